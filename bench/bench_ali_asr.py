@@ -0,0 +1,124 @@
+"""百炼asr首个识别结果延迟：每句话现场start一个Recognition vs 从预热池里借。
+
+服务端是进程内的aiohttp假DashScope websocket服务，按真实协议应答（run-task -> task-started，
+收到音频后出中间结果，finish-task -> task-finished），用--rtt-ms模拟到公网服务的往返：
+建连（tcp+tls+websocket升级）算3个往返，run-task和每个结果各1个往返。
+
+口径：说话开始（start/借出会话并发出第一块音频）-> 收到第一个中间结果。
+
+    python bench/bench_ali_asr.py --trials 20 --rtt-ms 40
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp import web, WSMsgType
+import dashscope
+from dashscope.audio.asr import RecognitionCallback
+
+from lib.ali_asr import RecognitionPool, new_recognition
+
+PORT = 3903
+SAMPLE_RATE = 16000
+CHUNK = bytes(SAMPLE_RATE * 2 // 10)  # 100ms
+
+def event(name, task_id, payload):
+    return json.dumps({"header": {"event": name, "task_id": task_id}, "payload": payload})
+
+async def handle(request, rtt):
+    await asyncio.sleep(rtt * 3)
+    ws = web.WebSocketResponse()
+    await ws.prepare(request)
+    task_id = None
+    partial = False
+    async for msg in ws:
+        if msg.type == WSMsgType.BINARY:
+            if not partial:
+                partial = True
+                await asyncio.sleep(rtt)
+                await ws.send_str(event("result-generated", task_id,
+                                        {"output": {"sentence": {"text": "字", "begin_time": 0, "end_time": None}}}))
+            continue
+        if msg.type != WSMsgType.TEXT:
+            break
+        header = json.loads(msg.data)["header"]
+        if header["action"] == "run-task":
+            task_id = header["task_id"]
+            await asyncio.sleep(rtt)
+            await ws.send_str(event("task-started", task_id, {}))
+        elif header["action"] == "finish-task":
+            await ws.send_str(event("task-finished", task_id, {"output": {}}))
+            break
+    await ws.close()
+    return ws
+
+def run_server(rtt, ready):
+    async def main():
+        app = web.Application()
+        app.router.add_get("/", lambda request: handle(request, rtt))
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", PORT).start()
+        ready.set()
+        await asyncio.Event().wait()
+    asyncio.run(main())
+
+class FirstPartial(RecognitionCallback):
+    def __init__(self):
+        self.first = threading.Event()
+        self.time = None
+
+    def on_event(self, result):
+        if self.time is None and result.get_sentence().get("text"):
+            self.time = time.perf_counter()
+            self.first.set()
+
+def trial(pool):
+    callback = FirstPartial()
+    start = time.perf_counter()
+    if pool:
+        recognition = pool.acquire(callback)
+    else:
+        recognition = new_recognition(callback, SAMPLE_RATE, "pcm")
+        recognition.start()
+    # 按实时发音频，直到出第一个结果
+    while True:
+        recognition.send_audio_frame(CHUNK)
+        if callback.first.wait(0.1):
+            break
+    recognition.stop()
+    return (callback.time - start) * 1000
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trials", type=int, default=20)
+    parser.add_argument("--rtt-ms", type=float, default=40)
+    parser.add_argument("--gap", type=float, default=1.0, help="两句话之间的间隔秒数")
+    args = parser.parse_args()
+
+    ready = threading.Event()
+    threading.Thread(target=run_server, args=(args.rtt_ms / 1000, ready), daemon=True).start()
+    ready.wait()
+    dashscope.api_key = "bench"
+    dashscope.base_websocket_api_url = f"ws://127.0.0.1:{PORT}/"
+
+    print(f"{args.trials} utterances, rtt {args.rtt_ms}ms, {args.gap}s between utterances")
+    for name in ("cold", "pooled"):
+        pool = RecognitionPool(SAMPLE_RATE, "pcm", 2) if name == "pooled" else None
+        time.sleep(args.gap)
+        results = []
+        for _ in range(args.trials):
+            results.append(trial(pool))
+            time.sleep(args.gap)
+        results.sort()
+        print(f"  {name:6}: first partial p50 {statistics.median(results):6.1f}ms  "
+              f"p90 {results[int(len(results) * 0.9)]:6.1f}ms  max {results[-1]:6.1f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""问答缓存基准：查询耗时随缓存条数的变化，以及一段模拟的多设备提问流里的命中率。
+
+提问流从一组常见问题和它们的说法变体里按Zipf分布抽取（少数问题占大多数），
+夹杂只出现一次的长尾问题和换了关键字的"近似"问题（今天/明天、杭州/北京），
+后者命中就算错误命中。每个问题按调用的工具确定ttl，时间按每秒rate个请求推进。
+
+    python bench/bench_answer_cache.py --requests 20000 --rate 5
+"""
+import argparse
+import os
+import random
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from lib.answer_cache import AnswerCache
+
+# (说法变体, 调用的工具)
+QUESTIONS = [
+    (["现在几点", "现在几点了", "现在是几点", "帮我看一下现在几点"], ["time-get_current_time"]),
+    (["今天天气怎么样", "今天的天气怎么样", "今天天气怎么样啊"], ["amap-maps_weather"]),
+    (["明天天气怎么样", "明天的天气怎么样"], ["amap-maps_weather"]),
+    (["杭州今天下雨吗", "杭州今天会下雨吗"], ["amap-maps_weather"]),
+    (["北京今天下雨吗", "北京今天会下雨吗"], ["amap-maps_weather"]),
+    (["讲个笑话", "给我讲个笑话", "讲个笑话吧"], []),
+    (["音量调大一点", "把音量调大一点"], ["tts_volume"]),
+    (["播放一首歌", "随便播放一首歌"], ["mp3_online"]),
+    (["你是谁", "你是谁啊"], []),
+    (["今天星期几", "今天是星期几"], ["time-get_current_time"]),
+]
+
+def stream(n, rng):
+    weights = 1 / np.arange(1, len(QUESTIONS) + 1)
+    weights /= weights.sum()
+    for i in range(n):
+        if rng.random() < 0.3:
+            yield f"长尾问题{i}的内容是什么", [], None
+            continue
+        k = rng.choices(range(len(QUESTIONS)), weights)[0]
+        variants, tools = QUESTIONS[k]
+        yield rng.choice(variants), tools, k
+
+def lookup_cost(entries, runs=200):
+    cache = AnswerCache(max_entries=entries)
+    for i in range(entries):
+        _, flight = cache.get(f"第{i}个问题的答案是什么")
+        cache.finish(flight, "答案", [])
+    start = time.perf_counter()
+    for i in range(runs):
+        cache.peek(f"一个没有缓存过的问题{i}")
+    return (time.perf_counter() - start) / runs
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--rate", type=float, default=5, help="所有设备每秒的请求数")
+    parser.add_argument("--entries", type=int, nargs="*", default=[256, 1024, 4096])
+    args = parser.parse_args()
+
+    for entries in args.entries:
+        print(f"  lookup with {entries:5} entries: {lookup_cost(entries) * 1e6:7.1f}us")
+
+    rng = random.Random(0)
+    cache = AnswerCache()
+    now = [1000.0]
+    time.time = lambda: now[0]
+    answers = {}
+    hits = wrong = 0
+    with open(os.devnull, "w") as devnull:
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            for text, tools, k in stream(args.requests, rng):
+                now[0] += 1 / args.rate
+                answer, flight = cache.get(text)
+                if answer is not None:
+                    hits += 1
+                    wrong += answers.get(answer) != k
+                    continue
+                answer = f"答案{len(answers)}"
+                answers[answer] = k
+                if flight:
+                    cache.finish(flight, answer, tools)
+        finally:
+            sys.stdout = stdout
+    print(f"{args.requests} requests @ {args.rate}/s: hit rate {hits / args.requests:.1%}, "
+          f"llm calls saved {hits}, wrong hits {wrong}")
+
+if __name__ == "__main__":
+    main()
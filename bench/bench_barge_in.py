@@ -0,0 +1,150 @@
+"""打断延迟：设备在播放长回复时开口，到收到FLUSH、旧音频停止下发的时间。
+
+桩llm/tts按实时速度的若干倍产生音频，和真实tts一样在每个chunk之间检查取消。
+
+    python bench/bench_barge_in.py --barge-in-ms 300
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.protocol import HEADER, Request, Response
+from bench_server import StubASR, make_speech, FRAME_BYTES, SAMPLE_RATE
+
+class StreamingLLM:
+    def __init__(self, tts):
+        self.tts = tts
+        self.cancelled = threading.Event()
+
+    def is_local(self):
+        return True
+
+    def call(self, text):
+        self.cancelled.clear()
+        self.tts.cancelled.clear()
+        self.tts.call(text)
+
+    def cancel(self):
+        self.cancelled.set()
+        self.tts.cancelled.set()
+
+class StreamingTTS:
+    """24kHz音频，按speed倍实时速度产出，共seconds秒"""
+    def __init__(self, seconds, speed):
+        self.conn = None
+        self.seconds = seconds
+        self.speed = speed
+        self.cancelled = threading.Event()
+
+    def is_local(self):
+        return True
+
+    def call(self, text):
+        chunk = bytes(4096)
+        interval = len(chunk) / 2 / 24000 / self.speed
+        for _ in range(int(self.seconds * 24000 * 2 / len(chunk))):
+            if self.cancelled.is_set():
+                return
+            self.conn.send(chunk, False)
+            time.sleep(interval)
+
+def session(config, seconds, speed):
+    from main import Connection
+    client, server = socket.socketpair()
+    tts = StreamingTTS(seconds, speed)
+    llm = StreamingLLM(tts)
+    asr = StubASR(llm)
+    conn = Connection(server, asr, llm, tts, config=config)
+    tts.conn = conn
+
+    def serve():
+        try:
+            while conn.recv_into_decoder(4096):
+                conn.process()
+        except OSError:
+            pass
+    threading.Thread(target=serve, daemon=True).start()
+    return client, conn
+
+def send_pcm(client, pcm, eof, realtime):
+    frame_time = FRAME_BYTES / 2 / SAMPLE_RATE
+    for i in range(0, len(pcm), FRAME_BYTES):
+        chunk = pcm[i:i + FRAME_BYTES]
+        last = eof and i + FRAME_BYTES >= len(pcm)
+        client.sendall(HEADER.pack(Request.MAGIC, Request.PCM_FORMAT, last, 0, len(chunk)) + chunk)
+        if realtime:
+            time.sleep(frame_time)
+
+def run_once(config, seconds, speed):
+    client, conn = session(config, seconds, speed)
+    # 声明设备支持打断，否则服务端不会发FLUSH
+    hello = json.dumps({"barge_in": True}).encode("utf-8")
+    client.sendall(HEADER.pack(Request.MAGIC, Request.HELLO, 0, 0, len(hello)) + hello)
+    # 第一句：唤醒并提问
+    send_pcm(client, make_speech(2), True, False)
+
+    got_audio = threading.Event()
+    flushed = {}
+    def reader():
+        audio_after_flush = 0
+        while True:
+            header = client.recv(HEADER.size, socket.MSG_WAITALL)
+            if not header:
+                break
+            _, type, eof, _, length = HEADER.unpack(header)
+            if length:
+                client.recv(length, socket.MSG_WAITALL)
+            if type == Response.PCM_DATA and length:
+                got_audio.set()
+                if "time" in flushed:
+                    audio_after_flush += 1
+            elif type == Response.FLUSH:
+                flushed["time"] = time.perf_counter()
+        flushed["audio_after"] = audio_after_flush
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+
+    got_audio.wait()
+    time.sleep(0.5)
+    # 播放中用户开口，按实时速度上传直到收到FLUSH
+    start = time.perf_counter()
+    speech = make_speech(3)
+    for i in range(0, len(speech), FRAME_BYTES):
+        if "time" in flushed:
+            break
+        send_pcm(client, speech[i:i + FRAME_BYTES], False, True)
+    time.sleep(0.3)
+    conn.close()
+    client.close()
+    thread.join(1)
+    return (flushed["time"] - start) * 1000 if "time" in flushed else None, flushed.get("audio_after", 0)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--barge-in-ms", type=int, default=300)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--reply-seconds", type=float, default=20)
+    parser.add_argument("--speed", type=float, default=4, help="tts产出速度相对实时的倍数")
+    args = parser.parse_args()
+
+    config = {"main": {"kws": "hellohello", "barge_in_ms": args.barge_in_ms}}
+    latencies = []
+    for _ in range(args.runs):
+        latency, audio_after = run_once(config, args.reply_seconds, args.speed)
+        if latency is None:
+            print("no FLUSH received")
+            continue
+        latencies.append(latency)
+        print(f"speech start -> FLUSH: {latency:.0f}ms, stale audio frames after FLUSH: {audio_after}")
+    if latencies:
+        print(f"median {statistics.median(latencies):.0f}ms "
+              f"(includes {args.barge_in_ms}ms of speech needed to trigger barge-in)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""音频编码基准：每路音频的带宽、每秒音频的编解码CPU时间和信噪比。
+
+上行16kHz（设备->服务端，服务端解码），下行24kHz（服务端编码->设备），
+帧大小和线上一致：上行60ms一帧，下行按tts分片100ms一帧。
+
+    python bench/bench_codec.py --seconds 30
+"""
+import argparse
+import os
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from lib import codec
+
+def make_audio(seconds, sample_rate):
+    """带包络的多谐波信号加少量噪声，幅度接近真实语音"""
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    f0 = 140 + 40 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / sample_rate
+    voice = sum(np.sin(k * phase) / k for k in range(1, 8))
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 3 * t) ** 2
+    noise = np.random.default_rng(0).normal(0, 0.02, t.size)
+    pcm = (voice * envelope + noise) * 6000
+    return np.clip(pcm, -32768, 32767).astype('<i2').tobytes()
+
+def split(pcm, frame_ms, sample_rate):
+    size = sample_rate * frame_ms // 1000 * 2
+    return [pcm[i:i + size] for i in range(0, len(pcm), size)]
+
+def snr(ref, out):
+    ref = np.frombuffer(ref, dtype='<i2').astype(np.float64)
+    out = np.frombuffer(out, dtype='<i2').astype(np.float64)[:ref.size]
+    err = np.sum((ref - out) ** 2)
+    return float('inf') if err == 0 else 10 * np.log10(np.sum(ref ** 2) / err)
+
+def run(name, seconds, sample_rate, frame_ms):
+    pcm = make_audio(seconds, sample_rate)
+    frames = split(pcm, frame_ms, sample_rate)
+    encoder, decoder = codec.create(name), codec.create(name)
+
+    start = time.process_time()
+    encoded = [encoder.encode(f) for f in frames]
+    encode_time = time.process_time() - start
+
+    start = time.process_time()
+    decoded = b''.join(bytes(decoder.decode(e)) for e in encoded)
+    decode_time = time.process_time() - start
+
+    kbps = sum(len(e) for e in encoded) * 8 / seconds / 1000
+    return kbps, encode_time / seconds * 1000, decode_time / seconds * 1000, snr(pcm, decoded)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=30)
+    args = parser.parse_args()
+
+    for direction, sample_rate, frame_ms in (("uplink", 16000, 60), ("downlink", 24000, 100)):
+        print(f"{direction} {sample_rate}Hz, {frame_ms}ms/frame")
+        print(f"  {'codec':6} {'kbps':>8} {'saved':>6} {'enc ms/s':>9} {'dec ms/s':>9} {'SNR dB':>7}")
+        base = None
+        for name in ("pcm", "ulaw", "adpcm"):
+            kbps, enc, dec, quality = run(name, args.seconds, sample_rate, frame_ms)
+            base = base or kbps
+            print(f"  {name:6} {kbps:8.1f} {1 - kbps / base:6.0%} {enc:9.2f} {dec:9.2f} {quality:7.1f}")
+
+if __name__ == "__main__":
+    main()
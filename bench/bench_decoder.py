@@ -0,0 +1,111 @@
+"""请求帧解码微基准：旧的bytes拼接解码 vs FrameDecoder，单位MB/s。
+
+两边都走完整路径：解帧 -> 累积pending_pcm -> 按pcm_chunk_size切块交给asr。
+
+    python bench/bench_decoder.py --mb 64
+"""
+import argparse
+import os
+import random
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.protocol import HEADER, Request, FrameDecoder
+
+PCM_CHUNK_SIZE = 9600 * 2
+
+class LegacyDecoder:
+    """baseline中Connection.process/process_pcm的解码逻辑"""
+    DECODE_HEADER = 0
+    DECODE_PAYLOAD = 1
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.payload = b''
+        self.request = None
+        self.decode_state = LegacyDecoder.DECODE_HEADER
+        self.pending_pcm = b''
+
+    def process(self, data):
+        self.payload += data
+        while len(self.payload) > 0:
+            if self.decode_state == LegacyDecoder.DECODE_HEADER:
+                if len(self.payload) < Request.HEADER_SIZE:
+                    return
+                self.request = Request.from_bytes(self.payload[:Request.HEADER_SIZE])
+                self.decode_state = LegacyDecoder.DECODE_PAYLOAD
+            else:
+                if len(self.payload) < Request.HEADER_SIZE + self.request.length:
+                    return
+                self.request.data = self.payload[Request.HEADER_SIZE:Request.HEADER_SIZE + self.request.length]
+                self.payload = self.payload[Request.HEADER_SIZE + self.request.length:]
+                self.pending_pcm += self.request.data
+                if len(self.pending_pcm) >= PCM_CHUNK_SIZE:
+                    while len(self.pending_pcm) > 0:
+                        self.sink(self.pending_pcm[0:PCM_CHUNK_SIZE])
+                        self.pending_pcm = self.pending_pcm[PCM_CHUNK_SIZE:]
+                self.request = None
+                self.decode_state = LegacyDecoder.DECODE_HEADER
+
+class ZeroCopyDecoder:
+    """与Connection.process/process_pcm相同的路径"""
+    def __init__(self, sink):
+        self.sink = sink
+        self.decoder = FrameDecoder()
+        self.pending_pcm = bytearray()
+
+    def process(self, data):
+        self.decoder.feed(data)
+        for req in self.decoder.frames():
+            self.pending_pcm += req.data
+            if len(self.pending_pcm) >= PCM_CHUNK_SIZE:
+                with memoryview(self.pending_pcm) as pcm:
+                    for i in range(0, len(pcm), PCM_CHUNK_SIZE):
+                        with pcm[i:i + PCM_CHUNK_SIZE] as frame:
+                            self.sink(frame)
+                self.pending_pcm.clear()
+
+def make_stream(total, frame_size):
+    payload = os.urandom(frame_size)
+    frame = HEADER.pack(Request.MAGIC, Request.PCM_FORMAT, 0, 0, frame_size) + payload
+    return frame * (total // len(frame))
+
+def split(stream, recv_size, burst):
+    # 模拟socket读：平时recv_size一块，偶尔一次读到一大段积压数据
+    rnd = random.Random(0)
+    chunks = []
+    i = 0
+    while i < len(stream):
+        size = burst if rnd.random() < 0.05 else recv_size
+        chunks.append(stream[i:i + size])
+        i += size
+    return chunks
+
+def run(cls, chunks):
+    received = [0]
+    def sink(frame):
+        received[0] += len(frame)
+    decoder = cls(sink)
+    start = time.perf_counter()
+    for chunk in chunks:
+        decoder.process(chunk)
+    return time.perf_counter() - start, received[0]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mb", type=int, default=64)
+    parser.add_argument("--frame", type=int, default=1024, help="设备每帧PCM字节数")
+    parser.add_argument("--recv", type=int, default=4096)
+    parser.add_argument("--burst", type=int, default=256 * 1024)
+    args = parser.parse_args()
+
+    stream = make_stream(args.mb * 1024 * 1024, args.frame)
+    chunks = split(stream, args.recv, args.burst)
+    mb = len(stream) / 1024 / 1024
+    for name, cls in (("legacy", LegacyDecoder), ("zero-copy", ZeroCopyDecoder)):
+        elapsed, received = run(cls, chunks)
+        print(f"{name:>10}: {mb / elapsed:8.1f} MB/s  ({received / 1024 / 1024:.1f} MB pcm to asr)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""音频处理基准：重采样和自动增益/噪声门的单核吞吐（输入样本/秒）和实时倍数。
+
+块大小和线上一致：上行120ms一块（vad阶段的粒度），下行100ms一块（tts分片）。
+单线程运行，吞吐即每核吞吐。
+
+    python bench/bench_dsp.py --seconds 60
+"""
+import argparse
+import os
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_codec import make_audio, split
+from lib import dsp
+
+CASES = [
+    # 名称, 处理器工厂, 输入采样率, 块毫秒
+    ("resample 16k->8k (cloud asr)", lambda: dsp.Resampler(16000, 8000), 16000, 120),
+    ("resample 24k->16k (device)", lambda: dsp.Resampler(24000, 16000), 24000, 100),
+    ("resample 24k->8k (device)", lambda: dsp.Resampler(24000, 8000), 24000, 100),
+    ("resample 24k->22.05k", lambda: dsp.Resampler(24000, 22050), 24000, 100),
+    ("agc+gate 16k", lambda: dsp.AGC(16000), 16000, 120),
+    ("agc+gate+resample 16k->8k", lambda: dsp.create(16000, {"agc": True}, 8000), 16000, 120),
+]
+
+def run(factory, seconds, sample_rate, frame_ms):
+    chunks = split(make_audio(seconds, sample_rate), frame_ms, sample_rate)
+    processor = factory()
+    start = time.process_time()
+    out = sum(len(processor.process(c)) for c in chunks)
+    cpu = time.process_time() - start
+    samples = seconds * sample_rate
+    return samples / cpu, seconds / cpu, out // 2
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=int, default=60)
+    args = parser.parse_args()
+    print(f"{args.seconds}s of audio per case")
+    for name, factory, sample_rate, frame_ms in CASES:
+        rate, realtime, out = run(factory, args.seconds, sample_rate, frame_ms)
+        print(f"  {name:28}: {rate / 1e6:6.2f}M samples/s per core, {realtime:7.0f}x realtime, "
+              f"{out} samples out")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""下行写出基准：逐帧sendall vs EgressWriter（按时间限速 / credit流控），
+统计每秒音频的写系统调用数和设备端缓冲峰值。
+
+模拟tts比实时快得多地产出4KB的pcm分片（24kHz），经egress阶段写到socketpair，
+另一端模拟设备按实时速度播放，记录任意时刻已收到但还没播放的音频时长；
+credit模式下设备每播完一帧就归还对应的credit。
+
+    python bench/bench_egress.py --seconds 5
+"""
+import argparse
+import os
+import queue
+import socket
+import sys
+import threading
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.egress import EgressWriter
+from lib.pipeline import Pipeline
+from lib.protocol import HEADER, Response
+
+SAMPLE_RATE = 24000
+CHUNK_SIZE = 4096
+WINDOW = 16384  # credit模式下设备的播放缓冲
+
+class CountingSocket:
+    def __init__(self, sock):
+        self.sock = sock
+        self.syscalls = 0
+
+    def sendall(self, data):
+        self.syscalls += 1
+        self.sock.sendall(data)
+
+    def sendmsg(self, buffers):
+        self.syscalls += 1
+        return self.sock.sendmsg(buffers)
+
+class LegacyWriter:
+    """baseline：每帧拼接头部后sendall"""
+    def __init__(self, sock):
+        self.sock = sock
+
+    def write(self, turn, resp, duration=0):
+        self.sock.sendall(resp.to_bytes())
+
+    def flush(self):
+        pass
+
+def player(buffered, writer):
+    """设备的播放线程：按实时速度播放，播完归还credit"""
+    while True:
+        length = buffered.get()
+        if length is None:
+            return
+        time.sleep(length / (SAMPLE_RATE * 2))
+        writer.grant(length)
+
+def device(sock, result, writer=None):
+    """接收音频并记录缓冲峰值"""
+    start = None
+    received = 0
+    peak = 0
+    buffered = queue.Queue()
+    if writer:
+        threading.Thread(target=player, args=(buffered, writer), daemon=True).start()
+    while True:
+        header = sock.recv(HEADER.size, socket.MSG_WAITALL)
+        if len(header) < HEADER.size:
+            break
+        _, type, eof, _, length = HEADER.unpack(header)
+        if length:
+            sock.recv(length, socket.MSG_WAITALL)
+            buffered.put(length)
+        if eof:
+            break
+        now = time.time()
+        start = start or now
+        received += length / (SAMPLE_RATE * 2)
+        peak = max(peak, received - (now - start))
+    buffered.put(None)
+    result["peak"] = peak
+
+def run(name, seconds):
+    a, b = socket.socketpair()
+    sock = CountingSocket(a)
+    writer = LegacyWriter(sock) if name == "legacy" else EgressWriter(sock, SAMPLE_RATE)
+    if name == "credit":
+        writer.set_window(WINDOW)
+    pipeline = Pipeline()
+    stage = pipeline.add_stage("egress", lambda turn, item: writer.write(turn, *item), 64, idle=writer.flush)
+    pipeline.start()
+    result = {}
+    t = threading.Thread(target=device, args=(b, result, writer if name == "credit" else None))
+    t.start()
+
+    pcm = bytes(CHUNK_SIZE)
+    start = time.time()
+    for _ in range(int(seconds * SAMPLE_RATE * 2 / CHUNK_SIZE)):
+        resp = Response()
+        resp.type = Response.PCM_DATA
+        resp.length = len(pcm)
+        resp.data = pcm
+        stage.put((resp, len(pcm) / (SAMPLE_RATE * 2)), pipeline.turn)
+    end = Response()
+    end.eof = 1
+    stage.put((end, 0), pipeline.turn)
+    t.join()
+    elapsed = time.time() - start
+    pipeline.stop()
+    a.close()
+    b.close()
+    return sock.syscalls / seconds, result["peak"], elapsed
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+    print(f"{args.seconds}s of {SAMPLE_RATE}Hz audio in {CHUNK_SIZE}-byte chunks")
+    for name in ("legacy", "paced", "credit"):
+        per_second, peak, elapsed = run(name, args.seconds)
+        print(f"  {name:6}: {per_second:5.1f} writes/s of audio, device buffer peak {peak * 1000:6.0f}ms, "
+              f"sent in {elapsed:.2f}s")
+
+if __name__ == "__main__":
+    main()
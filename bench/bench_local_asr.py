@@ -0,0 +1,112 @@
+"""本地asr传输基准：每块19200字节pcm的客户端开销，逐块新建连接的base64 json POST
+vs keep-alive POST vs websocket流式。
+
+服务端是进程内的aiohttp假服务，只解析请求、不做识别，测的是传输和编解码本身。
+
+    python bench/bench_local_asr.py --chunks 200
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import sys
+import threading
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp import web, WSMsgType
+import requests
+
+PORT = 3902
+os.environ["LOCAL_ASR_API"] = f"http://127.0.0.1:{PORT}"
+from lib.local_asr import ASR
+
+CHUNK_SIZE = 9600 * 2
+UTTERANCE_CHUNKS = 10
+
+async def handle_asr(request):
+    body = await request.json()
+    base64.b64decode(body["pcm"])
+    return web.Response(text="字" if body["is_finish"] else "")
+
+async def handle_stream(request):
+    ws = web.WebSocketResponse()
+    await ws.prepare(request)
+    async for msg in ws:
+        if msg.type == WSMsgType.TEXT and json.loads(msg.data).get("is_finish"):
+            await ws.send_str(json.dumps({"text": "字", "is_final": True}))
+    return ws
+
+def run_server(ready):
+    async def main():
+        app = web.Application(client_max_size=1 << 24)
+        app.router.add_post("/asr", handle_asr)
+        app.router.add_get("/asr/stream", handle_stream)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", PORT).start()
+        ready.set()
+        await asyncio.Event().wait()
+    asyncio.run(main())
+
+class Sink:
+    def __init__(self):
+        self.results = 0
+
+    def call(self, text):
+        self.results += 1
+
+class LegacyASR:
+    """baseline：每块一次requests.post，新建连接"""
+    def __init__(self, llm, sample_rate):
+        self.llm = llm
+        self.sample_rate = sample_rate
+
+    def send_audio_frame(self, data, is_finish=False):
+        resp = requests.post(f"{ASR.LOCAL_ASR_API}/asr", json={
+            "pcm": base64.b64encode(data).decode("utf-8"),
+            "sample_rate": self.sample_rate,
+            "is_finish": is_finish
+        })
+        if is_finish:
+            self.llm.call(resp.text)
+
+    def close(self):
+        pass
+
+def run(name, chunks):
+    sink = Sink()
+    if name == "legacy":
+        asr = LegacyASR(sink, 16000)
+    else:
+        asr = ASR(sink, 16000, stream=(name == "websocket"))
+    pcm = bytes(CHUNK_SIZE)
+    # 预热：建立长连接
+    asr.send_audio_frame(pcm, True)
+    start, cpu = time.perf_counter(), time.process_time()
+    for i in range(chunks):
+        asr.send_audio_frame(pcm, (i + 1) % UTTERANCE_CHUNKS == 0)
+    wall, cpu = time.perf_counter() - start, time.process_time() - cpu
+    asr.close()
+    assert sink.results == chunks // UTTERANCE_CHUNKS + 1
+    return wall / chunks * 1000, cpu / chunks * 1000
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=200)
+    args = parser.parse_args()
+
+    ready = threading.Event()
+    threading.Thread(target=run_server, args=(ready,), daemon=True).start()
+    ready.wait()
+
+    wire = {"legacy": len(base64.b64encode(bytes(CHUNK_SIZE))), "keep-alive": len(base64.b64encode(bytes(CHUNK_SIZE))),
+            "websocket": CHUNK_SIZE}
+    print(f"{args.chunks} chunks of {CHUNK_SIZE} bytes, {UTTERANCE_CHUNKS} chunks per utterance")
+    for name in ("legacy", "keep-alive", "websocket"):
+        wall, cpu = run(name, args.chunks)
+        print(f"  {name:10}: {wall:6.2f}ms/chunk, client cpu {cpu:6.2f}ms/chunk, payload {wire[name]} bytes/chunk")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""短句音频缓存基准：命中时从mmap取出第一包音频的耗时，以及按字节预算做LRU淘汰时的命中率。
+
+短句按Zipf分布抽取（问候、唤醒应答、工具确认等少数句子占大多数），每句的音频长度按
+每个字ms_per_char毫秒的24kHz 16bit pcm估计；未命中时写入缓存。
+
+    python bench/bench_phrase_cache.py --budget-mb 4 --phrases 2000 --requests 50000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from lib.phrase_cache import PhraseCache
+
+BYTES_PER_MS = 48  # 24kHz 16bit
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--budget-mb", type=float, nargs="*", default=[1, 4, 16])
+    parser.add_argument("--phrases", type=int, default=2000, help="不同短句的数量")
+    parser.add_argument("--requests", type=int, default=50000)
+    parser.add_argument("--ms-per-char", type=float, default=220)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    lengths = [rng.randint(2, 20) for _ in range(args.phrases)]
+    weights = 1 / np.arange(1, args.phrases + 1)
+    requests = rng.choices(range(args.phrases), weights, k=args.requests)
+    audio = {n: bytes(int(n * args.ms_per_char) * BYTES_PER_MS) for n in set(lengths)}
+    total = sum(len(audio[n]) for n in lengths) / 1024 / 1024
+    print(f"{args.phrases} phrases, {total:.1f}MB of audio in total, {args.requests} requests (zipf)")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for budget in args.budget_mb:
+            cache = PhraseCache(os.path.join(tmp, f"{budget}.pcm"), budget_mb=budget, max_chars=20)
+            hits = 0
+            first = []
+            for k in requests:
+                start = time.perf_counter()
+                chunks = cache.read(str(k))
+                if chunks is None:
+                    cache.put(str(k), audio[lengths[k]])
+                    continue
+                next(chunks)
+                first.append(time.perf_counter() - start)
+                chunks.close()
+                hits += 1
+            print(f"  budget {budget:5.1f}MB: hit rate {hits / args.requests:6.1%}, "
+                  f"{len(cache.entries):5} phrases cached, first chunk p50 {np.median(first) * 1e6:5.1f}us "
+                  f"p99 {np.percentile(first, 99) * 1e6:5.1f}us")
+            cache.close()
+
+if __name__ == "__main__":
+    main()
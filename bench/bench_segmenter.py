@@ -0,0 +1,113 @@
+"""tts切段基准：固定攒满120字再合成 vs 按标点切段，比较首包音频时间和播放卡顿。
+
+按时间线模拟一轮回复：llm首字延迟后按chars_per_s吐字（每个token 1~3个字），
+切出的段依次交给单个tts线程（和LLM.call里的tts线程一致），每段首包延迟tts_first_ms，
+之后按实时率rtf合成，每个字ms_per_char毫秒的音频。播放从第一包音频开始连续进行，
+下一段的音频还没到就算卡顿。
+
+口径：first audio为llm请求到第一包音频；stall为播放中间的卡顿总时长。
+
+    python bench/bench_segmenter.py --chars-per-s 30 --tts-first-ms 300
+"""
+import argparse
+import os
+import random
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from lib.segmenter import Segmenter
+
+REPLIES = [
+    "好的，今天杭州天气晴，气温在18到26度之间，空气质量优。明天有小雨，出门记得带伞！"
+    "后天转晴，比较适合出门游玩，可以去西湖边走走，或者去灵隐寺看看。",
+    "这个问题挺有意思的。简单来说，光在真空中的速度大约是每秒30万公里，"
+    "也就是说，从太阳发出的光大概需要8分20秒才能到达地球。所以我们看到的太阳，其实是8分钟之前的样子。",
+    "没问题，我给你讲个冷笑话：有一天，小明问爸爸，为什么大海是蓝色的？爸爸想了想说，"
+    "因为海里的鱼一直在吐泡泡，blue，blue，blue。小明听完沉默了三秒钟。",
+    "已经为你设置好了明天早上7:30的闹钟。另外提醒一下，你明天上午10点有一个会议，"
+    "地点在三楼的大会议室，记得提前准备好PPT。还有什么需要我帮忙的吗？",
+]
+
+def fixed_segments(events, threshold=120):
+    """原来的做法：攒够threshold个字才送tts，最后剩下的一起送"""
+    done, text = 0, ""
+    for t, token in events:
+        text += token
+        if len(text) - done > threshold:
+            yield t, text[done:]
+            done = len(text)
+    if done < len(text):
+        yield events[-1][0], text[done:]
+
+def punctuation_segments(events, first_min, max_len):
+    segmenter = Segmenter(first_min, max_len)
+    for t, token in events:
+        for segment in segmenter.feed(token):
+            yield t, segment
+    rest = segmenter.flush()
+    if rest:
+        yield events[-1][0], rest
+
+def token_events(text, args, rng):
+    t = args.llm_first_ms / 1000
+    events = []
+    i = 0
+    while i < len(text):
+        n = rng.randint(1, 3)
+        events.append((t, text[i:i + n]))
+        t += n / args.chars_per_s
+        i += n
+    return events
+
+def play(segments, args):
+    """返回(首包时间, 卡顿总时长, 段数)"""
+    tts_free = 0
+    playing_until = None
+    first_audio = None
+    stall = 0
+    count = 0
+    for emit, segment in segments:
+        count += 1
+        duration = len(segment) * args.ms_per_char / 1000
+        start = max(emit, tts_free)
+        audio = start + args.tts_first_ms / 1000
+        tts_free = audio + duration * args.tts_rtf
+        if first_audio is None:
+            first_audio = audio
+            playing_until = audio
+        stall += max(0, audio - playing_until)
+        playing_until = max(audio, playing_until) + duration
+    return first_audio, stall, count
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--llm-first-ms", type=float, default=400)
+    parser.add_argument("--chars-per-s", type=float, default=30)
+    parser.add_argument("--tts-first-ms", type=float, default=300)
+    parser.add_argument("--tts-rtf", type=float, default=0.3, help="合成耗时/音频时长")
+    parser.add_argument("--ms-per-char", type=float, default=220)
+    parser.add_argument("--first-min", type=int, default=4)
+    parser.add_argument("--max-len", type=int, default=120)
+    parser.add_argument("--runs", type=int, default=50, help="每条回复随机切token的次数")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    results = {"fixed 120": [], "punctuation": []}
+    for _ in range(args.runs):
+        for reply in REPLIES:
+            events = token_events(reply, args, rng)
+            results["fixed 120"].append(play(fixed_segments(events), args))
+            results["punctuation"].append(play(punctuation_segments(events, args.first_min, args.max_len), args))
+
+    print(f"{len(REPLIES)} replies x {args.runs} runs, {np.mean([len(r) for r in REPLIES]):.0f} chars avg, "
+          f"llm first token {args.llm_first_ms:.0f}ms @ {args.chars_per_s:.0f} chars/s, "
+          f"tts first audio {args.tts_first_ms:.0f}ms rtf {args.tts_rtf}")
+    for name, rows in results.items():
+        first, stall, count = (np.array(col) for col in zip(*rows))
+        print(f"  {name:12}: first audio p50 {np.median(first) * 1000:6.0f}ms  p90 {np.percentile(first, 90) * 1000:6.0f}ms  "
+              f"stall avg {stall.mean() * 1000:5.0f}ms  segments avg {count.mean():4.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""asyncio服务端压测：N个模拟设备并发推送PCM，统计每核可承载的实时会话数。
+
+asr/llm/tts用进程内桩代替，只衡量服务端自身的协议处理和调度开销。
+
+    python bench/bench_server.py --sessions 32 --seconds 10
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from lib.protocol import HEADER, Request
+
+SAMPLE_RATE = 16000
+FRAME_BYTES = 1920  # 60ms 16bit pcm
+
+def make_speech(seconds):
+    # 调幅的谐波+噪声，webrtcvad会判定为语音
+    t = np.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    rng = np.random.default_rng(0)
+    sig = (np.sin(2 * np.pi * 220 * t) * 0.3 + np.sin(2 * np.pi * 440 * t) * 0.2) * (0.5 + 0.5 * np.sin(2 * np.pi * 4 * t))
+    sig += rng.normal(0, 0.05, len(t))
+    return (sig * 12000).astype(np.int16).tobytes()
+
+class StubASR:
+    def __init__(self, llm):
+        self.llm = llm
+        self.frames = 0
+
+    def set_llm(self, llm):
+        self.llm = llm
+
+    def is_local(self):
+        return True
+
+    def stop(self):
+        pass
+
+    def close(self):
+        pass
+
+    def send_audio_frame(self, data, is_finish=False):
+        self.frames += 1
+        if is_finish:
+            self.llm.call(f"stub text {self.frames}")
+
+    def convert_text(self, data):
+        return "hellohello"
+
+class StubLLM:
+    def __init__(self, tts):
+        self.tts = tts
+
+    def is_local(self):
+        return True
+
+    def call(self, text):
+        self.tts.call(text)
+
+    def cancel(self):
+        pass
+
+class StubTTS:
+    PCM = bytes(4096)
+    FRAMES = 8
+
+    def __init__(self):
+        self.conn = None
+
+    def is_local(self):
+        return True
+
+    def set_connection(self, conn):
+        self.conn = conn
+
+    def call(self, text):
+        for _ in range(StubTTS.FRAMES):
+            self.conn.send(StubTTS.PCM, False)
+
+def stub_connection(s, config):
+    from main import Connection
+    tts = StubTTS()
+    llm = StubLLM(tts)
+    asr = StubASR(llm)
+    conn = Connection(s, asr, llm, tts, config=config)
+    tts.set_connection(conn)
+    return conn
+
+def run_server(port, workers, ready, stop, result):
+    from main import serve
+
+    config = {"main": {"host": "127.0.0.1", "port": port, "kws": "hellohello", "workers": workers}}
+
+    async def run():
+        task = asyncio.create_task(serve(config, stub_connection))
+        await asyncio.sleep(0.5)
+        ready.set()
+        await asyncio.get_running_loop().run_in_executor(None, stop.wait)
+        task.cancel()
+
+    start = time.process_time()
+    try:
+        asyncio.run(run())
+    except asyncio.CancelledError:
+        pass
+    result.put(time.process_time() - start)
+
+async def device(port, pcm, speed):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    frame_time = FRAME_BYTES / 2 / SAMPLE_RATE
+    start = time.perf_counter()
+    for i in range(0, len(pcm), FRAME_BYTES):
+        chunk = pcm[i:i + FRAME_BYTES]
+        eof = 1 if i + FRAME_BYTES >= len(pcm) else 0
+        writer.write(HEADER.pack(Request.MAGIC, Request.PCM_FORMAT, eof, 0, len(chunk)) + chunk)
+        await writer.drain()
+        if speed > 0:
+            delay = start + (i // FRAME_BYTES + 1) * frame_time / speed - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+    # 等待服务端的结束帧和桩tts的全部音频
+    eof_received, audio_frames = False, 0
+    while not eof_received or audio_frames < StubTTS.FRAMES:
+        header = await reader.readexactly(HEADER.size)
+        _, _, eof, _, length = HEADER.unpack(header)
+        await reader.readexactly(length)
+        if eof and length == 0:
+            eof_received = True
+        elif length:
+            audio_frames += 1
+    writer.close()
+
+async def run_devices(port, sessions, pcm, speed):
+    await asyncio.gather(*[device(port, pcm, speed) for _ in range(sessions)])
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--speed", type=float, default=0, help="相对实时的倍速，0表示不限速")
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--port", type=int, default=3900)
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    ready, stop, result = ctx.Event(), ctx.Event(), ctx.Queue()
+    server = ctx.Process(target=run_server, args=(args.port, args.workers, ready, stop, result))
+    server.start()
+    ready.wait()
+
+    pcm = make_speech(args.seconds)
+    start = time.perf_counter()
+    try:
+        asyncio.run(run_devices(args.port, args.sessions, pcm, args.speed))
+    except BaseException:
+        server.terminate()
+        raise
+    wall = time.perf_counter() - start
+    stop.set()
+    cpu = result.get()
+    server.join()
+
+    audio = args.sessions * args.seconds
+    print(f"sessions: {args.sessions}, audio: {audio:.0f}s, wall: {wall:.2f}s, server cpu: {cpu:.2f}s")
+    print(f"audio processed: {audio / wall:.1f}x realtime")
+    print(f"realtime sessions per core: {audio / cpu:.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""回复流解析基准：每次更新都对完整回复做re.sub和typewriter_print（原来的做法）
+vs 增量解析ResponseParser，比较一轮回复的解析CPU时间随长度的增长。
+
+模拟qwen_agent的输出：先是一段<think>，然后是正文，每次更新追加tokens_per_update个token
+（每个token 1~3个字），每次产出完整的累计消息列表。打印输出到/dev/null。
+
+    python bench/bench_stream_parser.py --lengths 500 2000 8000
+"""
+import argparse
+import contextlib
+import os
+import random
+import re
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qwen_agent.llm.schema import ASSISTANT
+from qwen_agent.utils.output_beautify import typewriter_print
+
+from lib.stream_parser import ResponseParser
+
+def make_updates(length, tokens_per_update, rng):
+    text = "<think>" + "让我想一想这个问题应该怎么回答。" * 5 + "</think>\n\n"
+    body = "".join(rng.choice("今天天气很好适合出门我们一起去公园散步吧，。") for _ in range(length))
+    full = text + body
+    updates = []
+    i = 0
+    while i < len(full):
+        for _ in range(tokens_per_update):
+            i += rng.randint(1, 3)
+        updates.append([{"role": ASSISTANT, "content": full[:i]}])
+    return updates, body
+
+def baseline(updates):
+    """原来LLM.call里的逻辑"""
+    fulltext = ""
+    plain = ""
+    for response in updates:
+        plain = typewriter_print(response, plain)
+        msg = response[-1]
+        if msg["role"] == ASSISTANT and msg.get("content"):
+            text = msg["content"]
+            if text.startswith("<think>") and "</think>" not in text:
+                fulltext = ""
+                continue
+            cleaned = re.sub(r"<think>.*?</think>", "", text, flags=re.DOTALL).strip()
+            if not cleaned:
+                continue
+            fulltext += cleaned[len(fulltext):]
+    return fulltext
+
+def incremental(updates):
+    parser = ResponseParser()
+    spoken = "".join(parser.feed(response) for response in updates)
+    return spoken + parser.flush()
+
+def measure(fn, updates):
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.process_time()
+        out = fn(updates)
+        return time.process_time() - start, out
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lengths", type=int, nargs="*", default=[500, 2000, 8000, 20000])
+    parser.add_argument("--tokens-per-update", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(0)
+    print(f"{args.tokens_per_update} token(s) per update")
+    for length in args.lengths:
+        updates, body = make_updates(length, args.tokens_per_update, rng)
+        base, base_out = measure(baseline, updates)
+        inc, inc_out = measure(incremental, updates)
+        assert base_out == inc_out == body.strip()
+        print(f"  {length:6} chars, {len(updates):5} updates: baseline {base * 1000:8.1f}ms/turn, "
+              f"incremental {inc * 1000:6.1f}ms/turn ({base / inc:5.1f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""空闲监听时vad的CPU开销：baseline的整块重扫 vs 增量Vad。
+
+模拟设备在安静/嘈杂房间里持续上传音频，kws每600ms判断一次是否有语音。
+输出每秒音频耗费的CPU时间，以及单核可承载的空闲会话数。
+
+    python bench/bench_vad.py --seconds 600
+"""
+import argparse
+import os
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import webrtcvad
+
+from main import Vad
+
+SAMPLE_RATE = 16000
+CHUNK = 9600 * 2
+
+class LegacyVad:
+    """baseline的Vad.is_speech"""
+    def __init__(self, sample_rate=16000, frame_duration_ms=30, threshold=0.1):
+        self.sample_rate = sample_rate
+        self.frame_duration_ms = frame_duration_ms
+        self.threshold = threshold
+        self.vad = webrtcvad.Vad()
+        self.vad.set_mode(2)
+
+    def is_speech(self, pcm_data):
+        frame_size = int(self.sample_rate * self.frame_duration_ms / 1000) * 2
+        frames = [pcm_data[i:i+frame_size] for i in range(0, len(pcm_data), frame_size)]
+        speech_frames = 0
+        for frame in frames:
+            if len(frame) < frame_size:
+                continue
+            if self.vad.is_speech(frame, sample_rate=self.sample_rate):
+                speech_frames += 1
+        return speech_frames / len(frames) >= self.threshold
+
+def make_room(seconds, noise, speech_every):
+    rng = np.random.default_rng(0)
+    n = int(SAMPLE_RATE * seconds)
+    sig = rng.normal(0, noise, n)
+    if speech_every:
+        t = np.arange(SAMPLE_RATE) / SAMPLE_RATE
+        burst = (np.sin(2 * np.pi * 220 * t) * 0.3 + np.sin(2 * np.pi * 440 * t) * 0.2) * 12000
+        for start in range(0, n - SAMPLE_RATE, int(SAMPLE_RATE * speech_every)):
+            sig[start:start + SAMPLE_RATE] += burst
+    return np.clip(sig, -32768, 32767).astype(np.int16).tobytes()
+
+def run(vad, pcm, device_frame=1024):
+    # 设备帧大小与kws块大小不对齐，和线上一样先攒块再判断
+    pending = bytearray()
+    hits = 0
+    start = time.process_time()
+    for i in range(0, len(pcm), device_frame):
+        pending += pcm[i:i + device_frame]
+        if len(pending) >= CHUNK:
+            chunk, pending = pending, bytearray()
+            hits += bool(vad.is_speech(chunk))
+    return time.process_time() - start, hits
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=600)
+    args = parser.parse_args()
+
+    rooms = (("quiet room", 20, 0), ("noisy room", 300, 0), ("occasional speech", 20, 10))
+    for room, noise, speech_every in rooms:
+        pcm = make_room(args.seconds, noise, speech_every)
+        print(f"{room}:")
+        for name, vad in (("legacy", LegacyVad()), ("incremental", Vad())):
+            cpu, hits = run(vad, pcm)
+            per_second = cpu / args.seconds * 1e6
+            print(f"  {name:>11}: {per_second:7.1f} us cpu per audio second, "
+                  f"{args.seconds / cpu:8.0f} idle sessions per core, {hits} speech chunks")
+
+if __name__ == "__main__":
+    main()
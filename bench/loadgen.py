@@ -0,0 +1,298 @@
+"""端到端压测：N个模拟ESP32设备按bee帧协议对服务端说话，统计每轮延迟分位数、吞吐和服务端资源。
+
+服务端在子进程里跑main.serve，asr/llm/tts换成可配置延迟和速率的进程内桩，离线可用。
+每个设备：（可选）HELLO协商编码 -> 每轮按实时或倍速发送一段语音，后面跟静音让服务端
+端点检测生效，最后一帧带eof -> 接收回复音频直到收齐桩tts这一轮应产出的时长，
+其间持续上传静音。
+
+延迟口径（设备侧时钟）：
+    first audio  最后一帧语音发出 -> 收到第一帧回复音频
+    reply        最后一帧语音发出 -> 回复音频收齐（含egress按播放速度限速）
+
+    python bench/loadgen.py --devices 16 --turns 3
+    python bench/loadgen.py --devices 64 --speed 4 --audio a.wav b.wav --codec adpcm
+"""
+import argparse
+import asyncio
+import functools
+import json
+import multiprocessing
+import os
+import queue
+import resource
+import sys
+import threading
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from bench_server import make_speech
+from lib import codec
+from lib.protocol import HEADER, Request, Response
+from lib.wakeword import load_pcm
+
+SAMPLE_RATE = 16000
+FRAME_BYTES = 1920      # 60ms 16bit pcm
+TTS_SAMPLE_RATE = 24000
+TTS_CHUNK = 4096
+
+class StubASR:
+    def __init__(self, llm, latency_ms):
+        self.llm = llm
+        self.latency = latency_ms / 1000
+        self.turns = 0
+
+    def set_llm(self, llm):
+        self.llm = llm
+
+    def is_local(self):
+        return True
+
+    def stop(self):
+        pass
+
+    def close(self):
+        pass
+
+    def send_audio_frame(self, data, is_finish=False):
+        if is_finish:
+            time.sleep(self.latency)
+            self.turns += 1
+            self.llm.call(f"stub question {self.turns}")
+
+    def convert_text(self, data):
+        # kws确认：直接判定为唤醒词
+        return "hellohello"
+
+class StubLLM:
+    """首字延迟后按chars_per_s吐字，每SEGMENT个字交给tts线程合成，和LLM.call的结构一致"""
+    SEGMENT = 20
+
+    def __init__(self, tts, first_token_ms, chars_per_s, reply_chars):
+        self.tts = tts
+        self.first_token = first_token_ms / 1000
+        self.chars_per_s = chars_per_s
+        self.reply_chars = reply_chars
+        self.cancelled = threading.Event()
+
+    def is_local(self):
+        return True
+
+    def cancel(self):
+        self.cancelled.set()
+        self.tts.cancelled.set()
+
+    def call(self, text):
+        self.cancelled.clear()
+        self.tts.cancelled.clear()
+        q = queue.Queue(8)
+
+        def tts_process():
+            while True:
+                segment = q.get()
+                if segment is None:
+                    break
+                self.tts.call(segment)
+
+        thread = threading.Thread(target=tts_process)
+        thread.start()
+        time.sleep(self.first_token)
+        done = 0
+        while done < self.reply_chars and not self.cancelled.is_set():
+            n = min(StubLLM.SEGMENT, self.reply_chars - done)
+            time.sleep(n / self.chars_per_s)
+            q.put("字" * n)
+            done += n
+        q.put(None)
+        thread.join()
+
+class StubTTS:
+    """首包延迟后按实时率rtf（合成耗时/音频时长）产出24kHz pcm，每个字ms_per_char毫秒"""
+    def __init__(self, first_audio_ms, rtf, ms_per_char):
+        self.conn = None
+        self.first_audio = first_audio_ms / 1000
+        self.rtf = rtf
+        self.ms_per_char = ms_per_char
+        self.cancelled = threading.Event()
+        t = np.arange(TTS_CHUNK // 2) / TTS_SAMPLE_RATE
+        self.pcm = (np.sin(2 * np.pi * 300 * t) * 8000).astype(np.int16).tobytes()
+
+    def is_local(self):
+        return True
+
+    def set_connection(self, conn):
+        self.conn = conn
+
+    def call(self, text):
+        time.sleep(self.first_audio)
+        remaining = reply_bytes(len(text), self.ms_per_char)
+        while remaining > 0 and not self.cancelled.is_set():
+            chunk = self.pcm[:min(TTS_CHUNK, remaining)]
+            time.sleep(len(chunk) / (TTS_SAMPLE_RATE * 2) * self.rtf)
+            self.conn.send(chunk, False)
+            remaining -= len(chunk)
+
+def reply_bytes(chars, ms_per_char):
+    return chars * ms_per_char * TTS_SAMPLE_RATE * 2 // 1000 // 2 * 2
+
+def stub_connection(s, config, args):
+    from main import Connection
+    tts = StubTTS(args.tts_first_audio_ms, args.tts_rtf, args.ms_per_char)
+    llm = StubLLM(tts, args.llm_first_token_ms, args.llm_chars_per_s, args.reply_chars)
+    asr = StubASR(llm, args.asr_latency_ms)
+    conn = Connection(s, asr, llm, tts, config=config)
+    tts.set_connection(conn)
+    return conn
+
+def run_server(args, ready, stop, result):
+    from main import serve
+
+    config = {"main": {"host": "127.0.0.1", "port": args.port, "kws": "hellohello", "workers": args.workers,
+                       "vad": {"endpoint_ms": args.endpoint_ms}}}
+
+    async def run():
+        task = asyncio.create_task(serve(config, functools.partial(stub_connection, args=args)))
+        await asyncio.sleep(0.5)
+        ready.set()
+        await asyncio.get_running_loop().run_in_executor(None, stop.wait)
+        task.cancel()
+
+    start = time.process_time()
+    try:
+        asyncio.run(run())
+    except asyncio.CancelledError:
+        pass
+    # Linux下ru_maxrss单位为KB
+    result.put((time.process_time() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+class Turn:
+    def __init__(self, expected):
+        self.expected = expected
+        self.speech_end = None
+        self.first_audio = None
+        self.received = 0
+        self.done = asyncio.Event()
+
+async def receive(reader, state):
+    decoders = {Response.AUDIO_TYPES[name]: codec.create(name) for name in codec.CODECS}
+    while True:
+        try:
+            header = await reader.readexactly(HEADER.size)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return
+        _, type, eof, _, length = HEADER.unpack(header)
+        data = await reader.readexactly(length) if length else b''
+        turn = state.get("turn")
+        if not turn or type not in decoders or not length:
+            continue
+        if turn.first_audio is None:
+            turn.first_audio = time.perf_counter()
+        turn.received += len(decoders[type].decode(data))
+        if turn.received >= turn.expected:
+            turn.done.set()
+
+async def send_pcm(writer, encoder, frame_type, pcm, speed, eof):
+    frame_time = FRAME_BYTES / 2 / SAMPLE_RATE
+    start = time.perf_counter()
+    for i in range(0, len(pcm), FRAME_BYTES):
+        chunk = encoder.encode(pcm[i:i + FRAME_BYTES])
+        last = eof and i + FRAME_BYTES >= len(pcm)
+        writer.write(HEADER.pack(Request.MAGIC, frame_type, 1 if last else 0, 0, len(chunk)) + chunk)
+        await writer.drain()
+        if speed > 0:
+            delay = start + (i // FRAME_BYTES + 1) * frame_time / speed - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+async def device(args, utterances, results):
+    reader, writer = await asyncio.open_connection("127.0.0.1", args.port)
+    state = {}
+    receiver = asyncio.create_task(receive(reader, state))
+    frame_type = {v: k for k, v in Request.AUDIO_FORMATS.items()}[args.codec]
+    encoder = codec.create(args.codec)
+    if args.codec != "pcm":
+        hello = json.dumps({"codecs": [args.codec]}).encode("utf-8")
+        writer.write(HEADER.pack(Request.MAGIC, Request.HELLO, 0, 0, len(hello)) + hello)
+    silence = bytes(SAMPLE_RATE * 2 * args.silence_ms // 1000)
+    expected = reply_bytes(args.reply_chars, args.ms_per_char)
+    try:
+        for i in range(args.turns):
+            turn = Turn(expected)
+            state["turn"] = turn
+            await send_pcm(writer, encoder, frame_type, utterances[i % len(utterances)], args.speed, False)
+            turn.speech_end = time.perf_counter()
+            await send_pcm(writer, encoder, frame_type, silence, args.speed, True)
+            # 等回复期间和真实设备一样持续上传麦克风静音，服务端收不到数据会超时断开
+            deadline = time.perf_counter() + args.timeout
+            while not turn.done.is_set() and time.perf_counter() < deadline:
+                await send_pcm(writer, encoder, frame_type, bytes(FRAME_BYTES), args.speed or 1, False)
+            if turn.done.is_set():
+                results.append((turn.first_audio - turn.speech_end, time.perf_counter() - turn.speech_end))
+            else:
+                results.append(None)
+    finally:
+        receiver.cancel()
+        writer.close()
+
+async def run_devices(args, utterances, results):
+    await asyncio.gather(*[device(args, utterances, results) for _ in range(args.devices)])
+
+def percentiles(values):
+    p50, p90, p99 = np.percentile(values, [50, 90, 99]) * 1000
+    return f"p50 {p50:6.0f}ms  p90 {p90:6.0f}ms  p99 {p99:6.0f}ms  max {max(values) * 1000:6.0f}ms"
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", type=int, default=16)
+    parser.add_argument("--turns", type=int, default=3, help="每个设备说几句话")
+    parser.add_argument("--audio", nargs="*", help="16kHz 16bit单声道wav/pcm，依次循环使用；默认合成2秒语音")
+    parser.add_argument("--speed", type=float, default=1, help="相对实时的倍速，0表示不限速")
+    parser.add_argument("--silence-ms", type=int, default=1000, help="每句话后的静音，需长于endpoint_ms")
+    parser.add_argument("--codec", default="pcm", choices=list(codec.CODECS))
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--endpoint-ms", type=int, default=600)
+    parser.add_argument("--asr-latency-ms", type=int, default=200)
+    parser.add_argument("--llm-first-token-ms", type=int, default=400)
+    parser.add_argument("--llm-chars-per-s", type=float, default=60)
+    parser.add_argument("--reply-chars", type=int, default=40)
+    parser.add_argument("--tts-first-audio-ms", type=int, default=150)
+    parser.add_argument("--tts-rtf", type=float, default=0.3, help="合成耗时/音频时长")
+    parser.add_argument("--ms-per-char", type=int, default=200, help="每个字的音频时长")
+    parser.add_argument("--workers", type=int, default=64)
+    parser.add_argument("--port", type=int, default=3901)
+    args = parser.parse_args()
+
+    utterances = [load_pcm(f) for f in args.audio] if args.audio else [make_speech(2)]
+
+    ctx = multiprocessing.get_context("spawn")
+    ready, stop, result = ctx.Event(), ctx.Event(), ctx.Queue()
+    server = ctx.Process(target=run_server, args=(args, ready, stop, result))
+    server.start()
+    ready.wait()
+
+    results = []
+    start = time.perf_counter()
+    try:
+        asyncio.run(run_devices(args, utterances, results))
+    except BaseException:
+        server.terminate()
+        raise
+    wall = time.perf_counter() - start
+    stop.set()
+    cpu, rss = result.get()
+    server.join()
+
+    ok = [r for r in results if r]
+    audio_in = sum(len(utterances[i % len(utterances)]) for i in range(args.turns)) * args.devices / (SAMPLE_RATE * 2)
+    print(f"devices {args.devices}, turns {len(results)} ({len(results) - len(ok)} timed out), "
+          f"codec {args.codec}, speed {args.speed}x, wall {wall:.1f}s")
+    if ok:
+        print(f"first audio: {percentiles([r[0] for r in ok])}")
+        print(f"reply:       {percentiles([r[1] for r in ok])}")
+    print(f"throughput: {len(ok) / wall:.2f} turns/s, speech in {audio_in / wall:.1f}s/s, "
+          f"reply audio out {len(ok) * args.reply_chars * args.ms_per_char / 1000 / wall:.1f}s/s")
+    print(f"server: cpu {cpu:.2f}s ({cpu / wall:.0%} of one core, {cpu / max(len(ok), 1) * 1000:.1f}ms/turn), "
+          f"peak rss {rss:.0f}MB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import asyncio
+import threading
+import time
+from qwen_agent.tools import TOOL_REGISTRY, MCPManager
+
+class AgentPool:
+    """进程内共享的Agent工具池，服务启动时初始化，所有会话共用。
+
+    Assistant每次构造时会把function_list里的mcpServers配置重新初始化一遍（启动uvx子进程、
+    连sse），代价在秒级。这里启动时按server逐个初始化一次，得到的mcp工具对象（按client_id
+    找MCPManager里的连接，本身无状态）直接作为BaseTool交给各会话的Assistant，不再重复连接。
+    注册表里的工具（web_search、绑定asr/llm/tts的配置工具等）构造很便宜，code_interpreter
+    还有会话自己的状态，仍然每个会话单独实例化。
+
+    后台每health_interval秒ping一次各mcp连接，断了（子进程退出、sse超时）就重连；
+    启动时连接失败的server也在这里重试。
+    """
+    def __init__(self, tools, health_interval=30, timeout=10):
+        self.servers = {}
+        self.registry = []
+        for item in tools:
+            if isinstance(item, dict) and "mcpServers" in item:
+                self.servers.update(item["mcpServers"])
+            else:
+                self.registry.append(item)
+        self.health_interval = health_interval
+        self.timeout = timeout
+        self.clients = {}  # server名 -> MCPManager里的client_id
+        self.mcp_tools = {}  # server名 -> [BaseTool]
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        start = time.perf_counter()
+        for name in self.servers:
+            self._connect(name)
+        count = sum(len(tools) for tools in self.mcp_tools.values())
+        print(f"--- AGENT POOL: {count} mcp tools from {len(self.mcp_tools)}/{len(self.servers)} servers "
+              f"ready in {time.perf_counter() - start:.2f}s (paid once at startup instead of on every device's first turn) ---")
+        self.thread = threading.Thread(target=self._run, name="agent-pool", daemon=True)
+        self.thread.start()
+
+    def _connect(self, name):
+        start = time.perf_counter()
+        try:
+            tools = MCPManager().initConfig({"mcpServers": {name: self.servers[name]}})
+        except Exception as e:
+            print(f"--- AGENT POOL: mcp server {name} failed after {time.perf_counter() - start:.2f}s: {e!r} ---")
+            return False
+        with self.lock:
+            self.mcp_tools[name] = tools
+            if tools:
+                self.clients[name] = tools[0].client_id
+        print(f"--- AGENT POOL: mcp server {name}: {len(tools)} tools in {time.perf_counter() - start:.2f}s ---")
+        return True
+
+    def _ping(self, name):
+        manager = MCPManager()
+        client_id = self.clients.get(name)
+        client = manager.clients.get(client_id)
+        if client is None:
+            return False
+        try:
+            asyncio.run_coroutine_threadsafe(client.session.send_ping(), manager.loop).result(self.timeout)
+            return True
+        except Exception as e:
+            print(f"--- AGENT POOL: mcp server {name} ping failed: {e!r} ---")
+        try:
+            # 工具对象按client_id查连接，替换掉MCPManager里的client即可，工具不用重建
+            future = asyncio.run_coroutine_threadsafe(client.reconnect(), manager.loop)
+            manager.clients[client_id] = future.result(self.timeout)
+            print(f"--- AGENT POOL: mcp server {name} reconnected ---")
+            return True
+        except Exception as e:
+            print(f"--- AGENT POOL: mcp server {name} reconnect failed: {e!r} ---")
+            return False
+
+    def _run(self):
+        while not self.stop_event.wait(self.health_interval):
+            for name in self.servers:
+                if name in self.mcp_tools:
+                    self._ping(name)
+                elif self._connect(name):
+                    print(f"--- AGENT POOL: mcp server {name} is available now, new sessions will get its tools ---")
+
+    def tools(self, args=None):
+        """给一个会话的工具列表：共享的mcp工具，加上这个会话自己实例化的注册表工具。
+        args为绑定到会话的asr/llm/tts，传给需要它们的工具"""
+        with self.lock:
+            tools = [tool for server in self.mcp_tools.values() for tool in server]
+        for item in self.registry:
+            if isinstance(item, dict):
+                name, cfg = item["name"], item
+                if args is not None and "args" in item:
+                    cfg = dict(item, args=args)
+            else:
+                name, cfg = item, None
+            try:
+                tools.append(TOOL_REGISTRY[name](cfg))
+            except Exception as e:
+                # 例如code_interpreter需要docker，缺了它其他工具照常可用
+                print(f"--- AGENT POOL: tool {name} unavailable: {e!r} ---")
+        return tools
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def load_agent_pool(config, tools):
+    """整个进程共用一个，第一次调用时连接所有mcp server；参数来自config["llm"]["agent_pool"]"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            cfg = (config or {}).get("llm", {}).get("agent_pool") or {}
+            _pool = AgentPool(tools, **cfg)
+            _pool.start()
+        return _pool
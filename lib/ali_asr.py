@@ -2,6 +2,8 @@ import dashscope
 from dashscope.audio.asr import *
 import queue
 import threading
+import time
+from collections import deque
 
 # Real-time speech recognition callback
 class Callback(RecognitionCallback):
@@ -36,6 +38,8 @@ class Callback(RecognitionCallback):
                     'RecognitionCallback sentence end, request_id:%s, usage:%s'
                     % (result.get_request_id(), result.get_usage(sentence)))
                 self.text += sentence['text']
+            if hasattr(self.llm, "partial"):
+                self.llm.partial(self.text if eof else self.text + sentence['text'])
 
 class SyncCallback(RecognitionCallback):
     def __init__(self, queue):
@@ -58,49 +62,164 @@ class SyncCallback(RecognitionCallback):
                     % (result.get_request_id(), result.get_usage(sentence)))
                 self.text += sentence['text']
 
+def new_recognition(callback, sample_rate, format_pcm):
+    return Recognition(
+        model='paraformer-realtime-v2',
+        # 'paraformer-realtime-v1'、'paraformer-realtime-8k-v1'
+        format=format_pcm,
+        # 'pcm'、'wav'、'opus'、'speex'、'aac'、'amr', you can check the supported formats in the document
+        sample_rate=sample_rate,
+        # support 8000, 16000
+        semantic_punctuation_enabled=False,
+        callback=callback)
+
+class PooledCallback(RecognitionCallback):
+    """池中会话的回调：借出前结果丢弃，借出后转给使用者的callback"""
+    def __init__(self):
+        self.target = None
+        self.alive = True
+
+    def on_complete(self) -> None:
+        self.alive = False
+        if self.target:
+            self.target.on_complete()
+
+    def on_error(self, message) -> None:
+        self.alive = False
+        if self.target:
+            self.target.on_error(message)
+
+    def on_close(self) -> None:
+        self.alive = False
+        if self.target:
+            self.target.on_close()
+
+    def on_event(self, result: RecognitionResult) -> None:
+        if self.target:
+            self.target.on_event(result)
+
+class RecognitionPool:
+    """预先start好的Recognition会话池，所有连接共用。
+
+    Recognition.start()只是起一个线程，websocket握手和run-task在后台进行，音频在握手完成前
+    排队，所以不预热时第一句话的识别结果要多等一次握手。池里的会话提前start，借出时直接发音频；
+    用完stop后会话就结束了，不能复用，后台线程随即补一个新的。
+    sdk在23秒没有音频时会自己结束会话，空闲超过MAX_IDLE的会话提前回收。
+    """
+    MAX_IDLE = 15
+    pools = {}
+    pools_lock = threading.Lock()
+
+    @staticmethod
+    def get(sample_rate, format_pcm, size):
+        with RecognitionPool.pools_lock:
+            key = (sample_rate, format_pcm)
+            if key not in RecognitionPool.pools:
+                RecognitionPool.pools[key] = RecognitionPool(sample_rate, format_pcm, size)
+            return RecognitionPool.pools[key]
+
+    def __init__(self, sample_rate, format_pcm, size=2):
+        self.sample_rate = sample_rate
+        self.format_pcm = format_pcm
+        self.size = size
+        self.idle = deque()  # [(start时间, recognition, PooledCallback)]，左边最老
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        if size > 0:
+            threading.Thread(target=self._run, name="asr-pool", daemon=True).start()
+
+    def _start(self):
+        callback = PooledCallback()
+        recognition = new_recognition(callback, self.sample_rate, self.format_pcm)
+        recognition.start()
+        return time.time(), recognition, callback
+
+    def acquire(self, callback):
+        """借出一个已经start的会话，结果交给callback；用完调用stop()即可"""
+        session = None
+        with self.lock:
+            while self.idle:
+                created, recognition, proxy = self.idle.popleft()
+                if proxy.alive and time.time() - created < RecognitionPool.MAX_IDLE:
+                    session = (recognition, proxy)
+                    break
+                self._retire(recognition, proxy)
+        self.wakeup.set()
+        if session is None:
+            # 池空了（或未开启）：现场start，和原来一样要等握手
+            recognition = new_recognition(callback, self.sample_rate, self.format_pcm)
+            recognition.start()
+            return recognition
+        recognition, proxy = session
+        proxy.target = callback
+        return recognition
+
+    def _retire(self, recognition, proxy):
+        # 结束一个没用上的会话，结果不转给任何人；stop要等服务端应答，放到线程里做
+        def stop():
+            try:
+                recognition.stop()
+            except Exception:
+                pass
+        if proxy.alive:
+            threading.Thread(target=stop, daemon=True).start()
+
+    def _run(self):
+        while True:
+            with self.lock:
+                while self.idle and (not self.idle[0][2].alive or
+                                     time.time() - self.idle[0][0] >= RecognitionPool.MAX_IDLE):
+                    _, recognition, proxy = self.idle.popleft()
+                    self._retire(recognition, proxy)
+                missing = self.size - len(self.idle)
+            for _ in range(missing):
+                try:
+                    session = self._start()
+                except Exception as e:
+                    print(f"asr pool: {e!r}")
+                    break
+                with self.lock:
+                    self.idle.append(session)
+            self.wakeup.wait(1)
+            self.wakeup.clear()
+
 class ASR:
-    def __init__(self, llm, sample_rate=8000, format_pcm='pcm'):
+    def __init__(self, llm, sample_rate=8000, format_pcm='pcm', pool_size=2):
         self.llm = llm
         self.sample_rate = sample_rate
         self.format_pcm = format_pcm
         self.callback = Callback(llm)
-
-        self.recognition = Recognition(
-            model='paraformer-realtime-v2',
-            # 'paraformer-realtime-v1'、'paraformer-realtime-8k-v1'
-            format=format_pcm,
-            # 'pcm'、'wav'、'opus'、'speex'、'aac'、'amr', you can check the supported formats in the document
-            sample_rate=sample_rate,
-            # support 8000, 16000
-            semantic_punctuation_enabled=False,
-            callback=self.callback)
-
         self.sync_queue = queue.Queue()
         self.sync_callback = SyncCallback(self.sync_queue)
-        self.sync_recognition = Recognition(
-            model='paraformer-realtime-v2',
-            # 'paraformer-realtime-v1'、'paraformer-realtime-8k-v1'
-            format=format_pcm,
-            # 'pcm'、'wav'、'opus'、'speex'、'aac'、'amr', you can check the supported formats in the document
-            sample_rate=sample_rate,
-            # support 8000, 16000
-            semantic_punctuation_enabled=False,
-            callback=self.sync_callback)
+        # 识别和kws确认都从共享的池里借预热好的会话
+        self.pool = RecognitionPool.get(sample_rate, format_pcm, pool_size)
+        self.recognition = None
+
+    def set_llm(self, llm):
+        self.llm = llm
+        self.callback.llm = llm
 
     def start(self):
-        self.recognition.start()
+        self.recognition = self.pool.acquire(self.callback)
     
     def stop(self):
-        self.recognition.stop()
+        recognition, self.recognition = self.recognition, None
+        if recognition:
+            recognition.stop()
+
+    def close(self):
+        if self.recognition:
+            self.stop()
 
     def send_audio_frame(self, data, is_finish=False):
         # send audio data to recognition service
-        self.recognition.send_audio_frame(data)
+        # sdk内部排队异步发送，data可能是连接缓冲区的视图，这里必须拷贝
+        self.recognition.send_audio_frame(bytes(data))
 
     def convert_text(self, data):
-        self.sync_recognition.start()
-        self.sync_recognition.send_audio_frame(data)
-        self.sync_recognition.stop()
+        recognition = self.pool.acquire(self.sync_callback)
+        recognition.send_audio_frame(bytes(data))
+        recognition.stop()
         return self.sync_queue.get()
 
 if __name__ == '__main__':
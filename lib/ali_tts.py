@@ -38,8 +38,7 @@ class TTS:
         self.config["tts"]["volume"] = volume
         self.volume = volume
 
-    def call(self, text):
-        from tts import adjust_volume
+    def stream(self, text):
         if not text:
             return
         response = dashscope.audio.qwen_tts.SpeechSynthesizer.call(
@@ -49,22 +48,26 @@ class TTS:
             voice=self.spk_id,#"Cherry",
             stream=True
         )
-        for chunk in response:
-            if not self.conn:
-                print(chunk)
-                continue
+        try:
+            for chunk in response:
+                try:
+                    audio_string = chunk["output"]["audio"]["data"]
+                except:
+                    continue
+                pcm_data = base64.b64decode(audio_string)
+                if len(pcm_data) == 0:
+                    continue
+                # print(f"Audio bytes length: {len(pcm_data)}", chunk["output"]["finish_reason"])
+                yield pcm_data
+        finally:
+            # 提前结束时关闭sdk的流式响应
+            response.close()
 
-            try:
-                audio_string = chunk["output"]["audio"]["data"]
-            except:
-                continue
-            pcm_data = base64.b64decode(audio_string)
-            if len(pcm_data) == 0:
-                continue
-            pcm_data = adjust_volume(pcm_data, self.volume)
-            # print(f"Audio bytes length: {len(pcm_data)}", chunk["output"]["finish_reason"])
-            self.conn.send(pcm_data, False)
+    def cancel(self):
+        # sdk的流无法从其他线程打断，由调用方在下一个chunk到达时停止迭代
+        pass
 
 if __name__ == "__main__":
     tts = TTS(None)
-    tts.call("你是谁？")
\ No newline at end of file
+    for pcm_data in tts.stream("你是谁？"):
+        print(len(pcm_data))
\ No newline at end of file
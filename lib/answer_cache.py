@@ -0,0 +1,188 @@
+import re
+import threading
+import time
+import zlib
+import numpy as np
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import metrics
+import speculative
+
+# 依赖上下文的追问（"那明天呢"、"再讲一个"），答案因人因对话而异，不缓存
+FOLLOW_UP = re.compile(r"[它他她]|这个|那个|这些|那些|刚才|上面|前面|继续|再|还有|然后|呢$|^那")
+# 归一化时去掉的语气词和客套话
+FILLERS = re.compile(r"请|麻烦|帮我|给我|一下|[呀啊吧哦嘛了吗]")
+# 多出来的字里有否定词或数字时意思就变了（"我不开心"、"第11个"）
+MEANINGFUL = re.compile(r"[不没别非未无零一二三四五六七八九十百千万两0-9a-z]")
+
+def normalize(text):
+    """在speculative.normalize的基础上再去掉语气词"""
+    return FILLERS.sub("", speculative.normalize(text))
+
+def embed(text, dim):
+    """字的一元和二元组哈希到dim维（带符号），L2归一化；本地计算，不依赖向量模型"""
+    v = np.zeros(dim, dtype=np.float32)
+    grams = list(text) + [text[i:i + 2] for i in range(len(text) - 1)]
+    for gram in grams:
+        h = zlib.crc32(gram.encode("utf-8"))
+        v[h % dim] += 1 if h >> 31 else -1
+    norm = np.linalg.norm(v)
+    return v / norm if norm else v
+
+def _only_insertions(short, long, max_insert):
+    """long是在short里插入不超过max_insert个字得到的，例如"现在几点"和"现在是几点"；
+    换字（今天/明天、杭州/北京）和插入否定词、数字不算"""
+    if len(long) - len(short) > max_insert:
+        return False
+    i = 0
+    for c in long:
+        if i < len(short) and c == short[i]:
+            i += 1
+        elif MEANINGFUL.match(c):
+            return False
+    return i == len(short)
+
+class Flight:
+    """一个正在调用llm的问题，同样的问题等它的结果，不再重复调用"""
+    def __init__(self, key):
+        self.key = key
+        self.answer = None
+        self.done = threading.Event()
+
+class AnswerCache:
+    """进程内共享的问答缓存，所有设备共用。
+
+    问题先归一化（去标点、语气词），用字n-gram哈希向量在NumPy矩阵里找余弦相似度最高的几条，
+    再确认两者只差插入的几个字，才算命中，避免"今天天气"命中"明天天气"。
+    每条答案按回答时调用的工具确定有效期（ttl按工具名子串匹配，多个工具取最小，0表示不缓存），
+    有副作用的工具（调音量、放音乐等）默认不缓存。
+    同一个问题正在调用llm时，后来的请求等它的结果（single-flight），最多等wait秒。
+    """
+    DIM = 512
+    DEFAULT_TTL = {"none": 3600, "time": 30, "weather": 600, "web_search": 600, "web_extractor": 600, "default": 0}
+
+    def __init__(self, threshold=0.75, max_entries=4096, max_insert=3, wait=15, ttl=None):
+        self.threshold = threshold
+        self.max_insert = max_insert
+        self.wait = wait
+        self.ttl = dict(AnswerCache.DEFAULT_TTL, **(ttl or {}))
+        self.vectors = np.zeros((max_entries, AnswerCache.DIM), dtype=np.float32)
+        self.expires = np.zeros(max_entries)  # 0表示空位
+        self.keys = [None] * max_entries
+        self.answers = [None] * max_entries
+        self.created = np.zeros(max_entries)
+        self.slots = {}    # key -> 位置
+        self.flights = {}  # key -> Flight
+        self.lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.coalesced = 0
+
+    def ttl_for(self, tools):
+        if not tools:
+            return self.ttl["none"]
+        ttls = []
+        for tool in tools:
+            matched = [v for k, v in self.ttl.items() if k not in ("none", "default") and k in tool]
+            ttls.append(min(matched) if matched else self.ttl["default"])
+        return min(ttls)
+
+    def _lookup(self, key, now):
+        slot = self.slots.get(key)
+        if slot is not None and self.expires[slot] > now:
+            return slot, 1.0
+        sims = self.vectors @ embed(key, AnswerCache.DIM)
+        sims[self.expires <= now] = -1
+        top = np.argpartition(sims, -5)[-5:] if len(sims) > 5 else np.arange(len(sims))
+        for slot in top[np.argsort(sims[top])[::-1]]:
+            if sims[slot] < self.threshold:
+                break
+            other = self.keys[slot]
+            short, long = sorted((key, other), key=len)
+            if _only_insertions(short, long, self.max_insert):
+                return slot, float(sims[slot])
+        return None, 0
+
+    def peek(self, text):
+        key = normalize(text)
+        with self.lock:
+            return self._lookup(key, time.time())[0] is not None
+
+    def get(self, text):
+        """返回(缓存的答案或None, Flight或None)；拿到Flight的调用方负责调用llm并finish"""
+        key = normalize(text)
+        if not key or FOLLOW_UP.search(key):
+            metrics.ANSWER_CACHE_TURNS.inc(result="skip")
+            return None, None
+        now = time.time()
+        with self.lock:
+            self.lookups += 1
+            slot, sim = self._lookup(key, now)
+            if slot is not None:
+                self.hits += 1
+                answer = self.answers[slot]
+                self._report("hit", text, f"sim {sim:.2f}, age {now - self.created[slot]:.0f}s")
+                return answer, None
+            flight = self.flights.get(key)
+            if flight is None:
+                flight = self.flights[key] = Flight(key)
+                metrics.ANSWER_CACHE_TURNS.inc(result="miss")
+                return None, flight
+        # 另一个设备正在问同样的问题
+        if flight.done.wait(self.wait) and flight.answer is not None:
+            with self.lock:
+                self.coalesced += 1
+                self._report("coalesced", text, "waited for an in-flight request")
+            return flight.answer, None
+        metrics.ANSWER_CACHE_TURNS.inc(result="miss")
+        return None, None
+
+    def finish(self, flight, answer, tools):
+        """llm结束：answer为None表示失败或被打断，等待的请求各自去调用llm"""
+        ttl = self.ttl_for(tools) if answer else 0
+        with self.lock:
+            if self.flights.get(flight.key) is flight:
+                del self.flights[flight.key]
+            if ttl > 0:
+                self._put(flight.key, answer, ttl)
+        flight.answer = answer if ttl > 0 else None
+        flight.done.set()
+
+    def _put(self, key, answer, ttl):
+        now = time.time()
+        slot = self.slots.get(key)
+        if slot is None:
+            # 优先用空位或过期的位置，满了就替换最早过期的
+            slot = int(np.argmin(self.expires))
+            old = self.keys[slot]
+            if old is not None and self.slots.get(old) == slot:
+                del self.slots[old]
+            self.slots[key] = slot
+        self.vectors[slot] = embed(key, AnswerCache.DIM)
+        self.expires[slot] = now + ttl
+        self.created[slot] = now
+        self.keys[slot] = key
+        self.answers[slot] = answer
+
+    def _report(self, result, text, detail):
+        metrics.ANSWER_CACHE_TURNS.inc(result=result)
+        saved = self.hits + self.coalesced
+        print(f"--- ANSWER CACHE {result}: {text} ({detail}; hit rate {saved}/{self.lookups}, "
+              f"llm calls saved {saved}) ---")
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def load_answer_cache(config):
+    """按config["llm"]["cache"]创建，整个进程共用一个；没配置或配置为false时返回None，
+    只写cache:不带参数时用默认参数"""
+    global _cache
+    llm = (config or {}).get("llm", {})
+    if "cache" not in llm or llm["cache"] is False:
+        return None
+    cfg = llm["cache"]
+    with _cache_lock:
+        if _cache is None:
+            _cache = AnswerCache(**(cfg if isinstance(cfg, dict) else {}))
+        return _cache
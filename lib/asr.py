@@ -1,24 +1,88 @@
 import requests
 import sys
 import os
+import time
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from local_asr import ASR as localASR
 from ali_asr import ASR as aliASR
+import metrics
+from cassette import load_cassette
+from health import load_monitor, LOCAL, REMOTE
+import dsp
+
+class ResultSink:
+    """识别结果回调：统计最后一帧音频交给asr到拿到结果的耗时，录制时记下结果，再转给llm"""
+    def __init__(self, asr):
+        self.asr = asr
+
+    def call(self, text):
+        asr = self.asr
+        if asr.finish_time:
+            metrics.ASR_FINALIZE_SECONDS.time(asr.finish_time)
+            asr.health.record("asr", asr.provider, time.perf_counter() - asr.finish_time)
+            asr.finish_time = None
+        if asr.cassette and not asr.cassette.replaying:
+            # 相对这句话最后一帧的时间，一句话结束前就出的结果记为0
+            offset = time.perf_counter() - asr.utterance_end if asr.finished else 0
+            asr.cassette.record("asr", asr.utterance, [(offset, text)])
+        asr.llm.call(text)
+
+    def partial(self, text):
+        # 这句话到目前为止的中间结果
+        if self.asr.on_partial:
+            self.asr.on_partial(text)
 
 class ASR:
     def __init__(self, llm, config=None, sample_rate=16000, format_pcm='pcm'):
         self.llm = llm
+        self.sink = ResultSink(self)
+        self.on_partial = None
+        self.finish_time = None
         self.config = config
+        # 录制/回放：识别结果按这是第几句话对应
+        self.cassette = load_cassette(config)
+        self.utterance = 0
+        self.utterance_end = None
+        self.finished = False
         self.sample_rate = sample_rate
+        # 送给provider的采样率，和输入不同时重采样，例如百炼用8000可以省一半流量
+        self.provider_rate = self.config["asr"].get("sample_rate", sample_rate)
+        self.resampler = dsp.Resampler(sample_rate, self.provider_rate) if self.provider_rate != sample_rate else None
         self.format_pcm = format_pcm
+        self.pcm = bytearray()  # 当前这句话送给provider的音频，provider出错切换后重发
+        # 按健康监控缓存的状态选择provider，不再每个连接同步探测
+        self.health = load_monitor(config)
+        self.health.register("asr", ASR._detect_local)
+        # 首选的provider是会话自己的状态，set_provider只改这个会话，不写所有会话共用的config
         provider = self.config["asr"].get("provider", "")
-        if provider == "本地" and self._detect_local():
+        self.preferred = provider if provider in (LOCAL, REMOTE) else REMOTE
+        if self.health.choose("asr", self._preferred()) == LOCAL:
             self._init_local()
         else:
             self._init_bailian()
         self.asr_running = False
 
-    def _detect_local(self):
+    def _preferred(self):
+        return self.preferred
+
+    def _select(self):
+        """一句话开始前按健康状态切换provider，切换了返回True"""
+        provider = self.health.choose("asr", self._preferred())
+        if provider == self.provider:
+            return False
+        print(f"--- FAILOVER asr {self.provider} -> {provider} ---")
+        try:
+            self.close()
+        except Exception as e:
+            print(e)
+        if provider == LOCAL:
+            self._init_local()
+        else:
+            self._init_bailian()
+        return True
+
+    @staticmethod
+    def _detect_local():
         try:
             resp = requests.get(localASR.LOCAL_ASR_API_PING, timeout=0.5)
             return resp.status_code == 200
@@ -27,14 +91,20 @@ class ASR:
 
     def _init_local(self):
         self.provider = "本地"
-        self.asr = localASR(self.llm, self.sample_rate)
+        self.asr = localASR(self.sink, self.provider_rate, self.config["asr"].get("stream", True))
         print("use local asr")
 
     def _init_bailian(self):
         self.provider = "百炼"
-        self.asr = aliASR(self.llm, self.sample_rate, self.format_pcm)
+        self.asr = aliASR(self.sink, self.provider_rate, self.format_pcm, self.config["asr"].get("pool", 2))
         print("use ali asr")
 
+    def set_llm(self, llm):
+        self.llm = llm
+
+    def set_partial(self, on_partial):
+        self.on_partial = on_partial
+
     def get_provider(self):
         return self.provider
 
@@ -51,7 +121,7 @@ class ASR:
         else:
             raise ValueError(f"unsupported provider {provider}")
 
-        self.config["asr"]["provider"] = provider
+        self.preferred = provider
 
     def is_local(self):
         return self.provider == "本地"
@@ -68,11 +138,59 @@ class ASR:
         self.asr_running = False
         self.asr.stop()
 
+    def close(self):
+        # 连接断开：停止识别并释放provider的长连接
+        self.stop()
+        if hasattr(self.asr, "close"):
+            self.asr.close()
+
     def send_audio_frame(self, data, is_finish=False):
-        self.start()
-        self.asr.send_audio_frame(data, is_finish)
+        if self.finished:
+            self.utterance += 1
+            self.finished = False
         if is_finish:
+            self.finish_time = self.utterance_end = time.perf_counter()
+            self.finished = True
+        if self.cassette and self.cassette.replaying:
+            if is_finish:
+                self._replay_results()
+            return
+        if not self.asr_running:
+            self._select()
+        if self.resampler:
+            data = self.resampler.process(data)
+            if is_finish:
+                self.resampler.reset()
+        self.pcm += data
+        try:
+            self.start()
+            self.asr.send_audio_frame(data, is_finish)
+        except Exception:
+            # provider中途出错：记一次错误，能切换就把这句话从头发给新的provider
+            self.health.record_error("asr", self.provider)
+            self.asr_running = False
+            if not self._select():
+                self.pcm = bytearray()
+                raise
+            self.start()
+            self.asr.send_audio_frame(bytes(self.pcm), is_finish)
+        if is_finish:
+            self.pcm = bytearray()
             self.stop()
 
+    def _replay_results(self):
+        events = []
+        while True:
+            record = self.cassette.take("asr", self.utterance, exact=True)
+            if record is None:
+                break
+            events.extend((max(t, 0), text) for t, text in record)
+        for text in self.cassette.play(sorted(events, key=lambda e: e[0])):
+            self.sink.call(text)
+
     def convert_text(self, data):
+        if self.resampler:
+            data = dsp.Resampler(self.sample_rate, self.provider_rate).process(data)
+        if self.cassette:
+            return self.cassette.call("asr.convert_text", None, lambda: self.asr.convert_text(data))
         return self.asr.convert_text(data)
\ No newline at end of file
@@ -0,0 +1,179 @@
+import gzip
+import json
+import struct
+import threading
+import time
+from collections import deque
+
+HEADER = struct.Struct("<II")  # 一条记录的json长度、音频数据长度
+
+class Cassette:
+    """录制/回放provider的请求和响应流，让延迟测试可以离线复现。
+
+    每次交互记录为一条：HEADER + json + 音频数据。json为{"p": provider, "k": key, "e": [[t, value], ...]}，
+    t为相对请求开始的秒数。音频chunk在json里只记长度{"b": n}，数据原样按顺序接在json后面，不做base64；
+    文本和其他值（例如llm每次产出的是到目前为止完整的消息列表）序列化后只记和同类的上一个chunk
+    相比新增的部分：{"t"或"j": [公共前缀长度, 之后的文本]}，录制大小和回复长度成正比，不是平方。
+    文件是逐条追加的gzip（多member），录制中途退出也不会丢前面的记录。
+
+    回放时按(provider, key)取第一条没用过的记录，key对不上就按录制顺序取该provider的
+    下一条；按原始时间间隔除以speed产出，speed=0表示不等待。
+    """
+    RECORD = "record"
+    REPLAY = "replay"
+
+    def __init__(self, path, mode, speed=1.0):
+        if mode not in (Cassette.RECORD, Cassette.REPLAY):
+            raise ValueError(f"unsupported cassette mode {mode}")
+        self.path = path
+        self.mode = mode
+        self.speed = speed
+        self.lock = threading.Lock()
+        self.records = {}  # provider -> deque([(key, events)])
+        if mode == Cassette.REPLAY:
+            self._load()
+
+    @property
+    def replaying(self):
+        return self.mode == Cassette.REPLAY
+
+    def _load(self):
+        count = 0
+        with gzip.open(self.path, "rb") as f:
+            while True:
+                header = f.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    break
+                size, audio_size = HEADER.unpack(header)
+                rec = json.loads(f.read(size).decode("utf-8"))
+                events = _decode(rec["e"], memoryview(f.read(audio_size)))
+                self.records.setdefault(rec["p"], deque()).append((rec["k"], events))
+                count += 1
+        print(f"cassette: {count} records from {self.path}")
+
+    def record(self, provider, key, events):
+        encoded, audio = _encode(events)
+        data = json.dumps({"p": provider, "k": key, "e": encoded}, ensure_ascii=False).encode("utf-8")
+        with self.lock:
+            with gzip.open(self.path, "ab") as f:
+                f.write(HEADER.pack(len(data), len(audio)) + data + audio)
+
+    def take(self, provider, key=None, exact=False):
+        with self.lock:
+            records = self.records.get(provider)
+            if not records:
+                return None
+            for i, (k, events) in enumerate(records):
+                if k == key:
+                    del records[i]
+                    return events
+            if exact:
+                return None
+            if key is not None:
+                print(f"cassette: no {provider} record for {key!r}, using the next one")
+            return records.popleft()[1]
+
+    def play(self, events):
+        start = time.perf_counter()
+        for t, value in events:
+            if self.speed:
+                delay = start + t / self.speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            yield value
+
+    def stream(self, provider, key, factory):
+        """包装一个流式调用：录制时记下每个chunk的时间，回放时不调用factory"""
+        if self.replaying:
+            events = self.take(provider, key)
+            if events is None:
+                raise ValueError(f"cassette: {provider} exhausted")
+            yield from self.play(events)
+            return
+        events = []
+        start = time.perf_counter()
+        it = factory()
+        try:
+            for value in it:
+                events.append((time.perf_counter() - start, value))
+                yield value
+        finally:
+            if hasattr(it, "close"):
+                it.close()
+            # 被打断的流也记下来，回放时同样只产出这些
+            self.record(provider, key, events)
+
+    def call(self, provider, key, factory):
+        """包装一个同步调用"""
+        if self.replaying:
+            events = self.take(provider, key)
+            if events is None:
+                raise ValueError(f"cassette: {provider} exhausted")
+            return list(self.play(events))[-1]
+        start = time.perf_counter()
+        value = factory()
+        self.record(provider, key, [(time.perf_counter() - start, value)])
+        return value
+
+def _encode(events):
+    """返回(json里的events, 拼在一起的音频数据)"""
+    encoded = []
+    audio = bytearray()
+    previous = {"t": "", "j": ""}
+    for t, value in events:
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            audio += value
+            encoded.append([round(t, 4), {"b": len(value)}])
+            continue
+        kind = "t" if isinstance(value, str) else "j"
+        text = value if kind == "t" else json.dumps(value, ensure_ascii=False, default=_to_json)
+        n = _common_prefix(previous[kind], text)
+        previous[kind] = text
+        encoded.append([round(t, 4), {kind: [n, text[n:]]}])
+    return encoded, bytes(audio)
+
+def _decode(encoded, audio):
+    events = []
+    offset = 0
+    previous = {"t": "", "j": ""}
+    for t, value in encoded:
+        if "b" in value:
+            events.append((t, bytes(audio[offset:offset + value["b"]])))
+            offset += value["b"]
+            continue
+        kind = "t" if "t" in value else "j"
+        n, rest = value[kind]
+        text = previous[kind] = previous[kind][:n] + rest
+        events.append((t, text if kind == "t" else json.loads(text)))
+    return events
+
+def _common_prefix(a, b):
+    # 二分查找，比较在切片上做，不逐字循环
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+def _to_json(obj):
+    # qwen_agent的Message等pydantic对象
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    return str(obj)
+
+_cassette = None
+_cassette_lock = threading.Lock()
+
+def load_cassette(config):
+    """按config["main"]["cassette"]创建，整个进程共用一个；没配置时返回None"""
+    global _cassette
+    cfg = config.get("main", {}).get("cassette") if config else None
+    if not cfg:
+        return None
+    with _cassette_lock:
+        if _cassette is None:
+            _cassette = Cassette(cfg["path"], cfg.get("mode", Cassette.REPLAY), cfg.get("speed", 1.0))
+        return _cassette
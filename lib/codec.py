@@ -0,0 +1,155 @@
+import struct
+import numpy as np
+
+class PCMCodec:
+    name = "pcm"
+
+    def encode(self, pcm):
+        return pcm
+
+    def decode(self, data):
+        return data
+
+    def reset(self):
+        pass
+
+def _ulaw_tables():
+    # G.711 µ-law，编码表按int16的全部65536个取值预先算好，编解码都是一次查表
+    samples = np.arange(-32768, 32768, dtype=np.int32)
+    sign = (samples < 0).astype(np.int32) << 7
+    magnitude = np.minimum(np.abs(samples), 32635) + 0x84
+    exponent = np.clip(np.floor(np.log2(magnitude)).astype(np.int32) - 7, 0, 7)
+    mantissa = (magnitude >> (exponent + 3)) & 0x0F
+    codes = (~(sign | (exponent << 4) | mantissa) & 0xFF).astype(np.uint8)
+    encode = np.empty(65536, dtype=np.uint8)
+    encode[samples.astype(np.int16).view(np.uint16)] = codes
+
+    u = ~np.arange(256, dtype=np.int32) & 0xFF
+    exponent = (u >> 4) & 0x07
+    magnitude = (((u & 0x0F) << 3) + 0x84) << exponent
+    decode = np.where(u & 0x80, 0x84 - magnitude, magnitude - 0x84).astype(np.int16)
+    return encode, decode
+
+class ULawCodec:
+    name = "ulaw"
+    ENCODE_TABLE, DECODE_TABLE = _ulaw_tables()
+
+    def encode(self, pcm):
+        samples = np.frombuffer(pcm, dtype=np.uint16)
+        return ULawCodec.ENCODE_TABLE[samples].tobytes()
+
+    def decode(self, data):
+        return ULawCodec.DECODE_TABLE[np.frombuffer(data, dtype=np.uint8)].tobytes()
+
+    def reset(self):
+        pass
+
+class ADPCMCodec:
+    """IMA-ADPCM，4:1压缩。
+
+    每帧以4字节头（预测值int16、步长下标uint8、保留）开始，和WAV的IMA-ADPCM块一样
+    可以独立解码，打断丢帧后设备不会失步。编码时预测值依赖上一个样本，只能逐样本计算；
+    解码时步长下标序列逐个推出，差分量和累加用numpy向量化，只有累加越界时才逐样本限幅。
+    """
+    name = "adpcm"
+    HEADER = struct.Struct('<hBx')
+    INDEX_TABLE = [-1, -1, -1, -1, 2, 4, 6, 8, -1, -1, -1, -1, 2, 4, 6, 8]
+    STEP_TABLE = [
+        7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+        50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+        253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+        1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+        3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442, 11487,
+        12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794, 32767]
+    STEPS = np.array(STEP_TABLE, dtype=np.int32)
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.predictor = 0
+        self.index = 0
+        self.carry = b''  # 奇数个样本时留一个到下一帧
+
+    def encode(self, pcm):
+        pcm = self.carry + bytes(pcm)
+        if len(pcm) // 2 % 2:
+            pcm, self.carry = pcm[:-2], pcm[-2:]
+        else:
+            self.carry = b''
+        header = ADPCMCodec.HEADER.pack(self.predictor, self.index)
+        predictor, index = self.predictor, self.index
+        steps, index_table = ADPCMCodec.STEP_TABLE, ADPCMCodec.INDEX_TABLE
+        codes = bytearray(len(pcm) // 4)
+        for n, sample in enumerate(np.frombuffer(pcm, dtype=np.int16).tolist()):
+            step = steps[index]
+            diff = sample - predictor
+            code = 0
+            if diff < 0:
+                code = 8
+                diff = -diff
+            vpdiff = step >> 3
+            if diff >= step:
+                code |= 4
+                diff -= step
+                vpdiff += step
+            step >>= 1
+            if diff >= step:
+                code |= 2
+                diff -= step
+                vpdiff += step
+            step >>= 1
+            if diff >= step:
+                code |= 1
+                vpdiff += step
+            predictor = predictor - vpdiff if code & 8 else predictor + vpdiff
+            predictor = -32768 if predictor < -32768 else 32767 if predictor > 32767 else predictor
+            index += index_table[code]
+            index = 0 if index < 0 else 88 if index > 88 else index
+            if n & 1:
+                codes[n >> 1] |= code << 4
+            else:
+                codes[n >> 1] = code
+        self.predictor, self.index = predictor, index
+        return header + bytes(codes)
+
+    def decode(self, data):
+        if len(data) < ADPCMCodec.HEADER.size:
+            # 只带eof的空帧，或者连帧头都不完整
+            return b''
+        predictor, index = ADPCMCodec.HEADER.unpack_from(data)
+        packed = np.frombuffer(data, dtype=np.uint8, offset=ADPCMCodec.HEADER.size)
+        codes = np.empty(len(packed) * 2, dtype=np.int32)
+        codes[0::2] = packed & 0x0F
+        codes[1::2] = packed >> 4
+
+        indexes = np.empty(len(codes), dtype=np.int32)
+        index_table = ADPCMCodec.INDEX_TABLE
+        for n, code in enumerate(codes.tolist()):
+            indexes[n] = index
+            index += index_table[code]
+            index = 0 if index < 0 else 88 if index > 88 else index
+
+        step = ADPCMCodec.STEPS[indexes]
+        vpdiff = (step >> 3) + (codes & 4 > 0) * step + (codes & 2 > 0) * (step >> 1) + (codes & 1) * (step >> 2)
+        vpdiff = np.where(codes & 8, -vpdiff, vpdiff)
+        samples = predictor + np.cumsum(vpdiff)
+        if samples.min(initial=0) < -32768 or samples.max(initial=0) > 32767:
+            # 累加过程中发生了限幅，后面的预测值都受影响，只能逐个算
+            samples = samples.tolist()
+            for n, diff in enumerate(vpdiff.tolist()):
+                predictor = min(32767, max(-32768, predictor + diff))
+                samples[n] = predictor
+        return np.asarray(samples, dtype=np.int16).tobytes()
+
+CODECS = {codec.name: codec for codec in (ADPCMCodec, ULawCodec, PCMCodec)}
+
+def negotiate(offered, supported):
+    """按设备给出的优先顺序选第一个双方都支持的编码"""
+    for name in offered:
+        if name in supported and name in CODECS:
+            return name
+    return PCMCodec.name
+
+def create(name):
+    return CODECS[name]()
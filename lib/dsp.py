@@ -0,0 +1,126 @@
+from math import gcd
+import numpy as np
+
+def _kaiser_sinc(num_taps, cutoff, beta=8.0):
+    """低通原型滤波器，cutoff为相对采样率的截止频率（0~0.5）"""
+    n = np.arange(num_taps) - (num_taps - 1) / 2
+    return 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(num_taps, beta)
+
+class Resampler:
+    """流式有理数倍重采样（多相FIR），16bit单声道pcm进出。
+
+    src_rate/dst_rate约分成L/M：概念上先插L-1个零再低通再每M个取一个，实际只算需要输出的点，
+    每个输出点用L组系数中的一组和taps个输入样本做内积，整块向量化计算。
+    块之间保留taps-1个历史样本和下一个输出点的相位，切块方式不影响结果。
+    """
+    def __init__(self, src_rate, dst_rate, taps=16):
+        self.src_rate = src_rate
+        self.dst_rate = dst_rate
+        g = gcd(src_rate, dst_rate)
+        self.up, self.down = dst_rate // g, src_rate // g
+        self.taps = taps
+        # 截止频率取两个采样率中较低的奈奎斯特频率再留10%过渡带，增益乘L补偿插零
+        cutoff = 0.45 / max(self.up, self.down)
+        h = _kaiser_sinc(self.up * taps, cutoff) * self.up
+        # phases[p][j] = h[p + j*L]，和x[b - j]相乘
+        self.phases = h.reshape(taps, self.up).T.astype(np.float32)
+        self.reset()
+
+    def reset(self):
+        self.history = np.zeros(self.taps - 1, dtype=np.float32)
+        self.t = (self.taps - 1) * self.up  # 下一个输出点在插值网格上的位置，相对history开头
+
+    def process(self, pcm):
+        if self.up == self.down:
+            return bytes(pcm)
+        x = np.concatenate((self.history, np.frombuffer(pcm, dtype=np.int16).astype(np.float32)))
+        # 输出点t需要x[t//L - taps + 1 .. t//L]
+        end = len(x) * self.up
+        count = max(0, (end - 1 - self.t) // self.down + 1)
+        t = self.t + np.arange(count, dtype=np.int64) * self.down
+        base, phase = t // self.up, t % self.up
+        idx = base[:, None] - np.arange(self.taps)[None, :]
+        y = np.einsum("ij,ij->i", x[idx], self.phases[phase])
+        keep = self.taps - 1
+        self.t += count * self.down - (len(x) - keep) * self.up
+        self.history = x[len(x) - keep:]
+        return np.clip(np.rint(y), -32768, 32767).astype(np.int16).tobytes()
+
+class AGC:
+    """流式自动增益 + 噪声门，16bit单声道pcm进出。
+
+    按frame_ms分帧算rms：高于门限的帧把增益向target_dbfs靠拢（变小用attack，变大用release），
+    增益不超过max_gain_db；低于门限且超过hold_ms的帧按attack衰减到gate_gain，门重新打开时也用attack，
+    远场麦克风的小声说话被拉起来，静音段的底噪被压下去。
+    帧内增益在相邻帧之间线性插值，不会有阶跃；增益和门的状态跨块保留，不额外缓冲，没有延迟。
+    """
+    def __init__(self, sample_rate=16000, target_dbfs=-20, max_gain_db=20, gate_dbfs=-50,
+                 gate_gain=0.1, frame_ms=10, attack_ms=20, release_ms=400, hold_ms=200):
+        self.frame = sample_rate * frame_ms // 1000
+        self.target = 32768 * 10 ** (target_dbfs / 20)
+        self.max_gain = 10 ** (max_gain_db / 20)
+        self.gate = 32768 * 10 ** (gate_dbfs / 20)
+        self.gate_gain = gate_gain
+        self.attack = np.exp(-frame_ms / attack_ms)
+        self.release = np.exp(-frame_ms / release_ms)
+        self.hold_frames = hold_ms // frame_ms
+        self.reset()
+
+    def reset(self):
+        self.gain = 1.0
+        self.quiet = 0  # 连续低于门限的帧数
+
+    def process(self, pcm):
+        x = np.frombuffer(pcm, dtype=np.int16).astype(np.float32)
+        if not len(x):
+            return bytes(pcm)
+        ends = np.minimum(np.arange(1, (len(x) + self.frame - 1) // self.frame + 1) * self.frame, len(x))
+        starts = np.concatenate(([0], ends[:-1]))
+        # 每帧的均方用累加和一次算出
+        energy = np.concatenate(([0], np.cumsum(x.astype(np.float64) ** 2)))
+        rms = np.sqrt((energy[ends] - energy[starts]) / (ends - starts))
+        wanted = np.minimum(self.target / np.maximum(rms, 1), self.max_gain)
+        gains = np.empty(len(rms))
+        gain, quiet = self.gain, self.quiet
+        for i in range(len(rms)):
+            if rms[i] < self.gate:
+                quiet += 1
+                if quiet <= self.hold_frames:
+                    gains[i] = gain
+                    continue
+                target, coeff = self.gate_gain, self.attack
+            else:
+                # 门打开时用attack快速恢复，不吃掉字头
+                opening = quiet > self.hold_frames
+                quiet = 0
+                target = wanted[i]
+                coeff = self.attack if target < gain or opening else self.release
+            gain = target + (gain - target) * coeff
+            gains[i] = gain
+        g = np.interp(np.arange(len(x)), np.concatenate(([0], ends - 1)), np.concatenate(([self.gain], gains)))
+        self.gain, self.quiet = gain, quiet
+        return np.clip(np.rint(x * g), -32768, 32767).astype(np.int16).tobytes()
+
+class Chain:
+    """按顺序串起几个处理器，本身也是一个处理器，可以直接放进流水线阶段里用"""
+    def __init__(self, *processors):
+        self.processors = [p for p in processors if p]
+
+    def __bool__(self):
+        return bool(self.processors)
+
+    def reset(self):
+        for p in self.processors:
+            p.reset()
+
+    def process(self, pcm):
+        for p in self.processors:
+            pcm = p.process(pcm)
+        return pcm
+
+def create(sample_rate, config, out_rate=None):
+    """按配置创建处理链：{"agc": {...}}开启自动增益和噪声门，out_rate与sample_rate不同时最后重采样"""
+    config = config or {}
+    agc = config.get("agc")
+    return Chain(AGC(sample_rate, **(agc if isinstance(agc, dict) else {})) if agc else None,
+                 Resampler(sample_rate, out_rate) if out_rate and out_rate != sample_rate else None)
@@ -0,0 +1,181 @@
+import sys
+import os
+import threading
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from protocol import Response, PING
+from latency import now_us
+import metrics
+
+class EgressWriter:
+    """下行写出：合并小帧、按播放速度限速，一次sendmsg写出多帧的头和数据。
+
+    tts每4KB左右产生一个Response，逐帧sendall意味着每帧一次头部拼接和一次系统调用，
+    而且合成比播放快时会一口气把几秒音频灌进设备，超出ESP32的播放缓冲。
+    这里把帧攒成批（最多batch_ms的音频或MAX_FRAMES帧），设备端已缓冲的音频超过
+    lead_ms时先等待，再把整批的头和数据作为iovec交给一次sendmsg。
+    非音频帧不占播放时长，FLUSH帧立即发出。
+
+    设备在握手时声明了缓冲大小（set_window）后改为credit流控：音频数据只在credit
+    足够时发出，不够就先把已攒的帧写出再等设备grant，此时不再按时间限速。
+    写出线程等待时egress队列会满，背压一路传回tts/llm/ffmpeg，音频不会在内存里越积越多。
+    """
+    MAX_FRAMES = 64  # 每帧头和数据两个iovec，远低于IOV_MAX
+
+    def __init__(self, sock, sample_rate=24000, lead_ms=300, batch_ms=120, on_audio=None):
+        self.sock = sock
+        self.on_audio = on_audio   # on_audio(turn, t)：音频帧写出后回调
+        self.sample_rate = sample_rate
+        self.lead = lead_ms / 1000
+        self.batch = batch_ms / 1000
+        self.frames = []           # [(turn, resp, duration)]
+        self.duration = 0          # 攒下的音频时长（秒）
+        self.play_end = 0          # 已发出的音频在设备上预计播完的时刻
+        self.last_turn = None      # 最近发出的音频所属的轮次
+        self.window = 0
+        self.credit = None         # None表示设备不支持流控
+        self.closed = False
+        self.cond = threading.Condition()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.syscalls = 0
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.audio_sent = 0
+
+    def pcm_duration(self, pcm_len):
+        return pcm_len / (self.sample_rate * 2)
+
+    def write(self, turn, resp, duration=0):
+        self.frames.append((turn, resp, duration))
+        self.duration += duration
+        if resp.type == Response.FLUSH or self.duration >= self.batch or len(self.frames) >= EgressWriter.MAX_FRAMES:
+            self.flush()
+
+    def set_window(self, window):
+        with self.cond:
+            self.window = window
+            self.credit = window
+            self.cond.notify_all()
+
+    def grant(self, size):
+        with self.cond:
+            if self.credit is None:
+                return
+            self.credit += size
+            self.cond.notify_all()
+
+    def wakeup(self):
+        # 打断或关闭时唤醒等待credit的写出线程
+        with self.cond:
+            self.cond.notify_all()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.report()
+
+    def is_playing(self):
+        """设备上是否还有没播完的音频（按播放速度估计）"""
+        return self.last_turn is not None and not self.last_turn.is_cancelled() and time.time() < self.play_end
+
+    def _try_acquire(self, size):
+        with self.cond:
+            # 单帧比整个窗口还大时，等缓冲全空再发
+            if self.credit < min(size, self.window):
+                return False
+            self.credit -= size
+            return True
+
+    def _acquire(self, turn, size):
+        with self.cond:
+            while self.credit < min(size, self.window):
+                if self.closed or (turn and turn.is_cancelled()):
+                    return False
+                self.cond.wait(1.0)
+            self.credit -= size
+            return True
+
+    def _pace(self, frames):
+        # 设备缓冲里的音频超过lead时等待；等待期间这一轮被打断，帧会在发送前被丢弃
+        delay = self.play_end - self.lead - time.time()
+        turn = frames[-1][0]
+        if delay > 0 and turn:
+            turn.cancelled.wait(delay)
+        elif delay > 0:
+            time.sleep(delay)
+
+    def flush(self):
+        if not self.frames:
+            return
+        frames, self.frames = self.frames, []
+        duration, self.duration = self.duration, 0
+        if duration and self.credit is None:
+            self._pace(frames)
+
+        batch = []
+        for turn, resp, duration in frames:
+            if turn and turn.is_cancelled():
+                continue
+            if duration and self.credit is not None and not self._try_acquire(resp.length):
+                # 先把已经拿到credit的帧发出去，设备收到后才会归还credit
+                self._send(batch)
+                batch = []
+                if not self._acquire(turn, resp.length):
+                    continue
+            batch.append((turn, resp, duration))
+        self._send(batch)
+
+    def _send(self, batch):
+        if not batch:
+            return
+        buffers = []
+        for _, resp, _ in batch:
+            if resp.type == Response.PING:
+                # 真正写出时才打时间戳，排队和限速的时间不算进rtt
+                resp.data = PING.pack(now_us())
+                resp.length = PING.size
+            buffers.append(resp.header())
+            if resp.length:
+                buffers.append(resp.data)
+        self._sendmsg(buffers)
+
+        now = time.time()
+        duration = 0
+        for turn, resp, d in batch:
+            if resp.type == Response.FLUSH:
+                # 设备清空了播放缓冲
+                self.play_end = now
+            if d:
+                duration += d
+                self.last_turn = turn
+                if self.on_audio:
+                    self.on_audio(turn, now)
+        self.play_end = max(self.play_end, now) + duration
+        self.frames_sent += len(batch)
+        self.audio_sent += duration
+
+    def _sendmsg(self, buffers):
+        total = sum(len(b) for b in buffers)
+        self.bytes_sent += total
+        self.syscalls += 1
+        start = time.perf_counter()
+        if not hasattr(self.sock, "sendmsg"):
+            self.sock.sendall(b''.join(buffers))
+        else:
+            sent = self.sock.sendmsg(buffers)
+            if sent < total:
+                # 阻塞socket极少出现部分写，剩下的拼起来补发
+                self.syscalls += 1
+                self.sock.sendall(memoryview(b''.join(buffers))[sent:])
+        metrics.SEND_SECONDS.time(start)
+
+    def report(self):
+        # 只有控制帧（结束帧、PING）时没有可报告的合并和限速
+        if self.syscalls and self.audio_sent:
+            per_second = self.syscalls / self.audio_sent
+            print(f"--- EGRESS: {self.frames_sent} frames, {self.bytes_sent} bytes, {self.syscalls} writes for "
+                  f"{self.audio_sent:.1f}s audio ({per_second:.1f} writes/s) ---")
+        self.reset_stats()
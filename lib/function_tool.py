@@ -1,6 +1,6 @@
 import json
 import os
-from queue import Empty, Queue
+from queue import Empty, Full, Queue
 import random
 import re
 import threading
@@ -207,6 +207,7 @@ class MP3Online(BaseTool):
         'description': '要播放音乐时传入这个参数，这个参数值是一个url必须来自`query`方法返回的结果，根据输入的url播放对应歌曲',
         'required': False
     }]
+    PCM_QUEUE_SIZE = 8  # ffmpeg输出最多预读8个4KB块
 
     def __init__(self, config):
         super().__init__(config)
@@ -313,28 +314,43 @@ class MP3Online(BaseTool):
                 bufsize=1024 * 64
             )
 
-            output_queue = Queue()
+            # 有界队列：下行发不出去时读线程阻塞，ffmpeg写满管道后也随之暂停解码
+            output_queue = Queue(MP3Online.PCM_QUEUE_SIZE)
             stop_flag = threading.Event()
+            closed = threading.Event()
+
+            def input_writer():
+                try:
+                    process.stdin.write(mp3_binary_data)
+                    process.stdin.close()
+                except OSError:
+                    # ffmpeg被提前结束
+                    pass
 
             def output_reader():
-                while True:
+                while not closed.is_set():
                     chunk = process.stdout.read(4096)
                     if not chunk:
                         break
-                    output_queue.put(chunk)
+                    while not closed.is_set():
+                        try:
+                            output_queue.put(chunk, timeout=0.1)
+                            break
+                        except Full:
+                            continue
                 stop_flag.set()
 
+            # stdin也在线程里写，避免ffmpeg输出暂停时卡在写输入上
+            writer = threading.Thread(target=input_writer, daemon=True)
+            writer.start()
             # 启动线程读取输出
             thread = threading.Thread(target=output_reader)
             thread.start()
 
-            process.stdin.write(mp3_binary_data)
-            process.stdin.close()
-
             # 从队列中读取所有输出块
             while not stop_flag.is_set() or not output_queue.empty():
                 try:
-                    chunk = output_queue.get_nowait()
+                    chunk = output_queue.get(timeout=0.1)
                     yield chunk
                 except Empty:
                     continue
@@ -355,6 +371,13 @@ class MP3Online(BaseTool):
             if 'process' in locals():
                 process.kill()
                 process.wait()
+        finally:
+            # 播放被打断时生成器提前关闭，结束ffmpeg
+            if 'closed' in locals():
+                closed.set()
+            if 'process' in locals() and process.poll() is None:
+                process.kill()
+                process.wait()
 
     def call(self, params: str, *args, **kwargs) -> str:
         params = self._verify_json_format_args(params)
@@ -371,6 +394,12 @@ class MP3Online(BaseTool):
         if params.get("play", ""):
             content = self._download(params["play"])
             from tts import adjust_volume
-            for pcm_data in self._convert_mp3_binary_to_pcm(content):
-                self.tts.conn.send(adjust_volume(pcm_data, self.tts.get_volume()), False)
+            stream = self._convert_mp3_binary_to_pcm(content)
+            try:
+                for pcm_data in stream:
+                    if self.tts.is_cancelled():
+                        return "播放被用户打断"
+                    self.tts.conn.send(adjust_volume(pcm_data, self.tts.get_volume()), False)
+            finally:
+                stream.close()
             return "已播放完成"
\ No newline at end of file
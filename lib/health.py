@@ -0,0 +1,122 @@
+import threading
+import time
+from collections import deque
+
+LOCAL = "本地"
+REMOTE = "百炼"
+
+class ProviderStats:
+    """一个provider最近window秒内的调用延迟和错误"""
+    def __init__(self, window):
+        self.window = window
+        self.samples = deque()  # [(time, latency or None表示出错)]
+        self.lock = threading.Lock()
+
+    def add(self, latency):
+        with self.lock:
+            self.samples.append((time.time(), latency))
+
+    def _trim(self):
+        expire = time.time() - self.window
+        while self.samples and self.samples[0][0] < expire:
+            self.samples.popleft()
+
+    def summary(self):
+        with self.lock:
+            self._trim()
+            samples = list(self.samples)
+        latencies = sorted(l for _, l in samples if l is not None)
+        errors = len(samples) - len(latencies)
+        p90 = latencies[int(len(latencies) * 0.9)] if latencies else 0
+        return len(samples), errors, p90, len(latencies)
+
+class HealthMonitor:
+    """进程内共享的provider健康状态。
+
+    后台线程定期探测本地服务（asr/llm/tts各自的ping），会话创建时直接读缓存，不再同步探测；
+    各wrapper上报每次调用的延迟（asr出结果、llm首次输出、tts首包）和错误，按时间窗口滚动统计。
+    choose()按配置的优先顺序选第一个可用的provider：本地需要探测在线，且两者都要求
+    窗口内没有超出延迟SLO（p90）或错误率。坏样本移出窗口后自动切回首选。
+    """
+    DEFAULT_SLO_MS = {"asr": 2000, "llm": 3000, "tts": 1500}
+
+    def __init__(self, interval=5, window=60, slo_ms=None, max_error_rate=0.2, min_samples=3):
+        self.interval = interval
+        self.window = window
+        self.slo = {k: v / 1000 for k, v in dict(HealthMonitor.DEFAULT_SLO_MS, **(slo_ms or {})).items()}
+        self.max_error_rate = max_error_rate
+        self.min_samples = min_samples
+        self.probes = {}  # kind -> probe()
+        self.up = {}      # kind -> 本地服务是否在线
+        self.stats = {}   # (kind, provider) -> ProviderStats
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def register(self, kind, probe):
+        """登记本地服务的探测函数；第一次登记时同步探测一次，之后由后台线程刷新"""
+        with self.lock:
+            if kind in self.probes:
+                return
+            self.probes[kind] = probe
+        self.up[kind] = self._probe(probe)
+        with self.lock:
+            if not self.thread:
+                self.thread = threading.Thread(target=self._run, name="health", daemon=True)
+                self.thread.start()
+
+    def _probe(self, probe):
+        try:
+            return bool(probe())
+        except Exception:
+            return False
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            for kind, probe in list(self.probes.items()):
+                up = self._probe(probe)
+                if up != self.up.get(kind):
+                    print(f"--- HEALTH: local {kind} is {'up' if up else 'down'} ---")
+                self.up[kind] = up
+
+    def is_up(self, kind):
+        return self.up.get(kind, False)
+
+    def _stats(self, kind, provider):
+        with self.lock:
+            return self.stats.setdefault((kind, provider), ProviderStats(self.window))
+
+    def record(self, kind, provider, latency):
+        self._stats(kind, provider).add(latency)
+
+    def record_error(self, kind, provider):
+        self._stats(kind, provider).add(None)
+
+    def healthy(self, kind, provider):
+        if provider == LOCAL and not self.is_up(kind):
+            return False
+        total, errors, p90, count = self._stats(kind, provider).summary()
+        if total and errors / total > self.max_error_rate:
+            return False
+        if count >= self.min_samples and p90 > self.slo.get(kind, float("inf")):
+            return False
+        return True
+
+    def choose(self, kind, preferred):
+        """按优先顺序返回第一个健康的provider，都不健康时用远端"""
+        for provider in (preferred, REMOTE if preferred == LOCAL else LOCAL):
+            if self.healthy(kind, provider):
+                return provider
+        return REMOTE
+
+_monitor = None
+_monitor_lock = threading.Lock()
+
+def load_monitor(config):
+    """按config["main"]["health"]创建，整个进程共用一个"""
+    global _monitor
+    with _monitor_lock:
+        if _monitor is None:
+            cfg = (config or {}).get("main", {}).get("health", {}) or {}
+            _monitor = HealthMonitor(**cfg)
+        return _monitor
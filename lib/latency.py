@@ -0,0 +1,89 @@
+import threading
+import time
+from collections import deque
+
+def now_us():
+    return int(time.time() * 1000000)
+
+class ClockSync:
+    """估计设备时钟相对服务端时钟的偏移。
+
+    服务端发PING(t0)，设备回PONG(t0, 设备时间td)，服务端在t3收到：
+    rtt = t3 - t0，假设上下行对称，offset = td - (t0 + t3) / 2。
+    取最近几次里rtt最小的样本，排队、限速造成的不对称影响最小。
+    """
+    SAMPLES = 8
+
+    def __init__(self):
+        self.samples = deque(maxlen=ClockSync.SAMPLES)  # [(rtt, offset)]
+
+    def add(self, t0, td, t3=None):
+        t3 = t3 or now_us()
+        rtt = t3 - t0
+        if rtt < 0:
+            return
+        self.samples.append((rtt, td - (t0 + t3) / 2))
+
+    def is_synced(self):
+        return bool(self.samples)
+
+    def rtt(self):
+        return min(self.samples)[0] if self.samples else 0
+
+    def to_server(self, device_us):
+        """设备时间（微秒）换算成服务端time.time()"""
+        offset = min(self.samples)[1]
+        return (device_us - offset) / 1000000
+
+class LatencyTracker:
+    """按轮次记录各阶段的时间点，设备报告开始播放后打印口到耳延迟。
+
+    时间点（服务端时钟，time.time()）：
+        speech_end  vad最后一个语音帧，减去半个rtt近似为用户停止说话的时刻
+        endpoint    判定一句话结束
+        asr         识别结果交给llm
+        tts         第一帧音频交给egress
+        egress      第一帧音频写出socket
+        play        设备开始播放第一个采样（设备时钟换算过来）
+    """
+    STAGES = ("speech_end", "endpoint", "asr", "tts", "egress", "play")
+    MAX_TURNS = 16
+
+    def __init__(self):
+        self.clock = ClockSync()
+        self.turns = {}  # turn.id -> {stage: time}
+        self.lock = threading.Lock()
+
+    def mark(self, turn, stage, t=None):
+        if not turn:
+            return
+        with self.lock:
+            marks = self.turns.setdefault(turn.id, {})
+            marks.setdefault(stage, t or time.time())
+            while len(self.turns) > LatencyTracker.MAX_TURNS:
+                self.turns.pop(next(iter(self.turns)))
+
+    def playback_started(self, turn, device_us):
+        if not turn or not self.clock.is_synced():
+            return
+        self.mark(turn, "play", self.clock.to_server(device_us))
+        self.report(turn)
+
+    def underrun(self, turn, device_us):
+        with self.lock:
+            start = self.turns.get(turn.id, {}).get("play") if turn else None
+        if start is None or not self.clock.is_synced():
+            print(f"--- UNDERRUN {turn} ---")
+            return
+        print(f"--- UNDERRUN {turn}: {(self.clock.to_server(device_us) - start) * 1000:.0f}ms after playback start ---")
+
+    def report(self, turn):
+        with self.lock:
+            marks = dict(self.turns.get(turn.id, {}))
+        if "play" not in marks or "speech_end" not in marks:
+            return
+        marks["speech_end"] -= self.clock.rtt() / 2000000
+        stages = [s for s in LatencyTracker.STAGES if s in marks]
+        parts = [f"{b} +{(marks[b] - marks[a]) * 1000:.0f}" for a, b in zip(stages, stages[1:])]
+        total = (marks["play"] - marks["speech_end"]) * 1000
+        print(f"--- LATENCY {turn}: mouth-to-ear {total:.0f}ms ({', '.join(parts)}; rtt {self.clock.rtt() / 1000:.0f}ms) ---")
@@ -2,16 +2,23 @@ from collections import deque
 import json
 import queue
 import threading
+import time
 from qwen_agent.agents import Assistant
 from qwen_agent.llm.schema import ASSISTANT
-from qwen_agent.utils.output_beautify import typewriter_print
 import requests
-import re
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 # 为了加载Agent
 import function_tool as _
+import metrics
+from agent_pool import load_agent_pool
+from answer_cache import load_answer_cache
+from cassette import load_cassette
+from health import load_monitor, LOCAL, REMOTE
+from speculative import Speculation, normalize
+from segmenter import Segmenter
+from stream_parser import ResponseParser
 
 TOOL_CALL_S = '[TOOL_CALL]'
 TOOL_CALL_E = ''
@@ -22,8 +29,8 @@ THOUGHT_S = '[THINK]'
 class LLM:
     LOCAL_LLM_API = os.getenv("LOCAL_LLM_API")
     LOCAL_LLM_API_PING = os.getenv("LOCAL_LLM_API")
-    MIN_TEXT_TO_TTS = 120
     MAX_HISTORY = 10
+    TTS_QUEUE_SIZE = 8
     PROMPT = {"role": "system", "content": '''
 # 🧠 智能语音助手对话行为规范
 
@@ -131,20 +138,54 @@ class LLM:
         self.config = config
         self.enable_thinking = self.config["llm"].get("enable_thinking", False)
         self.history = deque(maxlen=LLM.MAX_HISTORY)
+        # 回复文本按标点切段送tts：first_min为第一段的最少字数，max_len为一段的最大字数
+        self.segmenter_config = self.config["llm"].get("segmenter", {})
         self.asr = None
 
+        self.health = load_monitor(config)
+        self.health.register("llm", LLM._detect_local)
         provider = self.config["llm"].get("provider", "")
-        if provider == "本地" and self._detect_local():
+        self.preferred = provider if provider in (LOCAL, REMOTE) else REMOTE
+        if self.health.choose("llm", self._preferred()) == LOCAL:
             self._init_local()
         else:
             self._init_bailian()
 
         self.bot = None
+        self.tools = LLM.TOOLS
         self.need_exit_conversation = False
         self.tts_thread = None
-        self.tts_queue = queue.Queue()
+        self.tts_queue = queue.Queue(LLM.TTS_QUEUE_SIZE)
+        self.cancelled = threading.Event()
+        self.cassette = load_cassette(config)
+        # 所有设备共用的问答缓存，没配置时为None
+        self.cache = load_answer_cache(config)
+        # 猜测执行：asr中间结果稳定后提前跑的llm，call时最终结果一致就接着用
+        self.busy = False
+        self.speculation = None
+        self.spec_lock = threading.Lock()
+        self.spec_hits = 0
+        self.spec_misses = 0
+        self.spec_saved = 0
+
+    def _preferred(self):
+        return self.preferred
+
+    def _select(self):
+        """按健康状态切换provider，切换了返回True"""
+        provider = self.health.choose("llm", self._preferred())
+        if provider == self.provider:
+            return False
+        print(f"--- FAILOVER llm {self.provider} -> {provider} ---")
+        self.bot = None
+        if provider == LOCAL:
+            self._init_local()
+        else:
+            self._init_bailian()
+        return True
 
-    def _detect_local(self):
+    @staticmethod
+    def _detect_local():
         try:
             resp = requests.get(LLM.LOCAL_LLM_API_PING, timeout=0.5)
             return resp.status_code in [200, 404]
@@ -164,16 +205,27 @@ class LLM:
         self.model_server = "https://dashscope.aliyuncs.com/compatible-mode/v1"
         print("use ali llm")
 
+    @staticmethod
+    def preload(config):
+        """服务启动时连接共享的mcp工具，第一个连上的设备不用等"""
+        cassette = load_cassette(config)
+        if cassette and cassette.replaying:
+            return
+        load_agent_pool(config, LLM.TOOLS)
+
     @staticmethod
     def init_agent(asr, llm, tts):
-        for item in LLM.TOOLS:
-            if isinstance(item, dict) and item.get("name", None):
-                if item["name"] in ("get_model_config", "set_model_config", "exit_conversation", "tts_volume", "mp3_online"):
-                    item["args"] = {
-                        "asr": asr,
-                        "llm": llm,
-                        "tts": tts
-                    }
+        if llm.cassette and llm.cassette.replaying:
+            # 回放时不创建Assistant，也就不会启动mcp等工具
+            return
+        # mcp工具来自进程共享的AgentPool；注册表里的工具每个会话单独实例化，绑定自己的asr/llm/tts，
+        # 多设备并发时不能改写类属性LLM.TOOLS
+        pool = load_agent_pool(llm.config, LLM.TOOLS)
+        llm.tools = pool.tools({"asr": asr, "llm": llm, "tts": tts})
+        # 工具都是现成的对象，构造Assistant只剩创建llm客户端，连接时就做好，第一轮不用等
+        start = time.perf_counter()
+        llm._init_bot()
+        print(f"--- AGENT: assistant with {len(llm.tools)} tools ready in {(time.perf_counter() - start) * 1000:.0f}ms ---")
 
     def get_provider(self):
         return self.provider
@@ -191,7 +243,7 @@ class LLM:
         else:
             raise ValueError(f"unsupported provider {provider}")
 
-        self.config["llm"]["provider"] = provider
+        self.preferred = provider
 
     def is_local(self):
         return self.provider == "本地"
@@ -199,9 +251,78 @@ class LLM:
     def get_model(self):
         return self.model
 
-    def _process_history(self):
-        while self.history[0]["role"] != "user":
-            self.history.popleft()
+    def _process_history(self, history=None):
+        history = self.history if history is None else history
+        while history[0]["role"] != "user":
+            history.popleft()
+
+    def _user_message(self, text):
+        prefix = ""
+        if not self.enable_thinking and self.is_local():
+            # 实测ollama本地模型当前没法通过enable_thinking=False方式关闭think，这里hack下
+            prefix = "/no_think "
+        return {"role": "user", "content": prefix + text}
+
+    def speculate(self, text):
+        """用asr的中间结果提前开始这一轮，输出先留着，等call确认"""
+        if not text.strip() or (self.cassette and self.cassette.replaying):
+            return
+        with self.spec_lock:
+            if self.busy:
+                return
+            if self.speculation and self.speculation.key == normalize(text):
+                return
+            if self.cache and self.cache.peek(text):
+                # 缓存里有答案，不用提前跑
+                self._drop_speculation()
+                return
+            self._drop_speculation()
+            self._select()
+            if not self.bot:
+                self._init_bot()
+            # 和call一样构造消息，但不改动history
+            history = deque(self.history, maxlen=LLM.MAX_HISTORY)
+            history.append(self._user_message(text))
+            self._process_history(history)
+            messages = list(history)
+            print(f"--- SPECULATIVE start: {text} ---")
+            self.speculation = Speculation(text, lambda: self._run_bot(messages))
+
+    def drop_speculation(self, key=None):
+        """中间结果变成key之后，取消和它不一致的猜测"""
+        with self.spec_lock:
+            if self.speculation and self.speculation.key != key:
+                self._drop_speculation()
+
+    def _drop_speculation(self):
+        if self.speculation:
+            print(f"--- SPECULATIVE cancel: {self.speculation.text} ---")
+            self.speculation.cancel()
+            self.speculation = None
+
+    def _take_speculation(self, text):
+        """call开始时取出和最终结果一致的猜测，不一致的取消并计为未命中"""
+        with self.spec_lock:
+            self.busy = True
+            speculation, self.speculation = self.speculation, None
+        if not speculation:
+            return None
+        if speculation.key != normalize(text):
+            speculation.cancel()
+            self.spec_misses += 1
+            metrics.SPECULATIVE_TURNS.inc(result="miss")
+            print(f"--- SPECULATIVE miss: {speculation.text} -> {text} "
+                  f"(hit rate {self.spec_hits}/{self.spec_hits + self.spec_misses}) ---")
+            return None
+        saved = time.perf_counter() - speculation.start
+        self.spec_hits += 1
+        self.spec_saved += saved
+        metrics.SPECULATIVE_TURNS.inc(result="hit")
+        metrics.SPECULATIVE_SAVED_SECONDS.observe(saved)
+        print(f"--- SPECULATIVE hit: llm started {saved * 1000:.0f}ms before the final transcript "
+              f"(hit rate {self.spec_hits}/{self.spec_hits + self.spec_misses}, "
+              f"avg saved {self.spec_saved / self.spec_hits * 1000:.0f}ms) ---")
+        return speculation
 
     def _init_bot(self):
         llm_cfg = {
@@ -216,11 +337,32 @@ class LLM:
             },
         }
         self.bot = Assistant(llm=llm_cfg,
-                        function_list=LLM.TOOLS,
+                        function_list=self.tools,
                         name='Qwen3 Tool-calling Demo',
                         system_message=LLM.PROMPT['content'],
                         description="I'm a demo using the Qwen3 tool calling.")
 
+    def _run_bot(self, messages):
+        # 还没有任何输出就失败时，换一个provider重试一次
+        produced = False
+        try:
+            for response in self.bot.run(messages=messages):
+                produced = True
+                yield response
+        except Exception:
+            self.health.record_error("llm", self.provider)
+            if produced or self.cancelled.is_set() or not self._select():
+                raise
+            self._init_bot()
+            yield from self.bot.run(messages=messages)
+
+    def cancel(self):
+        # 取消当前这一轮：停止生成，丢弃还没合成的文本，打断正在合成的语音
+        self.cancelled.set()
+        self.drop_speculation()
+        if self.tts:
+            self.tts.cancel()
+
     def exit_conversation(self):
         print(f"\n\n------------ exit_conversation --------------")
         self.need_exit_conversation = True
@@ -229,18 +371,21 @@ class LLM:
         if self.tts_thread:
             return
         def tts_process(q):
-            try:
-                while True:
-                    text = q.get()
-                    if not text:
-                        break
+            while True:
+                text = q.get()
+                if not text:
+                    break
+                if self.cancelled.is_set():
+                    continue
+                try:
                     if self.tts:
                         if text.strip():
                             self.tts.call(text)
                     else:
                         print(f"\n--> tts: >>>>{text}<<<<")
-            except Exception as e:
-                print(e)
+                except Exception as e:
+                    # 队列有界，线程不能因为一段合成失败就退出
+                    print(e)
 
         self.tts_thread = threading.Thread(target = tts_process, args=(self.tts_queue,))
         self.tts_thread.start()
@@ -254,53 +399,90 @@ class LLM:
     def call(self, text):
         if len(text.strip()) == 0:
             return
-
+        speculation = self._take_speculation(text)
+        try:
+            self._call(text, speculation)
+        finally:
+            self.busy = False
+
+    def _call(self, text, speculation):
+        self.cancelled.clear()
+        if self.tts:
+            self.tts.resume()
         self._start_tts_thread()
 
-        if not self.bot:
-            self._init_bot()
-
-        prefix = ""
-        if not self.enable_thinking and self.is_local():
-            # 实测ollama本地模型当前没法通过enable_thinking=False方式关闭think，这里hack下
-            prefix = "/no_think "
-        self.history.append({"role": "user", "content": prefix + text})
-        self._process_history()
-        messages = list(self.history)
-        # print(messages)
-        fulltext_tts_done = 0
-        fulltext = ""
-        response_plain_text = ""
-        for response in self.bot.run(messages=messages):
-            response_plain_text = typewriter_print(response, response_plain_text)
-            msg = response[-1]
-            if msg['role'] == ASSISTANT and msg.get('content'):
-                text = msg["content"]
-                if text.startswith("<think>") and "</think>" not in text:
-                    # QwenAgent为了内部实现简单，stream是个复杂的状态机。
-                    # 如果中间有工具调用时，这里需要刷新text
-                    fulltext = ""
-                    assert fulltext_tts_done == 0
-                    continue
-
-                pattern = r'<think>.*?</think>'
-                cleaned_text = re.sub(pattern, '', text, flags=re.DOTALL).strip()
-                if not cleaned_text:
-                    continue
-
-                # print(cleaned_text[len(fulltext):], end="", flush=True)
-                fulltext += cleaned_text[len(fulltext):]
-
-                # 为了生成语音连贯性，这里牺牲实时性
-                delta = len(fulltext) - fulltext_tts_done
-                if delta > LLM.MIN_TEXT_TO_TTS:
-                    self.tts_queue.put(fulltext[fulltext_tts_done:])
-                    fulltext_tts_done = len(fulltext)
-
-        print()
-        if fulltext_tts_done < len(fulltext):
-            self.tts_queue.put(fulltext[fulltext_tts_done:])
-            fulltext_tts_done = len(fulltext)
+        replaying = self.cassette and self.cassette.replaying
+        # 缓存命中时直接念缓存的答案；没命中时拿到flight，这一轮的答案写回缓存
+        answer, flight = None, None
+        if self.cache and not replaying and not speculation:
+            answer, flight = self.cache.get(text)
+        response = []
+        said = []
+        completed = False
+        # 拿到flight之后出任何错都要在finally里结束它，否则同样的问题都要等满超时
+        try:
+            if answer is None and not replaying and not speculation:
+                self._select()
+            if answer is None and not self.bot and not replaying:
+                # 回放时不创建Assistant，也就不会启动mcp等工具
+                self._init_bot()
+
+            self.history.append(self._user_message(text))
+            self._process_history()
+            messages = list(self.history)
+            # print(messages)
+            segmenter = Segmenter(**self.segmenter_config)
+            parser = ResponseParser()
+            spoken = False
+            responded = False
+            start = time.perf_counter()
+            if answer is not None:
+                stream = [[{"role": ASSISTANT, "content": answer}]]
+            elif speculation:
+                # 猜测命中：接着用已经在跑的输出，首字延迟从这里算起
+                stream = speculation.stream()
+            elif self.cassette:
+                # 工具调用发生在bot.run内部，录下的时间已经包含了工具的耗时
+                stream = self.cassette.stream("llm", text, lambda: self._run_bot(messages))
+            else:
+                stream = self._run_bot(messages)
+            for response in stream:
+                if self.cancelled.is_set():
+                    break
+                if response and not responded:
+                    # 健康监控记模型第一次输出的时间：这时还没有执行工具，
+                    # 慢的mcp工具（地图、code_interpreter）不会让正常的provider被判超时
+                    if answer is None:
+                        self.health.record("llm", self.provider, time.perf_counter() - start)
+                    responded = True
+                # 只解析新增的部分，去掉思考内容，得到新的可以念出来的文本
+                text = parser.feed(response)
+                if text:
+                    if not spoken:
+                        metrics.LLM_FIRST_TOKEN_SECONDS.time(start)
+                        spoken = True
+                    said.append(text)
+                    # 第一段在第一个标点处就送出，尽快出声；后面的段逐渐变长，保持语音连贯
+                    for segment in segmenter.feed(text):
+                        self.tts_queue.put(segment)
+                if parser.calling:
+                    # 调用工具期间先把已经生成的话说完
+                    rest = segmenter.flush()
+                    if rest.strip():
+                        self.tts_queue.put(rest)
+
+            print()
+            tail = parser.flush()
+            said.append(tail)
+            rest = segmenter.flush() + tail
+            completed = not self.cancelled.is_set()
+            if rest.strip() and completed:
+                self.tts_queue.put(rest)
+        finally:
+            if flight:
+                # 被打断或出错时不写缓存，等着同一个问题的请求各自调用llm
+                tools = [msg["function_call"]["name"] for msg in response if msg.get("function_call")]
+                self.cache.finish(flight, "".join(said).strip() if completed else None, tools)
 
         self.history.extend(response)
 
@@ -1,15 +1,85 @@
 import requests
 import base64
+import json
 import os
+import queue
+import threading
+import websocket
+
+class StreamSession:
+    """到本地asr服务的一条websocket长连接，用于流式识别。
+
+    协议（{LOCAL_ASR_API}/asr/stream?sample_rate=16000，http换成ws）：
+        客户端 -> 服务端  binary帧：原始16bit pcm
+                          text帧：{"is_finish": true}，结束当前这句话
+        服务端 -> 客户端  text帧：{"text": "...", "is_final": false}，当前这句的中间结果
+                          text帧：{"text": "...", "is_final": true}，收到is_finish后的最终结果
+    一句话结束后连接保持，下一句直接接着发。
+    """
+    CONNECT_TIMEOUT = 2
+    RESULT_TIMEOUT = 10
+
+    def __init__(self, url, sample_rate, on_partial=None):
+        self.on_partial = on_partial
+        self.ws = websocket.create_connection(f"{url}?sample_rate={sample_rate}", timeout=StreamSession.CONNECT_TIMEOUT)
+        self.ws.settimeout(None)
+        self.results = queue.Queue()
+        self.closed = False
+        self.thread = threading.Thread(target=self._read, daemon=True)
+        self.thread.start()
+
+    def _read(self):
+        try:
+            while True:
+                msg = self.ws.recv()
+                if not msg:
+                    break
+                result = json.loads(msg)
+                if result.get("is_final"):
+                    self.results.put(result.get("text", ""))
+                elif result.get("text"):
+                    print(f"asr partial: {result['text']}")
+                    if self.on_partial:
+                        self.on_partial(result["text"])
+        except Exception as e:
+            if not self.closed:
+                print(f"asr stream: {e!r}")
+        self.closed = True
+        self.results.put(None)
+
+    def send(self, pcm):
+        self.ws.send(bytes(pcm), opcode=websocket.ABNF.OPCODE_BINARY)
+
+    def finish(self):
+        self.ws.send(json.dumps({"is_finish": True}))
+        text = self.results.get(timeout=StreamSession.RESULT_TIMEOUT)
+        if text is None:
+            raise ConnectionError("asr stream closed")
+        return text
+
+    def close(self):
+        self.closed = True
+        self.ws.close()
 
 class ASR:
-    LOCAL_ASR_API = os.getenv("LOCAL_ASR_API") 
+    LOCAL_ASR_API = os.getenv("LOCAL_ASR_API")
     LOCAL_ASR_API_PING = os.getenv("LOCAL_ASR_API") + "/ping"
+    LOCAL_ASR_API_STREAM = LOCAL_ASR_API.replace("http", "ws", 1) + "/asr/stream"
 
-    def __init__(self, llm, sample_rate):
+    def __init__(self, llm, sample_rate, stream=True):
         self.llm = llm
         self.sample_rate = sample_rate
         self.text = ""
+        # http模式也复用keep-alive连接
+        self.http = requests.Session()
+        # 流式会话：识别和kws确认各一条，互不等待；连不上或中途断开就退回http
+        self.stream = stream
+        self.session = None
+        self.kws_session = None
+        self.pending = bytearray()  # 当前这句已经发出的音频，流式中途断开时用http补发
+
+    def set_llm(self, llm):
+        self.llm = llm
 
     def start(self):
         pass
@@ -17,23 +87,80 @@ class ASR:
     def stop(self):
         pass
 
-    def send_audio_frame(self, data, is_finish=False):
-        resp = requests.post(f"{ASR.LOCAL_ASR_API}/asr", json={
+    def close(self):
+        for session in (self.session, self.kws_session):
+            if session:
+                session.close()
+        self.session = self.kws_session = None
+        self.http.close()
+
+    def _open_session(self, on_partial=None):
+        if not self.stream:
+            return None
+        try:
+            return StreamSession(ASR.LOCAL_ASR_API_STREAM, self.sample_rate, on_partial)
+        except Exception as e:
+            print(f"local asr stream not available, fall back to http: {e!r}")
+            self.stream = False
+            return None
+
+    def _post(self, data, is_finish):
+        resp = self.http.post(f"{ASR.LOCAL_ASR_API}/asr", json={
             "pcm": base64.b64encode(data).decode("utf-8"),
             "sample_rate": self.sample_rate,
             "is_finish": is_finish
         })
-        if resp.text.strip() != "":
-            print(resp.text)
-        self.text += resp.text
+        return resp.text
+
+    def send_audio_frame(self, data, is_finish=False):
+        if self.session is None:
+            self.session = self._open_session(getattr(self.llm, "partial", None))
+        if self.session:
+            try:
+                text = self._stream_audio_frame(data, is_finish)
+            except Exception as e:
+                # 这句话剩下的音频都走http，不能再接到一条新的流上
+                print(f"local asr stream failed, fall back to http: {e!r}")
+                self.session.close()
+                self.session = None
+                self.stream = False
+                data, self.pending = bytes(self.pending), bytearray()
+            else:
+                if text is not None:
+                    if text.strip() != "":
+                        print(text)
+                    self.llm.call(text)
+                return
+
+        text = self._post(data, is_finish)
+        if text.strip() != "":
+            print(text)
+        self.text += text
         if is_finish:
             self.llm.call(self.text)
             self.text = ""
+        elif text and hasattr(self.llm, "partial"):
+            self.llm.partial(self.text)
+
+    def _stream_audio_frame(self, data, is_finish):
+        self.pending += data
+        if data:
+            self.session.send(data)
+        if not is_finish:
+            return None
+        text = self.session.finish()
+        self.pending = bytearray()
+        return text
 
     def convert_text(self, data):
-        resp = requests.post(f"{ASR.LOCAL_ASR_API}/asr", json={
-            "pcm": base64.b64encode(data).decode("utf-8"),
-            "sample_rate": self.sample_rate,
-            "is_finish": True
-        })
-        return resp.text.strip()
\ No newline at end of file
+        if self.kws_session is None:
+            self.kws_session = self._open_session()
+        if self.kws_session:
+            try:
+                self.kws_session.send(data)
+                return self.kws_session.finish().strip()
+            except Exception as e:
+                print(f"local asr stream failed, fall back to http: {e!r}")
+                self.kws_session.close()
+                self.kws_session = None
+        return self._post(data, True).strip()
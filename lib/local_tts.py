@@ -14,6 +14,7 @@ class TTS:
             print(f"invalid spk_id {self.spk_id}, change to {self.spk_id_support[0]}")
             self.spk_id = self.spk_id_support[0]
         self.volume = self.config["tts"].get("volume", 30)
+        self.resp = None
 
     def set_connection(self, conn):
         self.conn = conn
@@ -35,19 +36,26 @@ class TTS:
     def set_volume(self, volume):
         self.volume = volume
 
-    def call(self, text):
-        from tts import adjust_volume
+    def stream(self, text):
         resp = requests.post(f"{TTS.LOCAL_TTS_API}/tts", json={
             "text": text,
             "spk_id": self.spk_id,
         }, stream=True)
-        for pcm_data in resp.iter_content(chunk_size=4096):
-            if not self.conn:
-                print(len(pcm_data))
-                continue
-            pcm_data = adjust_volume(pcm_data, self.volume)
-            self.conn.send(pcm_data, False)
+        self.resp = resp
+        try:
+            for pcm_data in resp.iter_content(chunk_size=4096):
+                yield pcm_data
+        finally:
+            self.resp = None
+            resp.close()
+
+    def cancel(self):
+        # 从其他线程关闭正在读取的http响应，iter_content会立刻结束
+        resp = self.resp
+        if resp:
+            resp.close()
 
 if __name__ == "__main__":
     tts = TTS(None)
-    tts.call("你是谁？")
+    for pcm_data in tts.stream("你是谁？"):
+        print(len(pcm_data))
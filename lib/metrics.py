@@ -0,0 +1,146 @@
+# 运行时指标，Prometheus文本格式，通过本地http端点暴露。
+# 默认关闭：start_server之前所有observe/inc都直接返回，埋点只剩一次函数调用。
+import sys
+import threading
+import time
+import weakref
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# lib里的模块import metrics，main里from lib import metrics，两个名字必须是同一份指标
+sys.modules.setdefault("metrics", sys.modules[__name__])
+sys.modules.setdefault("lib.metrics", sys.modules[__name__])
+
+enabled = False
+sessions = weakref.WeakSet()  # 活动的Connection，gauge按需从中统计
+metrics = []
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+class Counter:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+        self.lock = threading.Lock()
+        metrics.append(self)
+
+    def inc(self, value=1, **labels):
+        if not enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in self.values.items():
+                lines.append(f"{self.name}{_labels(key)} {value}")
+        return lines
+
+class Gauge:
+    """取值时调用fn()，不需要在热路径上维护"""
+    def __init__(self, name, help, fn):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        metrics.append(self)
+
+    def render(self):
+        try:
+            value = self.fn()
+        except Exception:
+            value = float("nan")
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+class Histogram:
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.lock = threading.Lock()
+        metrics.append(self)
+
+    def observe(self, value):
+        if not enabled:
+            return
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def time(self, start):
+        """记录从start（time.perf_counter()）到现在的耗时"""
+        if enabled:
+            self.observe(time.perf_counter() - start)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        cumulative += counts[-1]
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {cumulative}')
+        lines.append(f"{self.name}_sum {total}")
+        lines.append(f"{self.name}_count {cumulative}")
+        return lines
+
+VAD_SECONDS = Histogram("esp32ai_vad_decision_seconds", "每块pcm的端点检测耗时", FAST_BUCKETS)
+KWS_SECONDS = Histogram("esp32ai_kws_decision_seconds", "每块pcm的唤醒词检测耗时（含asr确认）")
+ASR_FINALIZE_SECONDS = Histogram("esp32ai_asr_finalize_seconds", "最后一帧音频交给asr到拿到识别结果")
+LLM_FIRST_TOKEN_SECONDS = Histogram("esp32ai_llm_first_token_seconds", "llm请求到第一段回复文本")
+TTS_FIRST_AUDIO_SECONDS = Histogram("esp32ai_tts_first_audio_seconds", "tts请求到第一块音频")
+SEND_SECONDS = Histogram("esp32ai_socket_send_seconds", "每次下行写socket的耗时", FAST_BUCKETS)
+SPECULATIVE_TURNS = Counter("esp32ai_speculative_turns_total", "用asr中间结果提前启动llm的轮次，按是否命中最终结果")
+SPECULATIVE_SAVED_SECONDS = Histogram("esp32ai_speculative_saved_seconds", "猜测命中时llm比最终识别结果提前启动的时间")
+ANSWER_CACHE_TURNS = Counter("esp32ai_answer_cache_turns_total", "问答缓存的查询结果：hit命中、coalesced等同一问题的请求、miss调用llm、skip追问不查缓存")
+PHRASE_CACHE_LOOKUPS = Counter("esp32ai_phrase_cache_lookups_total", "短句合成音频缓存的查询，按是否命中")
+AUDIO_BYTES = Counter("esp32ai_audio_bytes_total", "音频字节数，按方向和编码")
+UPLINK_DROPPED_BYTES = Counter("esp32ai_uplink_dropped_bytes_total", "vad阶段积压超过上限时丢掉的上行pcm字节数")
+ACTIVE_SESSIONS = Gauge("esp32ai_active_sessions", "当前连接的设备数", lambda: len(sessions))
+TTS_QUEUE_DEPTH = Gauge("esp32ai_tts_queue_depth", "所有会话等待合成的文本段数",
+                        lambda: sum(s.llm.tts_queue.qsize() for s in list(sessions)))
+PENDING_PCM_BYTES = Gauge("esp32ai_pending_pcm_bytes", "所有会话已收到还没交给asr的pcm字节数",
+                          lambda: sum(len(s.pending_pcm) + s.backlog_bytes + len(s.utterance) for s in list(sessions)))
+
+def render():
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_server(host="127.0.0.1", port=9100):
+    global enabled
+    enabled = True
+    server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"Metrics on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,184 @@
+import atexit
+import json
+import mmap
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+class PhraseCache:
+    """短句合成结果的磁盘缓存，所有设备共用。
+
+    音频放在一个固定大小（budget_mb）的文件里，mmap映射后按(offset, length)分配，
+    读的时候按CHUNK切出mmap上的memoryview，缓存这一层不拷贝；之后和现场合成的音频一样
+    每块要调音量（转成float再转回int16）、重采样、编码，各有一次拷贝。命中省下的是
+    合成的时间（首包几百毫秒），不是这几次拷贝。空间不够时按LRU淘汰，
+    正在被读的条目不会被淘汰覆盖。索引（key -> offset, length, crc）另存为json，
+    每save_s秒和进程退出时写一次；启动时用crc校验，崩溃后被覆盖的条目直接丢掉。
+
+    缓存的是调音量之前的原始pcm，和cassette录制的一致。
+    """
+    CHUNK = 4800  # 24kHz 16bit下100ms
+
+    def __init__(self, path="phrases.pcm", budget_mb=32, max_chars=20, save_s=5):
+        self.path = path
+        self.index_path = path + ".json"
+        self.size = int(budget_mb * 1024 * 1024)
+        self.max_chars = max_chars
+        self.save_s = save_s
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> [offset, length, crc]，按最近使用排序
+        self.pins = {}                # key -> 正在读的数量
+        self.free = [(0, self.size)]  # 按offset排序的空闲区间
+        self.dirty = False
+        self.saved = time.time()
+        self.hits = 0
+        self.misses = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "a+b") as f:
+            if os.path.getsize(path) != self.size:
+                f.truncate(self.size)
+        self.file = open(path, "r+b")
+        self.mm = mmap.mmap(self.file.fileno(), self.size)
+        self._load()
+        atexit.register(self.save)
+
+    @staticmethod
+    def key(provider, spk_id, text):
+        return f"{provider}|{spk_id}|{text.strip()}"
+
+    def cacheable(self, text):
+        return 0 < len(text.strip()) <= self.max_chars
+
+    def _load(self):
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        for key, (offset, length, crc) in saved:
+            if offset + length > self.size or zlib.crc32(self.mm[offset:offset + length]) != crc:
+                continue
+            if not self._take(offset, length):
+                continue
+            self.entries[key] = [offset, length, crc]
+        print(f"--- PHRASE CACHE: loaded {len(self.entries)} phrases from {self.path} ---")
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            saved = list(self.entries.items())
+            self.dirty = False
+            self.saved = time.time()
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(saved, f, ensure_ascii=False)
+        os.replace(tmp, self.index_path)
+
+    def close(self):
+        self.save()
+        atexit.unregister(self.save)
+        self.mm.close()
+        self.file.close()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def read(self, key):
+        """命中时返回按CHUNK切好的memoryview生成器，否则返回None；生成器结束前这一条不会被淘汰"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            self.pins[key] = self.pins.get(key, 0) + 1
+        return self._chunks(key, entry[0], entry[1])
+
+    def _chunks(self, key, offset, length):
+        try:
+            view = memoryview(self.mm)[offset:offset + length]
+            for i in range(0, length, PhraseCache.CHUNK):
+                yield view[i:i + PhraseCache.CHUNK]
+        finally:
+            with self.lock:
+                self.pins[key] -= 1
+                if not self.pins[key]:
+                    del self.pins[key]
+
+    def put(self, key, pcm):
+        length = len(pcm)
+        if not length or length > self.size:
+            return False
+        with self.lock:
+            if key in self.entries:
+                return True
+            offset = self._allocate(length)
+            if offset is None:
+                return False
+            self.mm[offset:offset + length] = pcm
+            self.entries[key] = [offset, length, zlib.crc32(pcm)]
+            self.dirty = True
+            save = time.time() - self.saved > self.save_s
+        if save:
+            self.save()
+        return True
+
+    def _allocate(self, length):
+        """first fit；没有足够大的空闲区间时从最久没用的开始淘汰"""
+        while True:
+            for i, (offset, size) in enumerate(self.free):
+                if size >= length:
+                    if size == length:
+                        del self.free[i]
+                    else:
+                        self.free[i] = (offset + length, size - length)
+                    return offset
+            victim = next((k for k in self.entries if k not in self.pins), None)
+            if victim is None:
+                return None
+            offset, size, _ = self.entries.pop(victim)
+            self._release(offset, size)
+
+    def _take(self, offset, length):
+        """加载索引时把条目占用的区间从空闲列表里扣掉"""
+        for i, (start, size) in enumerate(self.free):
+            if start <= offset and offset + length <= start + size:
+                pieces = [(start, offset - start), (offset + length, start + size - offset - length)]
+                self.free[i:i + 1] = [p for p in pieces if p[1]]
+                return True
+        return False
+
+    def _release(self, offset, length):
+        """归还区间，和前后相邻的空闲区间合并"""
+        free = self.free
+        i = 0
+        while i < len(free) and free[i][0] < offset:
+            i += 1
+        free.insert(i, (offset, length))
+        if i + 1 < len(free) and offset + length == free[i + 1][0]:
+            free[i] = (offset, length + free[i + 1][1])
+            del free[i + 1]
+        if i > 0 and free[i - 1][0] + free[i - 1][1] == offset:
+            free[i - 1] = (free[i - 1][0], free[i - 1][1] + free[i][1])
+            del free[i]
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def load_phrase_cache(config):
+    """按config["tts"]["phrase_cache"]创建，整个进程共用一个；没配置时返回None"""
+    global _cache
+    cfg = config.get("tts", {}).get("phrase_cache") if config else None
+    if not cfg:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = PhraseCache(**{k: v for k, v in cfg.items() if k != "prewarm"})
+        return _cache
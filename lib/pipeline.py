@@ -0,0 +1,125 @@
+import itertools
+import queue
+import threading
+
+class Turn:
+    """一轮对话。cancel之后，各阶段队列里属于这一轮的数据都会被丢弃"""
+    _ids = itertools.count(1)
+
+    def __init__(self):
+        self.id = next(Turn._ids)
+        self.cancelled = threading.Event()
+
+    def __str__(self):
+        return f"turn-{self.id}"
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def is_cancelled(self):
+        return self.cancelled.is_set()
+
+class Stage:
+    """流水线中的一个阶段：有界输入队列 + 独立的工作线程。
+
+    队列满时put阻塞，背压逐级传回上游阶段；读socket的线程用put_nowait，
+    不能阻塞在这里，否则会收不到设备发来的控制帧。
+    handler(turn, item)在工作线程中执行，turn为该数据所属的一轮对话。
+    idle()在队列取空、工作线程即将阻塞等待之前调用，可用于把攒下的数据一次处理掉。
+    """
+    STOP = object()
+
+    def __init__(self, name, handler, maxsize=8, idle=None):
+        self.name = name
+        self.handler = handler
+        self.idle = idle
+        self.queue = queue.Queue(maxsize)
+        self.turn = None  # 工作线程当前正在处理的轮次
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def put(self, item, turn):
+        self.queue.put((turn, item))
+
+    def put_nowait(self, item, turn):
+        """队列满时不等待，返回False"""
+        try:
+            self.queue.put_nowait((turn, item))
+            return True
+        except queue.Full:
+            return False
+
+    def qsize(self):
+        return self.queue.qsize()
+
+    def clear(self):
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def stop(self):
+        self.clear()
+        try:
+            self.queue.put_nowait(Stage.STOP)
+        except queue.Full:
+            pass
+
+    def _run(self):
+        while True:
+            if self.idle and self.queue.empty():
+                try:
+                    self.idle()
+                except Exception as e:
+                    print(f"{self.name} stage: {e!r}")
+            entry = self.queue.get()
+            if entry is Stage.STOP:
+                break
+            turn, item = entry
+            if turn and turn.is_cancelled():
+                continue
+            self.turn = turn
+            try:
+                self.handler(turn, item)
+            except Exception as e:
+                print(f"{self.name} stage: {e!r}")
+            finally:
+                self.turn = None
+
+class StageSink:
+    """把下游阶段包装成provider期望的回调接口（例如asr识别完成后调用的llm.call）。
+
+    回调发生在上游阶段处理某一轮数据的过程中，所以沿用上游当前的轮次。
+    """
+    def __init__(self, stage, upstream):
+        self.stage = stage
+        self.upstream = upstream
+
+    def call(self, item):
+        self.stage.put(item, self.upstream.turn)
+
+class Pipeline:
+    def __init__(self):
+        self.stages = []
+        self.turn = Turn()  # 设备上行数据当前所属的轮次
+
+    def add_stage(self, name, handler, maxsize=8, idle=None):
+        stage = Stage(name, handler, maxsize, idle)
+        self.stages.append(stage)
+        return stage
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    def new_turn(self):
+        self.turn = Turn()
+        return self.turn
+
+    def stop(self):
+        self.turn.cancel()
+        for stage in self.stages:
+            stage.stop()
@@ -0,0 +1,161 @@
+import struct
+
+# 帧头格式：3s B B B H -> 3字节字符串、1字节无符号char、1字节、1字节、2字节短整型
+HEADER = struct.Struct('<3sBBBH')
+# CREDIT帧的data：设备新腾出的下行缓冲字节数
+CREDIT = struct.Struct('<I')
+# 对时：服务端PING带服务端时间，设备PONG原样带回并附上设备时间，单位都是微秒
+PING = struct.Struct('<Q')
+PONG = struct.Struct('<QQ')
+# 设备事件：事件类型、设备时间（微秒）
+EVENT = struct.Struct('<BQ')
+
+class Request:
+    HEADER_SIZE = HEADER.size
+    MAGIC = b'bee'  # 3字节魔数
+
+    WAV_FORMAT = 1
+    PCM_FORMAT = 2
+    HELLO = 3           # 握手，data为json：{"codecs": {"up": [...], "down": [...]}, "sample_rate": 16000}
+                        # sample_rate为设备播放的采样率，服务端把24kHz的tts输出重采样成这个采样率
+                        # "barge_in": true表示设备有回声消除、能处理FLUSH，服务端才会在播放中检测说话并打断
+    ULAW_FORMAT = 4
+    ADPCM_FORMAT = 5
+    # 流控：设备在HELLO里带上"window"（下行缓冲字节数）即开启，服务端发出的音频数据
+    # 总量不超过设备给的credit；设备播放或清空缓冲后用CREDIT帧归还腾出的字节数
+    CREDIT = 6
+    # 时间戳：设备在HELLO里带上"timestamps": true即开启，服务端会发PING对时
+    PONG = 7
+    EVENT = 8
+
+    EVENT_PLAYBACK_START = 1    # 一轮回复的第一个采样开始播放
+    EVENT_UNDERRUN = 2          # 播放缓冲欠载
+
+    # 上行音频帧类型 -> 编码名
+    AUDIO_FORMATS = {PCM_FORMAT: "pcm", ULAW_FORMAT: "ulaw", ADPCM_FORMAT: "adpcm"}
+
+    def __init__(self):
+        self.magic = Request.MAGIC  # 3字节魔数
+        self.type = 0               # 1字节类型
+        self.eof = 0                # 1字节标识结束
+        self.dummy = 0              # 1字节保留字段
+        self.length = 0             # 2字节长度
+
+        self.data = b''
+
+    def __str__(self):
+        return f"magic: {self.magic}, type: {self.type}, eof: {self.eof}, dummy: {self.dummy}, length: {self.length}, data: {len(self.data)}"
+
+    @classmethod
+    def from_bytes(cls, data, offset=0):
+        req = cls()
+        req.magic, req.type, req.eof, req.dummy, req.length = HEADER.unpack_from(data, offset)
+        return req
+
+    def to_bytes(self):
+        return HEADER.pack(self.magic, self.type, self.eof, self.dummy, self.length) + bytes(self.data)
+
+class Response:
+    HEADER_SIZE = HEADER.size
+    MAGIC = b'bee'  # 3字节魔数
+
+    ASR_BIT = 0x2
+    LLM_BIT = 0x1
+    TTS_BIT = 0
+
+    PCM_DATA = 1
+    EXIT_CHAT = 2
+    TOKEN = 3
+    FLUSH = 4       # 打断：设备丢弃还没播放的音频
+    HELLO = 5       # 握手应答，data为json：{"codecs": {"up": "...", "down": "..."}, "sample_rate": 16000}
+    ULAW_DATA = 6
+    ADPCM_DATA = 7
+    PING = 8        # 对时，data为PING，设备收到后立即回PONG
+
+    # 编码名 -> 下行音频帧类型
+    AUDIO_TYPES = {"pcm": PCM_DATA, "ulaw": ULAW_DATA, "adpcm": ADPCM_DATA}
+
+    def __init__(self):
+        self.magic = Request.MAGIC  # 3字节魔数
+        self.type = 0               # 1字节类型
+        self.eof = 0                # 1字节标识结束
+        self.is_local = 0           # 1字节表明asr/llm/tts用在线还是离线
+        self.length = 0             # 2字节长度
+
+        self.data = b''
+
+    def __str__(self):
+        return f"magic: {self.magic}, type: {self.type}, eof: {self.eof}, is_local: {self.is_local}, length: {self.length}, data: {len(self.data)}"
+
+    @classmethod
+    def from_bytes(cls, data, offset=0):
+        resp = cls()
+        resp.magic, resp.type, resp.eof, resp.is_local, resp.length = HEADER.unpack_from(data, offset)
+        return resp
+
+    def header(self):
+        return HEADER.pack(self.magic, self.type, self.eof, self.is_local, self.length)
+
+    def to_bytes(self):
+        return self.header() + bytes(self.data)
+
+class FrameDecoder:
+    """基于可复用bytearray的请求帧解码器。
+
+    socket数据直接写进内部缓冲区（recv_into或feed），解析出的Request.data是指向
+    缓冲区的memoryview，不产生拷贝。缓冲区只在尾部空间不足时把未解析的数据挪回头部，
+    所以帧总是连续的；memoryview只在下一次写入缓冲区之前有效，需要保留的调用方自行拷贝。
+    """
+    def __init__(self, capacity=64 * 1024):
+        self.buf = bytearray(capacity)
+        self.view = memoryview(self.buf)
+        self.start = 0  # 未解析数据的起点
+        self.end = 0    # 已写入数据的终点
+
+    def __len__(self):
+        return self.end - self.start
+
+    def _reserve(self, size):
+        if self.end + size <= len(self.buf):
+            return
+        pending = self.end - self.start
+        if pending + size > len(self.buf):
+            # 单帧超过容量时扩容，旧的memoryview仍然引用旧缓冲区，不受影响
+            capacity = max(len(self.buf) * 2, pending + size)
+            buf = bytearray(capacity)
+            buf[:pending] = self.view[self.start:self.end]
+            self.buf = buf
+            self.view = memoryview(buf)
+        else:
+            self.view[:pending] = self.view[self.start:self.end]
+        self.start = 0
+        self.end = pending
+
+    def writable(self, size):
+        """返回可供socket.recv_into写入的缓冲区，写入后调用commit"""
+        self._reserve(size)
+        return self.view[self.end:self.end + size]
+
+    def commit(self, size):
+        self.end += size
+
+    def feed(self, data):
+        size = len(data)
+        self._reserve(size)
+        self.view[self.end:self.end + size] = data
+        self.end += size
+
+    def frames(self):
+        while self.end - self.start >= HEADER.size:
+            req = Request.from_bytes(self.buf, self.start)
+            if req.magic != Request.MAGIC:
+                print(f"Invalid magic number {req.magic}")
+                raise ValueError(f"Invalid magic number {req.magic}")
+            begin = self.start + HEADER.size
+            if self.end < begin + req.length:
+                return
+            req.data = self.view[begin:begin + req.length]
+            self.start = begin + req.length
+            if self.start == self.end:
+                self.start = self.end = 0
+            yield req
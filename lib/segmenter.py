@@ -0,0 +1,95 @@
+import re
+
+# 句末标点：后面的停顿长，切在这里韵律最自然
+STRONG = set("。！？；!?;…\n")
+# 句中标点：第一段为了尽快出声可以切在这里，后面的段只有过长时才用
+WEAK = set("，、：,:")
+# 紧跟在标点后面的引号括号归前一段
+CLOSING = set("”’」』）)】》\"'")
+# 英文字母和数字，两个之间不能切开（单词、3.14、1,000）
+WORD = re.compile(r"[0-9A-Za-z]")
+
+class Segmenter:
+    """把llm流式吐出的文本切成适合tts的段。
+
+    第一段在达到first_min个字后的第一个标点处切出，尽快出声；之后每段的最小长度翻倍，
+    直到max_len，只在句末标点处切，让合成的韵律连贯；超过max_len还没有句末标点时退到句中标点，
+    再不行就在不破坏英文单词和数字的位置硬切。标点之后要再看到一个字符才切：英文的.和,
+    要判断是不是3.14、1,000里的，后面紧跟的引号括号也要归到这一段。
+    """
+    def __init__(self, first_min=4, max_len=120):
+        self.first_min = first_min
+        self.max_len = max_len
+        self.reset()
+
+    def reset(self):
+        self.buffer = ""
+        self.min_len = self.first_min
+        self.first = True
+
+    def feed(self, text):
+        """追加文本，返回可以送去合成的段（可能为空）"""
+        self.buffer += text
+        segments = []
+        while True:
+            end = self._find_end()
+            if not end:
+                return segments
+            segments.append(self.buffer[:end])
+            self.buffer = self.buffer[end:]
+            if self.first:
+                self.first = False
+            else:
+                self.min_len = min(self.min_len * 2, self.max_len)
+
+    def flush(self):
+        """llm结束，剩下的都送去合成"""
+        rest, self.buffer = self.buffer, ""
+        return rest
+
+    def _breaks(self):
+        """[(段结束位置, 是否句末)]，结束位置包含标点和紧跟的引号括号"""
+        text = self.buffer
+        breaks = []
+        for i, c in enumerate(text):
+            strong = c in STRONG or (c == "." and not self._in_word(i))
+            if not strong and c not in WEAK:
+                continue
+            if i + 1 >= len(text) or (c in ".,:" and self._in_word(i)):
+                # 还不知道后面是不是引号括号，或者是3.14、1,000、12:30
+                continue
+            end = i + 1
+            while end < len(text) and text[end] in CLOSING:
+                end += 1
+            if end >= len(text) and end > i + 1:
+                continue
+            breaks.append((end, strong))
+        return breaks
+
+    def _in_word(self, i):
+        text = self.buffer
+        return (0 < i < len(text) - 1 and WORD.match(text[i - 1]) is not None
+                and WORD.match(text[i + 1]) is not None)
+
+    def _find_end(self):
+        breaks = [(end, strong) for end, strong in self._breaks() if len(self.buffer[:end].strip()) >= self.min_len]
+        if self.first and breaks:
+            return breaks[0][0]
+        strong = [end for end, s in breaks if s]
+        if strong:
+            return strong[-1] if strong[-1] <= self.max_len else strong[0]
+        if len(self.buffer) <= self.max_len:
+            # 多等一个字符，硬切时才能看到切点后面是不是还在同一个单词里
+            return None
+        if breaks:
+            return breaks[-1][0] if breaks[-1][0] <= self.max_len else breaks[0][0]
+        return self._hard_end()
+
+    def _hard_end(self):
+        end = self.max_len
+        while end < len(self.buffer) and WORD.match(self.buffer[end - 1]) and WORD.match(self.buffer[end]):
+            end -= 1
+            if end <= self.min_len:
+                # 一整段都是字母数字，只能切开
+                return self.max_len
+        return end
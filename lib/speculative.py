@@ -0,0 +1,121 @@
+import re
+import threading
+import time
+
+def normalize(text):
+    """比较识别结果时忽略标点、空白和大小写"""
+    return re.sub(r"[\W_]+", "", text or "").lower()
+
+def _has_function_call(response):
+    return any(msg.get("function_call") for msg in response)
+
+class Speculation:
+    """在最终识别结果出来之前，用中间结果提前跑的一次llm。
+
+    后台线程消费bot.run的输出，只保留最新的一份（qwen_agent每次产出的都是完整的累计回复），
+    不送tts。确认（stream()）之后从最新的一份接着产出；取消则关闭生成器。
+    agent在流式输出结束后才执行工具，所以遇到工具调用时停在原地等确认，
+    不会因为猜错的问题去调用工具。
+    """
+    def __init__(self, text, run):
+        self.text = text
+        self.key = normalize(text)
+        self.start = time.perf_counter()
+        self.cond = threading.Condition()
+        self.latest = None
+        self.seq = 0
+        self.done = False
+        self.error = None
+        self.confirmed = False
+        self.cancelled = False
+        self.thread = threading.Thread(target=self._run, args=(run,), name="speculation", daemon=True)
+        self.thread.start()
+
+    def _run(self, run):
+        it = None
+        try:
+            it = run()
+            for response in it:
+                with self.cond:
+                    self.latest = response
+                    self.seq += 1
+                    self.cond.notify_all()
+                    while _has_function_call(response) and not self.confirmed and not self.cancelled:
+                        self.cond.wait()
+                    if self.cancelled:
+                        break
+        except Exception as e:
+            self.error = e
+        finally:
+            if it is not None:
+                it.close()
+            with self.cond:
+                self.done = True
+                self.cond.notify_all()
+
+    def cancel(self):
+        with self.cond:
+            self.cancelled = True
+            self.cond.notify_all()
+
+    def stream(self):
+        """确认这次猜测，产出llm的输出；中途不再消费时自动取消"""
+        with self.cond:
+            self.confirmed = True
+            self.cond.notify_all()
+        seen = 0
+        try:
+            while True:
+                with self.cond:
+                    while self.seq == seen and not self.done:
+                        self.cond.wait()
+                    if self.seq == seen:
+                        if self.error:
+                            raise self.error
+                        return
+                    seen, response = self.seq, self.latest
+                yield response
+        finally:
+            self.cancel()
+
+class Speculator:
+    """跟踪asr的中间结果，同一段文本保持stable_ms不变时让llm提前开始。
+
+    文本变化时取消已经开始的猜测；最终结果交给llm.call之前调用reset。
+    """
+    def __init__(self, llm, stable_ms=300):
+        self.llm = llm
+        self.stable = stable_ms / 1000
+        self.key = None
+        self.timer = None
+        self.lock = threading.Lock()
+
+    def update(self, text):
+        key = normalize(text)
+        with self.lock:
+            if key == self.key:
+                return
+            self.key = key
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+            self.llm.drop_speculation(key)
+            if not key:
+                return
+            self.timer = threading.Timer(self.stable, self._fire, (text, key))
+            self.timer.daemon = True
+            self.timer.start()
+
+    def _fire(self, text, key):
+        with self.lock:
+            if key != self.key:
+                return
+            self.timer = None
+        self.llm.speculate(text)
+
+    def reset(self):
+        with self.lock:
+            self.key = None
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
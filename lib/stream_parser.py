@@ -0,0 +1,122 @@
+from qwen_agent.llm.schema import ASSISTANT, FUNCTION
+
+THINK_S = "<think>"
+THINK_E = "</think>"
+
+def _partial_tag(text, tag):
+    """text结尾可能是tag的前半截（跨两次更新的标签），返回这部分的长度"""
+    for n in range(min(len(tag) - 1, len(text)), 0, -1):
+        if text.endswith(tag[:n]):
+            return n
+    return 0
+
+class ResponseParser:
+    """增量解析bot.run产出的回复列表，每次只处理新增的部分。
+
+    qwen_agent每次产出的是到目前为止完整的消息列表，最后一条消息的各字段只会在末尾追加；
+    工具调用时会追加function_call消息、工具结果消息和新的assistant消息。
+    这里记住处理到第几条消息、每个字段处理到哪里，以及是否在<think>里，
+    feed只看新增的字符，返回可以念出来的新文本（去掉思考内容，每条消息开头的空白），
+    同时像typewriter_print一样把新增内容打印出来。
+    """
+    def __init__(self, echo=True):
+        self.echo = echo
+        self.index = -1
+        self.printed = False
+        self.calling = False  # 最后一条消息是工具调用或工具结果
+        self._reset_message()
+
+    def _reset_message(self):
+        self.consumed = {}   # 字段 -> 已处理的长度
+        self.think = False
+        self.pending = ""    # 可能是半截标签的结尾，等下一次更新再判断
+        self.started = False
+
+    def feed(self, response):
+        spoken = []
+        for i in range(max(self.index, 0), len(response)):
+            if i != self.index:
+                self.index = i
+                self._reset_message()
+            spoken.append(self._message(response[i]))
+        return "".join(spoken)
+
+    def flush(self):
+        """回复结束：留着等判断的结尾原来不是标签，也念出来"""
+        text, self.pending = self.pending, ""
+        return "" if self.think else text
+
+    def _delta(self, field, value):
+        done = self.consumed.get(field)
+        if done is None:
+            self._print(self._header(field))
+            done = 0
+        elif len(value) < done:
+            # 同一条消息的内容被重写了（不应该发生），当作从头开始
+            if field == "content":
+                self.think, self.pending, self.started = False, "", False
+            done = 0
+        self.consumed[field] = len(value)
+        delta = value[done:]
+        self._print(delta, header=False)
+        return delta
+
+    def _header(self, field):
+        return {"reasoning_content": "[THINK]\n", "content": "[ANSWER]\n"}.get(field, "")
+
+    def _print(self, text, header=True):
+        if not self.echo or not text:
+            return
+        if header and self.printed:
+            text = "\n" + text
+        print(text, end="", flush=True)
+        self.printed = True
+
+    def _message(self, msg):
+        role = msg["role"]
+        if role == FUNCTION:
+            self.calling = True
+            if "result" not in self.consumed:
+                self.consumed["result"] = True
+                self._print(f"[TOOL_RESPONSE] {msg.get('name')}\n{msg.get('content')}")
+            return ""
+        if role != ASSISTANT:
+            return ""
+        if msg.get("reasoning_content"):
+            self._delta("reasoning_content", msg["reasoning_content"])
+        text = ""
+        if msg.get("content"):
+            text = self._speakable(self._delta("content", msg["content"]))
+        function_call = msg.get("function_call")
+        self.calling = bool(function_call)
+        if function_call:
+            if "function_call" not in self.consumed:
+                self.consumed["function_call"] = 0
+                self._print(f"[TOOL_CALL] {function_call.get('name')}\n")
+            arguments = function_call.get("arguments") or ""
+            self._print(arguments[self.consumed["function_call"]:], header=False)
+            self.consumed["function_call"] = len(arguments)
+        return text
+
+    def _speakable(self, delta):
+        text = self.pending + delta
+        out = []
+        i = 0
+        while True:
+            tag = THINK_E if self.think else THINK_S
+            j = text.find(tag, i)
+            if j < 0:
+                end = len(text) - _partial_tag(text[i:], tag)
+                if not self.think:
+                    out.append(text[i:end])
+                self.pending = text[end:]
+                break
+            if not self.think:
+                out.append(text[i:j])
+            self.think = not self.think
+            i = j + len(tag)
+        spoken = "".join(out)
+        if not self.started:
+            spoken = spoken.lstrip()
+            self.started = bool(spoken)
+        return spoken
@@ -5,6 +5,12 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from local_tts import TTS as localTTS
 from ali_tts import TTS as aliTTS
 import numpy as np
+import threading
+import time
+import metrics
+from cassette import load_cassette
+from health import load_monitor, LOCAL, REMOTE
+from phrase_cache import load_phrase_cache
 
 def adjust_volume(pcm_data, volume=None):
     def calculate_safe_gain(data):
@@ -24,20 +30,46 @@ def adjust_volume(pcm_data, volume=None):
     return adjusted_pcm_clipped.astype(np.int16).tobytes()
 
 class TTS:
+    _prewarmed = False
+    _prewarm_lock = threading.Lock()
+
     def __init__(self, conn, config=None):
         self.conn = conn
         self.config = config
+        self.health = load_monitor(config)
+        self.health.register("tts", TTS._detect_local)
         provider = self.config["tts"].get("provider", "")
-        if provider == "本地" and self._detect_local():
+        self.preferred = provider if provider in (LOCAL, REMOTE) else REMOTE
+        if self.health.choose("tts", self._preferred()) == LOCAL:
             self._init_local()
         else:
             self._init_bailian()
+        self.cancelled = threading.Event()
+        self.cassette = load_cassette(config)
+        # 短句的合成结果缓存在磁盘上，所有设备共用；录制/回放时不用，保证cassette里有完整的tts流
+        self.phrases = None if self.cassette else load_phrase_cache(config)
 
     def set_connection(self, conn):
         self.conn = conn
         self.tts.set_connection(conn)
 
-    def _detect_local(self):
+    def _preferred(self):
+        return self.preferred
+
+    def _select(self):
+        """按健康状态切换provider，切换了返回True"""
+        provider = self.health.choose("tts", self._preferred())
+        if provider == self.provider:
+            return False
+        print(f"--- FAILOVER tts {self.provider} -> {provider} ---")
+        if provider == LOCAL:
+            self._init_local()
+        else:
+            self._init_bailian()
+        return True
+
+    @staticmethod
+    def _detect_local():
         try:
             resp = requests.get(localTTS.LOCAL_TTS_API_PING, timeout=0.5)
             return resp.status_code == 200
@@ -69,7 +101,7 @@ class TTS:
         else:
             raise ValueError(f"unsupported provider {provider}")
 
-        self.config["tts"]["provider"] = provider
+        self.preferred = provider
 
     def is_local(self):
         return self.provider == "本地"
@@ -89,8 +121,117 @@ class TTS:
     def set_volume(self, volume):
         self.tts.set_volume(volume)
 
+    def cancel(self):
+        # 打断：停止当前的合成流，后续call直接返回，直到resume
+        self.cancelled.set()
+        self.tts.cancel()
+
+    def resume(self):
+        self.cancelled.clear()
+
+    def is_cancelled(self):
+        return self.cancelled.is_set()
+
     def call(self, data):
-        self.tts.call(data)
+        if self.cancelled.is_set():
+            return
+        self._select()
+        try:
+            self._call(data)
+        except _Failed:
+            # 还没出声就失败了：换一个provider重试一次
+            if not self._select():
+                raise
+            self._call(data)
+
+    def _phrase_key(self, text):
+        return self.phrases.key(self.provider, self.get_spk_id(), text)
+
+    @staticmethod
+    def preload(config):
+        """服务启动时预热短句缓存，整个进程只做一次"""
+        with TTS._prewarm_lock:
+            if TTS._prewarmed:
+                return
+            TTS._prewarmed = True
+        tts = TTS(None, config)
+        if tts.phrases:
+            tts.prewarm()
+
+    def prewarm(self):
+        """后台合成配置里的常用短句（和唤醒应答），已经缓存的跳过"""
+        phrases = list(self.config["tts"]["phrase_cache"].get("prewarm", []))
+        wake_ack = self.config.get("main", {}).get("wake_ack")
+        if wake_ack:
+            phrases.append(wake_ack)
+        missing = [text for text in phrases if self._phrase_key(text) not in self.phrases]
+        if not missing:
+            return
+        # 合成期间provider可能切换，key按开始时的provider和音色算
+        tts, provider, spk_id = self.tts, self.provider, self.get_spk_id()
+        def warm():
+            for text in missing:
+                try:
+                    self.phrases.put(self.phrases.key(provider, spk_id, text), b"".join(tts.stream(text)))
+                except Exception as e:
+                    print(f"prewarm {text}: {e!r}")
+            print(f"--- PHRASE CACHE: prewarmed {len(missing)} phrases ---")
+        threading.Thread(target=warm, daemon=True).start()
+
+    def cached_audio(self, text):
+        """缓存里有这句话时返回调好音量的pcm，否则返回None；用于唤醒应答这种要立刻出声的场景。
+        整句拼起来再调音量，会拷贝两次，应答只有零点几秒，代价可以忽略"""
+        chunks = self.phrases.read(self._phrase_key(text)) if self.phrases else None
+        if chunks is None:
+            return None
+        return adjust_volume(b"".join(chunks), self.get_volume())
+
+    def _call(self, data):
+        start = time.perf_counter()
+        key = self._phrase_key(data) if self.phrases and self.phrases.cacheable(data) else None
+        cached = self.phrases.read(key) if key else None
+        collected = [] if key and cached is None else None
+        if key:
+            metrics.PHRASE_CACHE_LOOKUPS.inc(result="miss" if collected is not None else "hit")
+        if cached is not None:
+            print(f"--- PHRASE CACHE hit: {data.strip()} ({self.phrases.hits}/{self.phrases.hits + self.phrases.misses}) ---")
+            stream = cached
+        elif self.cassette:
+            # 录制的是调音量之前的原始音频
+            stream = self.cassette.stream("tts", data, lambda: self.tts.stream(data))
+        else:
+            stream = self.tts.stream(data)
+        try:
+            for pcm_data in stream:
+                if self.cancelled.is_set():
+                    break
+                if start:
+                    metrics.TTS_FIRST_AUDIO_SECONDS.time(start)
+                    if cached is None:
+                        self.health.record("tts", self.provider, time.perf_counter() - start)
+                    start = None
+                if collected is not None:
+                    collected.append(pcm_data)
+                if not self.conn:
+                    print(len(pcm_data))
+                    continue
+                self.conn.send(adjust_volume(pcm_data, self.get_volume()), False)
+            if collected and not self.cancelled.is_set():
+                # 完整合成完的短句才缓存
+                self.phrases.put(key, b"".join(collected))
+        except Exception as e:
+            # 打断时连接被关闭引起的异常不用关心
+            if self.cancelled.is_set():
+                return
+            self.health.record_error("tts", self.provider)
+            if start:
+                raise _Failed(e) from e
+            raise
+        finally:
+            stream.close()
+
+class _Failed(Exception):
+    """合成在产出第一包音频之前失败，可以换provider重试"""
 
 if __name__ == "__main__":
     tts = TTS(None)
@@ -0,0 +1,154 @@
+import os
+import wave
+import numpy as np
+
+def _mel_filterbank(sample_rate, n_fft, n_mels):
+    def hz_to_mel(hz):
+        return 2595 * np.log10(1 + hz / 700.)
+
+    def mel_to_hz(mel):
+        return 700 * (10 ** (mel / 2595.) - 1)
+
+    mels = np.linspace(hz_to_mel(0), hz_to_mel(sample_rate / 2), n_mels + 2)
+    bins = np.floor((n_fft + 1) * mel_to_hz(mels) / sample_rate).astype(int)
+    fbank = np.zeros((n_mels, n_fft // 2 + 1), dtype=np.float32)
+    for m in range(1, n_mels + 1):
+        left, center, right = bins[m - 1], bins[m], bins[m + 1]
+        if center > left:
+            fbank[m - 1, left:center] = (np.arange(left, center) - left) / (center - left)
+        if right > center:
+            fbank[m - 1, center:right] = (right - np.arange(center, right)) / (right - center)
+    return fbank
+
+def _dct_matrix(n_mels, n_mfcc):
+    n = np.arange(n_mels)
+    k = np.arange(n_mfcc)[:, None]
+    return (np.cos(np.pi * k * (2 * n + 1) / (2 * n_mels)) * np.sqrt(2. / n_mels)).astype(np.float32)
+
+class MFCC:
+    """numpy实现的MFCC特征，25ms帧、10ms帧移，去掉c0后做倒谱均值归一化"""
+    def __init__(self, sample_rate=16000, n_mfcc=13, n_mels=26, frame_ms=25, hop_ms=10, n_fft=512):
+        self.sample_rate = sample_rate
+        self.frame_len = sample_rate * frame_ms // 1000
+        self.hop = sample_rate * hop_ms // 1000
+        self.n_fft = n_fft
+        self.window = np.hamming(self.frame_len).astype(np.float32)
+        self.fbank = _mel_filterbank(sample_rate, n_fft, n_mels)
+        self.dct = _dct_matrix(n_mels, n_mfcc)
+
+    def __call__(self, pcm):
+        samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768
+        if len(samples) < self.frame_len:
+            return np.zeros((0, self.dct.shape[0] - 1), dtype=np.float32)
+        samples = np.append(samples[0], samples[1:] - 0.97 * samples[:-1])
+        frames = np.lib.stride_tricks.sliding_window_view(samples, self.frame_len)[::self.hop] * self.window
+        power = np.abs(np.fft.rfft(frames, self.n_fft)) ** 2 / self.n_fft
+        feats = np.log(power @ self.fbank.T + 1e-10) @ self.dct.T
+        feats = feats[:, 1:]
+        return feats - feats.mean(axis=0)
+
+def trim_silence(pcm, frame_size=320, ratio=0.1):
+    """去掉模板首尾的静音，以最响帧能量的ratio为门限"""
+    samples = np.frombuffer(pcm, dtype=np.int16)
+    count = len(samples) // frame_size
+    if count == 0:
+        return pcm
+    energy = np.square(samples[:count * frame_size].reshape(count, -1).astype(np.float32)).mean(axis=1)
+    loud = np.nonzero(energy >= energy.max() * ratio)[0]
+    return samples[loud[0] * frame_size:(loud[-1] + 1) * frame_size].tobytes()
+
+def subsequence_dtw(template, feats):
+    """模板在任意位置与feats对齐的最小平均代价，以及匹配结束的帧下标。
+
+    每行只依赖上一行（步长(1,0)、(1,1)、(1,2)），可以按行向量化。
+    """
+    if len(feats) == 0:
+        return np.inf, 0
+    t = template / (np.linalg.norm(template, axis=1, keepdims=True) + 1e-8)
+    f = feats / (np.linalg.norm(feats, axis=1, keepdims=True) + 1e-8)
+    cost = 1 - t @ f.T  # 余弦距离，m x n
+    row = cost[0].copy()  # 开头不受约束
+    for i in range(1, len(template)):
+        prev = row
+        best = prev.copy()
+        best[1:] = np.minimum(best[1:], prev[:-1])
+        best[2:] = np.minimum(best[2:], prev[:-2])
+        row = cost[i] + best
+    end = int(np.argmin(row))
+    return row[end] / len(template), end
+
+def load_pcm(fpath, sample_rate=16000):
+    if fpath.endswith(".wav"):
+        with wave.open(fpath, "rb") as f:
+            if f.getframerate() != sample_rate or f.getnchannels() != 1 or f.getsampwidth() != 2:
+                raise ValueError(f"{fpath}: need {sample_rate}Hz 16bit mono wav")
+            return f.readframes(f.getnframes())
+    with open(fpath, "rb") as f:
+        return f.read()
+
+class WakeWordDetector:
+    """本地唤醒词初筛：MFCC + 子序列DTW，与录制的若干条唤醒词模板做匹配。
+
+    只用来挡掉明显不是唤醒词的语音，命中后仍由asr确认，所以门限宁松勿紧。
+    """
+    DEFAULT_THRESHOLD = 0.3
+    def __init__(self, templates, threshold=None, sample_rate=16000):
+        self.mfcc = MFCC(sample_rate)
+        self.sample_rate = sample_rate
+        self.templates = [self.mfcc(trim_silence(pcm)) for pcm in templates]
+        self.templates = [t for t in self.templates if len(t) > 0]
+        if not self.templates:
+            raise ValueError("no valid wake word templates")
+        self.threshold = threshold or self._calibrate()
+        self.hop = self.mfcc.hop * 2  # 特征帧对应的字节数
+
+    def _calibrate(self):
+        # 录音差异大时，按模板之间互相匹配的最大代价放宽，否则用经验值
+        scores = [subsequence_dtw(a, b)[0]
+                  for i, a in enumerate(self.templates) for j, b in enumerate(self.templates) if i != j]
+        return max([WakeWordDetector.DEFAULT_THRESHOLD] + [score * 1.5 for score in scores])
+
+    @classmethod
+    def from_dir(cls, path, threshold=None, sample_rate=16000):
+        files = sorted(f for f in os.listdir(path) if f.endswith((".wav", ".pcm")))
+        templates = [load_pcm(os.path.join(path, f), sample_rate) for f in files]
+        detector = cls(templates, threshold, sample_rate)
+        print(f"wake word detector: {len(detector.templates)} templates, threshold {detector.threshold:.3f}")
+        return detector
+
+    def score(self, pcm):
+        """返回(最小匹配代价, 唤醒词结束位置的字节偏移)"""
+        feats = self.mfcc(pcm)
+        best, best_end = np.inf, 0
+        for template in self.templates:
+            score, end = subsequence_dtw(template, feats)
+            if score < best:
+                best, best_end = score, end
+        end_offset = min(len(pcm), best_end * self.hop + self.mfcc.frame_len * 2)
+        return best, end_offset
+
+    def detect(self, pcm):
+        return self.score(pcm)[0] <= self.threshold
+
+_detectors = {}
+
+def load_detector(config):
+    """按配置加载进程内共享的检测器，未配置模板目录时返回None"""
+    path = config["main"].get("kws_templates", "")
+    if not path:
+        return None
+    key = (path, config["main"].get("kws_threshold"))
+    if key not in _detectors:
+        if os.path.isdir(path):
+            _detectors[key] = WakeWordDetector.from_dir(path, config["main"].get("kws_threshold"))
+        else:
+            print(f"wake word detector: template dir {path} not found, every speech chunk goes to asr")
+            _detectors[key] = None
+    return _detectors[key]
+
+if __name__ == "__main__":
+    import sys
+    detector = WakeWordDetector.from_dir(sys.argv[1])
+    for fpath in sys.argv[2:]:
+        score, end = detector.score(load_pcm(fpath))
+        print(f"{fpath}: score {score:.3f}, end at {end} bytes, {'HIT' if score <= detector.threshold else 'miss'}")
@@ -1,169 +1,341 @@
 from dotenv import load_dotenv
 load_dotenv(override=True)
 
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import socket
 from lib.asr import ASR
 from lib.llm import LLM
 from lib.tts import TTS
-import struct
+from lib.protocol import Request, Response, FrameDecoder, CREDIT, PING, PONG, EVENT
+from lib.pipeline import Pipeline, StageSink, Turn
+from lib.wakeword import load_detector
+from lib.egress import EgressWriter
+from lib.latency import LatencyTracker
+from lib.speculative import Speculator
+from lib.phrase_cache import PhraseCache
+from lib import metrics
+from lib import codec
+from lib import dsp
 import json
+import threading
+import time
+from collections import deque
+import numpy as np
 import webrtcvad
 import yaml
 
 class Vad:
-    def __init__(self, sample_rate=16000, frame_duration_ms=30, threshold=0.1):
+    """webrtcvad封装，按帧增量处理：不足一帧的数据留到下一次调用，
+    能量明显低于门限的帧直接判为静音，不再调用webrtcvad。
+
+    is_speech返回最近window_ms内语音帧占比是否达到threshold；stream是流式端点检测：
+    - 静音状态下最近preroll_ms的音频留作预录，检测到起音时连同预录一起输出，不丢字头；
+    - 语音之后连续静音达到endpoint_ms判定一句话结束，服务端无需等设备的eof。
+    """
+    SILENCE = 0
+    SPEECH = 1
+
+    def __init__(self, sample_rate=16000, frame_duration_ms=30, threshold=0.1,
+                 endpoint_ms=600, preroll_ms=300, onset_ms=90,
+                 window_ms=600, energy_threshold=60):
         self.sample_rate = sample_rate
         self.frame_duration_ms = frame_duration_ms
+        self.frame_size = int(self.sample_rate * self.frame_duration_ms / 1000) * 2  # 16位 = 2字节
         self.threshold = threshold
+        self.energy_threshold = energy_threshold  # 帧RMS门限（int16幅度）
         self.vad = webrtcvad.Vad()
         self.vad.set_mode(2)  # 0~3，3最严格
+        self.remainder = bytearray()
+
+        # 语音占比的滑动窗口
+        self.window = deque(maxlen=max(1, window_ms // frame_duration_ms))
+        self.window_speech = 0
+
+        self.endpoint_ms = endpoint_ms
+        self.onset_ms = onset_ms
+        self.preroll = deque(maxlen=max(1, preroll_ms // frame_duration_ms))
+        self.reset()
+
+    def reset(self):
+        self.state = Vad.SILENCE
+        self.speech_ms = 0             # 连续语音时长，用于判断起音
+        self.silence_ms = 0            # 最后一个语音帧之后的静音时长
+        self.last_speech_time = None   # 最后一个语音帧的处理时刻
+        self.preroll.clear()
+        self.remainder = bytearray()
+
+    def take_remainder(self):
+        remainder, self.remainder = self.remainder, bytearray()
+        return remainder
+
+    def frames(self, pcm):
+        """接上次剩下的数据逐帧判断，生成(帧, 是否语音)"""
+        if self.remainder:
+            self.remainder += pcm
+            pcm = self.take_remainder()
+        count = len(pcm) // self.frame_size
+        if count:
+            # 一次性算出所有整帧的RMS
+            samples = np.frombuffer(pcm, dtype=np.int16, count=count * self.frame_size // 2)
+            samples = samples.reshape(count, -1).astype(np.float32)
+            power = np.einsum('ij,ij->i', samples, samples)
+            loud = (power >= self.energy_threshold ** 2 * samples.shape[1]).tolist()
+        view = memoryview(pcm)
+        for i in range(count):
+            frame = view[i * self.frame_size:(i + 1) * self.frame_size]
+            voiced = loud[i] and self.vad.is_speech(frame, self.sample_rate)
+            if len(self.window) == self.window.maxlen:
+                self.window_speech -= self.window[0]
+            self.window.append(voiced)
+            self.window_speech += voiced
+            yield frame, voiced
+        self.remainder += view[count * self.frame_size:]
+
+    def speech_ratio(self):
+        return self.window_speech / len(self.window) if self.window else 0
 
     def is_speech(self, pcm_data):
-        frame_size = int(self.sample_rate * self.frame_duration_ms / 1000) * 2  # 16位 = 2字节
-        frames = [pcm_data[i:i+frame_size] for i in range(0, len(pcm_data), frame_size)]
-        speech_frames = 0
-        for frame in frames:
-            if len(frame) < frame_size:
-                continue
-            if self.vad.is_speech(frame, sample_rate=self.sample_rate):
-                speech_frames += 1
-        return speech_frames / len(frames) >= self.threshold
+        for _ in self.frames(pcm_data):
+            pass
+        return len(self.window) > 0 and self.speech_ratio() >= self.threshold
+
+    def stream(self, pcm):
+        """逐帧更新端点状态，生成(要送给asr的音频, 是否一句话结束)"""
+        for frame, voiced in self.frames(pcm):
+            if voiced:
+                self.speech_ms += self.frame_duration_ms
+                self.silence_ms = 0
+                self.last_speech_time = time.time()
+            else:
+                self.speech_ms = 0
+                self.silence_ms += self.frame_duration_ms
+
+            if self.state == Vad.SILENCE:
+                self.preroll.append(frame)
+                if self.speech_ms >= self.onset_ms:
+                    self.state = Vad.SPEECH
+                    yield b''.join(self.preroll), False
+                    self.preroll.clear()
+            elif self.endpoint_ms and self.silence_ms >= self.endpoint_ms:
+                yield frame, True
+                self.state = Vad.SILENCE
+                self.speech_ms = 0
+            else:
+                yield frame, False
 
 class KWS:
-    def __init__(self, asr, kw="hellohello"):
+    """唤醒词检测。音频进入一个带重叠的滑动窗口，每攒够hop_ms新数据对整个窗口检测一次，
+    跨两块的唤醒词也能被看到；唤醒后窗口里唤醒词之后的音频交给asr，命令不丢。
+    """
+    def __init__(self, asr, kw="hellohello", detector=None, sample_rate=16000, window_ms=1500, hop_ms=600):
         self.asr = asr
         self.kw = kw.lower()
         self.wakeup = False
-        self.vad = Vad()
-
-    def is_wakeup(self, pcm):
+        self.window_size = sample_rate * window_ms // 1000 * 2
+        self.hop_size = sample_rate * hop_ms // 1000 * 2
+        self.vad = Vad(sample_rate, window_ms=window_ms)
+        # 本地唤醒词初筛，只有疑似命中的语音才交给asr确认
+        self.detector = detector
+        self.reset()
+
+    def reset(self):
+        self.window = bytearray()
+        self.pending = 0
+        self.vad.reset()
+
+    @staticmethod
+    def normalize(text):
+        return text.replace(" ", "").replace(",", "").replace("，", "").lower()
+
+    def feed(self, pcm):
+        """送入新音频，唤醒时返回窗口中唤醒词之后的音频，否则返回None"""
         if self.wakeup:
-            return True
-        if not self.vad.is_speech(pcm):
-            return False
-        text = self.asr.convert_text(pcm)
-        text = text.replace(" ", "").replace(",", "").replace("，", "").lower()
+            return pcm
+        self.window += pcm
+        if len(self.window) > self.window_size:
+            del self.window[:len(self.window) - self.window_size]
+        self.pending += len(pcm)
+        speech = self.vad.is_speech(pcm)
+        if self.pending < self.hop_size:
+            return None
+        self.pending = 0
+        if not speech:
+            return None
+
+        window = bytes(self.window)
+        end = 0
+        if self.detector:
+            score, end = self.detector.score(window)
+            if score > self.detector.threshold:
+                return None
+        text = self.normalize(self.asr.convert_text(window))
         if self.kw in text:
             print("--- WAKEUP ---")
             self.wakeup = True
-            return True
+            self.reset()
+            # 没有本地检测器时不知道唤醒词的位置，整窗交给asr，由strip去掉识别结果里的唤醒词
+            return window[end:]
+        return None
+
+    def strip(self, text):
+        """去掉识别结果开头的唤醒词，如 "Hello hello，今天天气" 返回 "今天天气" """
+        kept = [i for i, c in enumerate(text) if c not in " ,，"]
+        normalized = "".join(text[i] for i in kept).lower()
+        pos = normalized.find(self.kw)
+        if pos < 0 or pos > len(self.kw):
+            return text
+        rest = text[kept[pos + len(self.kw) - 1] + 1:]
+        return rest.lstrip(" ,，。！？!?.")
 
     def exit(self):
         print("--- SLEEP ---")
         self.wakeup = False
+        self.reset()
 
-class Request:
-    HEADER_SIZE = 8
-    MAGIC = b'bee'  # 3字节魔数
-
-    WAV_FORMAT = 1
-    PCM_FORMAT = 2
-
-    def __init__(self):
-        self.magic = Request.MAGIC  # 3字节魔数
-        self.type = 0               # 1字节类型
-        self.eof = 0                # 1字节标识结束
-        self.dummy = 0              # 1字节保留字段
-        self.length = 0             # 2字节长度
-
-        self.data = b''
-
-    def __str__(self):
-        return f"magic: {self.magic}, type: {self.type}, eof: {self.eof}, dummy: {self.dummy}, length: {self.length}, data: {len(self.data)}"
-
-    @classmethod
-    def from_bytes(cls, data: bytes):
-        req = cls()
-
-        # 使用 struct.unpack_from 解析前 8 字节
-        # 格式字符串：3s B B B H -> 3字节字符串、1字节无符号char、1字节、1字节、2字节短整型
-        unpacked = struct.unpack_from('<3sBBBH', data)
-        req.magic = unpacked[0]
-        req.type = unpacked[1]
-        req.eof = unpacked[2]
-        req.dummy = unpacked[3]
-        req.length = unpacked[4]
-
-        return req  
-
-class Response:
-    HEADER_SIZE = 8
-    MAGIC = b'bee'  # 3字节魔数
-
-    ASR_BIT = 0x2
-    LLM_BIT = 0x1
-    TTS_BIT = 0
-
-    PCM_DATA = 1
-    EXIT_CHAT = 2
-    TOKEN = 3
-
-    def __init__(self):
-        self.magic = Request.MAGIC  # 3字节魔数
-        self.type = 0               # 1字节类型
-        self.eof = 0                # 1字节标识结束
-        self.is_local = 0           # 1字节表明asr/llm/tts用在线还是离线
-        self.length = 0             # 2字节长度
-
-        self.data = b''
-
-    def __str__(self):
-        return f"magic: {self.magic}, type: {self.type}, eof: {self.eof}, is_local: {self.is_local}, length: {self.length}, data: {len(self.data)}"
-
-    @classmethod
-    def from_bytes(cls, data: bytes):
-        resp = cls()
-
-        # 使用 struct.unpack_from 解析前 8 字节
-        # 格式字符串：3s B B B H -> 3字节字符串、1字节无符号char、1字节、1字节、2字节短整型
-        unpacked = struct.unpack_from('<3sBBBH', data)
-        resp.magic = unpacked[0]
-        resp.type = unpacked[1]
-        resp.eof = unpacked[2]
-        resp.is_local = unpacked[3]
-        resp.length = unpacked[4]
+class StreamSocket:
+    """把asyncio的StreamWriter包装成Connection需要的阻塞socket接口。
 
-        return resp
+    sendall只能在工作线程（执行器、各阶段和tts线程）里调用，
+    数据交给事件循环写出，drain完成前调用方阻塞，以此传递背压。
+    """
+    def __init__(self, loop, writer):
+        self.loop = loop
+        self.writer = writer
+
+    async def _write(self, data):
+        self.writer.write(data)
+        await self.writer.drain()
+
+    async def _writelines(self, buffers):
+        # 传输层支持时writelines用sendmsg分散写，不拼接
+        self.writer.writelines(buffers)
+        await self.writer.drain()
+
+    def sendall(self, data):
+        asyncio.run_coroutine_threadsafe(self._write(data), self.loop).result()
+
+    def sendmsg(self, buffers):
+        asyncio.run_coroutine_threadsafe(self._writelines(buffers), self.loop).result()
+        return sum(len(b) for b in buffers)
 
-    def to_bytes(self):
-        # 使用 struct.pack 打包数据
-        # 格式字符串：3s B B B H -> 3字节字符串、1字节无符号char、1字节、1字节、2字节短整型
-        packed = struct.pack('<3sBBBH', self.magic, self.type, self.eof, self.is_local, self.length)
-        return packed + self.data
+    def close(self):
+        self.loop.call_soon_threadsafe(self.writer.close)
 
 class Connection:
-    DECODE_HEADER = 0
-    DECODE_PAYLOAD = 1
+    """一个设备会话，按阶段组织成流水线：
+
+        ingest(读socket线程) -> vad/kws -> asr -> llm -> tts(llm内的tts线程) -> egress
+
+    阶段之间是有界队列，下游处理不过来时背压逐级传回，到vad阶段为止；ingest不阻塞，
+    音频在backlog里最多攒BACKLOG_SIZE，超过就丢掉最早的，CREDIT等控制帧总能及时处理。
+    每个阶段有独立的工作线程，读socket永远不会卡在asr/llm/tts上。
+    cancel_turn取消一轮对话，各阶段丢弃该轮剩余数据。
+    """
+    RECV_TIMEOUT = 5.0
+    VAD_CHUNK_SIZE = 3840  # 120ms，端点检测的粒度
+    VAD_QUEUE_SIZE = 16
+    BACKLOG_SIZE = 320000  # 10s，vad阶段来不及处理时ingest最多替它攒这么多上行音频
+    ASR_QUEUE_SIZE = 8
+    LLM_QUEUE_SIZE = 2
+    EGRESS_QUEUE_SIZE = 64
+    SAMPLE_RATE = 16000      # 上行，vad/kws/asr的采样率
+    TTS_SAMPLE_RATE = 24000  # tts和ffmpeg输出的采样率
 
     def __init__(self, s, asr, llm, tts, pcm_chunk_size=9600*2, config=None):
         self.socket = s
         self.asr = asr
         self.llm = llm
         self.tts = tts
-        self.payload = b''
-        self.request = None
-        self.decode_state = Connection.DECODE_HEADER
+        self.decoder = FrameDecoder()
         self.pcm_chunk_size = pcm_chunk_size
-        self.pending_pcm = b''
+        self.pending_pcm = bytearray()
+        # vad队列满时还没交出去的(pcm, eof)块，ingest不阻塞，控制帧不会排在上行音频后面
+        self.backlog = deque()
+        self.backlog_bytes = 0
+        self.backlog_lock = threading.Lock()
+        self.dropped_bytes = 0
+        self.dropping = False
         self.config = config
-        self.kws = KWS(asr, kw=config["main"].get("kws", "hellohello"))
-
-    def recv(self, size):
-        self.socket.settimeout(5.0)
-        ret = self.socket.recv(size)
+        self.kws = KWS(asr, kw=config["main"].get("kws", "hellohello"), detector=load_detector(config),
+                       window_ms=config["main"].get("kws_window_ms", 1500),
+                       hop_ms=config["main"].get("kws_hop_ms", 600))
+        self.endpointer = Vad(**config["main"].get("vad", {}))
+        self.utterance = bytearray()  # 唤醒后攒给asr的音频
+        self.endpoint_time = None     # 服务端判定本句结束的时刻
+        # 播放中检测到持续这么久的语音就打断，0表示关闭；只对在握手时声明"barge_in"的设备生效，
+        # 这样的设备有回声消除，并且能处理FLUSH帧
+        self.barge_in_ms = config["main"].get("barge_in_ms", 0)
+        self.barge_in_supported = False
+        self.barge_in_time = None     # 最近一次打断的时刻
+        # 唤醒后立刻播放的应答（如"我在"），只用短句缓存里的音频，不等合成
+        self.wake_ack = config["main"].get("wake_ack")
+        # 音频编码：上行按帧类型解码，下行用握手协商的编码，未握手的设备保持pcm
+        self.codecs = config["main"].get("codecs", list(codec.CODECS))
+        self.decoders = {t: codec.create(name) for t, name in Request.AUDIO_FORMATS.items()}
+        self.encoder = codec.PCMCodec()
+        self.encode_lock = threading.Lock()
+        # 端到端延迟：设备在握手时声明支持时间戳后，对时并上报播放事件
+        self.latency = LatencyTracker()
+        self.timestamps = False
+        # 下行按设备播放速度限速，合并小帧后一次写出
+        self.egress = EgressWriter(s, on_audio=lambda turn, t: self.latency.mark(turn, "egress", t),
+                                   **config["main"].get("egress", {}))
+        # 上行在vad/kws之前做自动增益和噪声门；下行重采样到设备播放的采样率
+        self.uplink = dsp.create(Connection.SAMPLE_RATE, config["main"])
+        self.downlink = dsp.create(Connection.TTS_SAMPLE_RATE, None, self.egress.sample_rate)
+
+        self.pipeline = Pipeline()
+        self.vad_stage = self.pipeline.add_stage("vad", self.process_pcm, Connection.VAD_QUEUE_SIZE,
+                                                 idle=self.drain_backlog)
+        self.asr_stage = self.pipeline.add_stage("asr", self.process_asr, Connection.ASR_QUEUE_SIZE)
+        self.llm_stage = self.pipeline.add_stage("llm", self.process_llm, Connection.LLM_QUEUE_SIZE)
+        self.egress_stage = self.pipeline.add_stage("egress", self.process_egress, Connection.EGRESS_QUEUE_SIZE,
+                                                    idle=self.egress.flush)
+        # asr识别完成后不再在asr线程里直接跑llm，而是投递给llm阶段
+        self.asr.set_llm(StageSink(self.llm_stage, self.asr_stage))
+        # 猜测执行：中间结果稳定一段时间后提前启动llm，最终结果一致时沿用它的输出
+        speculative = config["main"].get("speculative")
+        self.speculator = Speculator(self.llm, **speculative) if speculative else None
+        if self.speculator:
+            self.asr.set_partial(lambda text: self.speculator.update(self.kws.strip(text)))
+        self.pipeline.start()
+        metrics.sessions.add(self)
+
+    def recv_into_decoder(self, size):
+        # 直接收进解码缓冲区，省掉一次bytes拷贝
+        self.socket.settimeout(Connection.RECV_TIMEOUT)
+        n = self.socket.recv_into(self.decoder.writable(size))
         self.socket.settimeout(None)
-        return ret
+        self.decoder.commit(n)
+        return n
 
-    def send(self, data, eof=0):
+    def response(self, data, eof=0):
         resp = Response()
         resp.eof = eof
         resp.length = len(data)
         resp.is_local |= self.asr.is_local() << Response.ASR_BIT
         resp.is_local |= self.llm.is_local() << Response.LLM_BIT
         resp.is_local |= self.tts.is_local() << Response.TTS_BIT
+        resp.data = data
+        return resp
+
+    def send(self, data, eof=0, turn=None):
+        resp = self.response(data, eof)
+        duration = 0
         if isinstance(data, bytes):
-            resp.type = Response.PCM_DATA
-            resp.data = data
+            if data:
+                self.latency.mark(turn or self.llm_stage.turn, "tts")
+                # 音量调整之后再重采样、编码
+                with self.encode_lock:
+                    if self.downlink:
+                        data = self.downlink.process(data)
+                    resp.data = self.encoder.encode(data)
+                resp.length = len(resp.data)
+            duration = self.egress.pcm_duration(len(data))
+            if data:
+                metrics.AUDIO_BYTES.inc(resp.length, direction="out", codec=self.encoder.name)
+            resp.type = Response.AUDIO_TYPES[self.encoder.name]
         else:
             resp.data = data.encode("utf-8")
             resp.type = Response.TOKEN
@@ -176,52 +348,268 @@ class Connection:
             except:
                 pass
         # print(resp)
-        self.socket.sendall(resp.to_bytes())
-
-    def process(self, data):
-        self.payload += data
-        while len(self.payload) > 0:
-            if self.decode_state == Connection.DECODE_HEADER:
-                if len(self.payload) < Request.HEADER_SIZE:
-                    return None
-                else:
-                    self.request = Request.from_bytes(self.payload[:Request.HEADER_SIZE])
-                    if self.request.magic != Request.MAGIC:
-                        print(f"Invalid magic number {self.request.magic}")
-                        raise ValueError(f"Invalid magic number {self.request.magic}")
-                    self.decode_state = Connection.DECODE_PAYLOAD
-            elif self.decode_state == Connection.DECODE_PAYLOAD:
-                if len(self.payload) < Request.HEADER_SIZE + self.request.length:
-                    return None
-                else:
-                    self.request.data = self.payload[Request.HEADER_SIZE:Request.HEADER_SIZE + self.request.length]
-                    self.payload = self.payload[Request.HEADER_SIZE + self.request.length:]
-                    self.process_request(self.request)
-                    self.request = None
-                    self.decode_state = Connection.DECODE_HEADER
+        # 默认归属llm阶段正在处理的那一轮，tts线程的输出也走这里
+        self.egress_stage.put((resp, duration), turn or self.llm_stage.turn)
+
+    def send_control(self, type, data=b'', turn=None):
+        resp = self.response(data)
+        resp.type = type
+        self.egress_stage.put((resp, 0), turn or self.pipeline.turn)
+
+    def cancel_turn(self, turn=None):
+        # llm已经结束时，回复可能还在egress里等待发送或在设备上播放
+        turn = turn or self.llm_stage.turn or self.egress.last_turn
+        if not turn:
+            return
+        print(f"--- CANCEL {turn} ---")
+        turn.cancel()
+        self.egress.wakeup()
+        if self.llm_stage.turn is turn:
+            self.llm.cancel()
+
+    def is_replying(self):
+        turn = self.llm_stage.turn
+        return (turn is not None and not turn.is_cancelled()) or self.egress.is_playing()
+
+    def barge_in(self):
+        """用户在播放过程中开口：取消正在回复的这一轮，并通知设备清空播放缓冲"""
+        self.barge_in_time = time.time()
+        print(f"--- BARGE-IN {self.llm_stage.turn} ---")
+        self.cancel_turn()
+        if self.barge_in_supported:
+            # 新一轮的控制帧，排在被取消的音频之后，egress会跳过它们尽快发出
+            self.send_control(Response.FLUSH)
+
+    def acknowledge(self):
+        """唤醒应答单独作为一轮发送，用户接着说话打断它时不影响这一句的识别"""
+        if not self.wake_ack:
+            return
+        pcm = self.tts.cached_audio(self.wake_ack)
+        if pcm is None:
+            print(f"--- WAKE ACK: {self.wake_ack} not cached yet ---")
+            return
+        # 帧头的长度字段只有16位，和流式合成一样按块发送
+        turn = Turn()
+        for i in range(0, len(pcm), PhraseCache.CHUNK):
+            self.send(pcm[i:i + PhraseCache.CHUNK], turn=turn)
+
+    def close(self):
+        if self.speculator:
+            self.speculator.reset()
+        self.llm.cancel()
+        self.pipeline.stop()
+        self.asr.close()
+        self.egress.close()
+        metrics.sessions.discard(self)
+
+    def process(self, data=None):
+        if data:
+            self.decoder.feed(data)
+        for req in self.decoder.frames():
+            self.process_request(req)
 
     def process_request(self, req):
+        # ingest阶段：在读socket的线程里只做解帧和攒块
         if req.type == Request.WAV_FORMAT:
             print(f"Received WAV format data: {len(req.data)} bytes")
             raise ValueError("WAV format not supported")
-        elif req.type == Request.PCM_FORMAT:
-            self.pending_pcm += req.data
-            if len(self.pending_pcm) >= self.pcm_chunk_size:
-                self.process_pcm(req.eof)
+        elif req.type == Request.PONG:
+            self.latency.clock.add(*PONG.unpack_from(req.data))
+        elif req.type == Request.EVENT:
+            event, device_us = EVENT.unpack_from(req.data)
+            if event == Request.EVENT_PLAYBACK_START:
+                self.latency.playback_started(self.egress.last_turn, device_us)
+            elif event == Request.EVENT_UNDERRUN:
+                self.latency.underrun(self.egress.last_turn, device_us)
+        elif req.type == Request.CREDIT:
+            self.egress.grant(CREDIT.unpack_from(req.data)[0])
+        elif req.type == Request.HELLO:
+            self.process_hello(json.loads(bytes(req.data)))
+        elif req.type in Request.AUDIO_FORMATS:
+            # 先解码成pcm，vad/kws/asr只处理pcm
+            decoder = self.decoders[req.type]
+            metrics.AUDIO_BYTES.inc(len(req.data), direction="in", codec=decoder.name)
+            if req.data:
+                # 只带eof的空帧不用解码
+                self.pending_pcm += decoder.decode(req.data)
+            if len(self.pending_pcm) >= Connection.VAD_CHUNK_SIZE or req.eof:
+                # 整块交给vad阶段，自己换一个新缓冲区，不拷贝；上行音频不随轮次取消
+                pcm, self.pending_pcm = self.pending_pcm, bytearray()
+                with self.backlog_lock:
+                    self.backlog.append((pcm, req.eof))
+                    self.backlog_bytes += len(pcm)
+                    self._drain_backlog()
+                    self._trim_backlog()
         else:
             raise ValueError(f"Unknown request type: {req.type}")
 
-        if req.eof:
-            self.process_pcm(True)
-            self.send(b'', True)
+    def drain_backlog(self):
+        """vad阶段队列取空时把积压的音频交给它"""
+        with self.backlog_lock:
+            self._drain_backlog()
+
+    def _drain_backlog(self):
+        # 不能阻塞：这里阻塞的话读socket的线程就收不到CREDIT，egress会一直等下去
+        while self.backlog and self.vad_stage.put_nowait(self.backlog[0], None):
+            pcm, _ = self.backlog.popleft()
+            self.backlog_bytes -= len(pcm)
+        if not self.backlog and self.dropping:
+            self.dropping = False
+            print(f"--- INGEST: vad stage caught up, {self.dropped_bytes} bytes of uplink audio dropped so far ---")
+
+    def _trim_backlog(self):
+        # 积压超过上限时丢掉最早的音频，eof保留下来，一句话照常结束
+        dropped = 0
+        for i in range(len(self.backlog)):
+            if self.backlog_bytes <= Connection.BACKLOG_SIZE:
+                break
+            pcm, eof = self.backlog[i]
+            if pcm:
+                self.backlog[i] = (bytearray(), eof)
+                self.backlog_bytes -= len(pcm)
+                dropped += len(pcm)
+        if dropped:
+            self.dropped_bytes += dropped
+            metrics.UPLINK_DROPPED_BYTES.inc(dropped)
+            if not self.dropping:
+                self.dropping = True
+                print(f"--- INGEST: vad stage is more than {Connection.BACKLOG_SIZE} bytes behind, "
+                      f"dropping the oldest uplink audio ---")
+
+    def process_hello(self, hello):
+        offered = hello.get("codecs", {})
+        if isinstance(offered, list):
+            offered = {"up": offered, "down": offered}
+        up = codec.negotiate(offered.get("up", []), self.codecs)
+        down = codec.negotiate(offered.get("down", []), self.codecs)
+        rate = hello.get("sample_rate", self.egress.sample_rate)
+        with self.encode_lock:
+            self.encoder = codec.create(down)
+            self.downlink = dsp.create(Connection.TTS_SAMPLE_RATE, None, rate)
+            self.egress.sample_rate = rate
+        window = hello.get("window", 0)
+        if window:
+            self.egress.set_window(window)
+        self.timestamps = bool(hello.get("timestamps", False))
+        self.barge_in_supported = bool(hello.get("barge_in", False))
+        print(f"--- HELLO: uplink {up}, downlink {down} {rate}Hz, window {window or 'none'}, "
+              f"timestamps {self.timestamps}, barge-in {self.barge_in_supported} ---")
+        self.send_control(Response.HELLO, json.dumps({"codecs": {"up": up, "down": down},
+                                                      "sample_rate": rate}).encode("utf-8"))
+        self.ping()
+
+    def ping(self):
+        # 时间戳由egress写出时填上
+        if self.timestamps:
+            self.send_control(Response.PING, bytes(PING.size))
+
+    def end_of_speech(self, turn):
+        self.latency.mark(turn, "speech_end", self.endpointer.last_speech_time)
+        self.latency.mark(turn, "endpoint")
+        # 每句话对一次时，跟踪时钟漂移
+        self.ping()
+
+    def process_pcm(self, turn, item):
+        # 轮次由vad阶段划分：一句话结束（服务端端点或设备eof）就开始新的一轮
+        pcm, is_finish = item
+        if self.uplink:
+            pcm = self.uplink.process(pcm)
+        if not self.kws.wakeup:
+            start = time.perf_counter()
+            pcm = self.kws.feed(pcm)
+            metrics.KWS_SECONDS.time(start)
+            if pcm is None:
+                if is_finish:
+                    self.kws.reset()
+                    self.asr_stage.put(None, self.pipeline.turn)
+                    self.pipeline.new_turn()
+                return
+            # 唤醒词之后的音频照常走端点检测，紧接着说的命令会立刻起音，预录保证不丢字头
+            self.endpointer.reset()
+            if self.is_replying():
+                # 播放音乐等回复过程中喊唤醒词也能打断
+                self.barge_in()
+            self.acknowledge()
+
+        # 只统计端点检测本身，不算下游队列的背压等待
+        vad_time = 0
+        start = time.perf_counter()
+        for audio, end in self.endpointer.stream(pcm):
+            vad_time += time.perf_counter() - start
+            self.utterance += audio
+            if end:
+                latency = (time.time() - self.endpointer.last_speech_time) * 1000
+                print(f"--- ENDPOINT {self.pipeline.turn}: end of speech detected {latency:.0f}ms after last voiced frame ---")
+                self.endpoint_time = time.time()
+                self.end_of_speech(self.pipeline.turn)
+                self.flush_utterance(True)
+                self.pipeline.new_turn()
+            elif len(self.utterance) >= self.pcm_chunk_size:
+                self.flush_utterance(False)
+            if (self.barge_in_ms and self.barge_in_supported and self.endpointer.state == Vad.SPEECH
+                    and self.endpointer.speech_ms >= self.barge_in_ms and self.is_replying()):
+                self.barge_in()
+            start = time.perf_counter()
+        metrics.VAD_SECONDS.observe(vad_time + time.perf_counter() - start)
+
+        if is_finish:
+            if self.endpointer.state == Vad.SPEECH:
+                self.utterance += self.endpointer.take_remainder()
+                latency = (time.time() - self.endpointer.last_speech_time) * 1000
+                print(f"--- device eof {self.pipeline.turn}: {latency:.0f}ms after last voiced frame ---")
+                self.end_of_speech(self.pipeline.turn)
+                self.flush_utterance(True)
+            elif self.endpoint_time:
+                print(f"--- device eof arrived {(time.time() - self.endpoint_time) * 1000:.0f}ms after server endpoint ---")
+            self.asr_stage.put(None, self.pipeline.turn)
+            self.pipeline.new_turn()
+            self.endpointer.reset()
+            self.endpoint_time = None
+
+    def flush_utterance(self, is_finish):
+        data, self.utterance = self.utterance, bytearray()
+        # data交出后不再修改，切片视图可以安全地跨线程传递
+        view = memoryview(data)
+        for i in range(0, len(data), self.pcm_chunk_size):
+            self.asr_stage.put((view[i:i + self.pcm_chunk_size], is_finish and (i + self.pcm_chunk_size >= len(data))), self.pipeline.turn)
+        if is_finish and not data:
+            self.asr_stage.put((b'', True), self.pipeline.turn)
+
+    def process_asr(self, turn, item):
+        if item is None:
+            # 设备的eof：这句话的识别结果已经在llm阶段排队，结束帧也交给llm阶段，等回复发完再发
+            self.llm_stage.put(None, turn)
+            return
+        pcm, is_finish = item
+        self.asr.send_audio_frame(pcm, is_finish)
 
-    def process_pcm(self, is_finish):
-        if not self.kws.is_wakeup(self.pending_pcm):
-            self.pending_pcm = b''
+    def process_llm(self, turn, text):
+        if text is None:
+            # 设备的eof，排在这一轮的回复之后
+            self.send(b'', True, turn)
+            return
+        self.latency.mark(turn, "asr")
+        if self.speculator:
+            self.speculator.reset()
+        self.llm.call(self.kws.strip(text))
+        # 回复的音频都已交给egress阶段，排在它们后面统计这一轮的发送情况
+        self.egress_stage.put(None, turn)
+        if turn.is_cancelled() and self.barge_in_time:
+            print(f"--- BARGE-IN {turn}: llm/tts stopped {(time.time() - self.barge_in_time) * 1000:.0f}ms after interrupt ---")
+
+    def process_egress(self, turn, item):
+        if item is None:
+            # 一轮回复结束：发出攒下的帧，报告这一轮的合并和限速情况
+            self.egress.flush()
+            self.egress.report()
             return
-        while len(self.pending_pcm) > 0:
-            self.asr.send_audio_frame(self.pending_pcm[0:self.pcm_chunk_size], is_finish and (len(self.pending_pcm) <= self.pcm_chunk_size))
-            self.pending_pcm = self.pending_pcm[self.pcm_chunk_size:]
+        resp, duration = item
+        self.egress.write(turn, resp, duration)
+        if resp.eof:
+            self.egress.flush()
+        if self.barge_in_time and resp.type == Response.FLUSH:
+            # 此前被取消的音频已全部跳过，设备收到flush即静音
+            print(f"--- BARGE-IN: device flushed {(time.time() - self.barge_in_time) * 1000:.0f}ms after interrupt ---")
 
 def load_config(fpath="config.yaml"):
     with open(fpath, 'r') as f:
@@ -230,8 +618,68 @@ def load_config(fpath="config.yaml"):
     print(json.dumps(config, indent=2, ensure_ascii=False))
     return config
 
+def create_connection(s, config):
+    # pcm(wav) -> asr(text) -> llm(text) -> tts(speech) -> socket
+    tts = TTS(None, config)
+    llm = LLM(tts, config)
+    asr = ASR(llm, config)
+
+    # for agent
+    LLM.init_agent(asr, llm, tts)
+
+    conn = Connection(s, asr, llm, tts, config=config)
+    tts.set_connection(conn)
+    return conn
+
+async def handle_device(reader, writer, config, executor, connection_factory=create_connection):
+    loop = asyncio.get_running_loop()
+    addr = writer.get_extra_info("peername")
+    print(f"Connected by {addr}")
+    conn = None
+    try:
+        # 创建provider会探测本地服务，同样是阻塞调用
+        conn = await loop.run_in_executor(executor, connection_factory, StreamSocket(loop, writer), config)
+        while True:
+            data = await asyncio.wait_for(reader.read(4096), Connection.RECV_TIMEOUT)
+            if not data:
+                print(f"Client {addr} disconnected.")
+                break
+            # 解码、上行dsp等放到有界执行器里跑以免占用事件循环；
+            # 同一设备的数据按顺序处理，处理完之前不再读socket
+            await loop.run_in_executor(executor, conn.process, data)
+    except Exception as e:
+        print(f"{addr}: {e!r}")
+    finally:
+        try:
+            if conn:
+                # 关闭asr长连接（dashscope的stop、websocket的close）可能阻塞数秒，不能卡住其他设备
+                await loop.run_in_executor(executor, conn.close)
+        finally:
+            writer.close()
+
+async def serve(config, connection_factory=create_connection):
+    host = config["main"]["host"]
+    port = config["main"]["port"]
+    workers = config["main"].get("workers", 32)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest") as executor:
+        server = await asyncio.start_server(
+            lambda r, w: handle_device(r, w, config, executor, connection_factory),
+            host, port, reuse_address=True)
+        print(f"Server (asyncio, {workers} workers) is listening on {host}:{port}...")
+        async with server:
+            await server.serve_forever()
+
 def main():
     config = load_config()
+    if config["main"].get("metrics"):
+        metrics.start_server(**config["main"]["metrics"])
+    # mcp server等工具在启动时初始化一次，所有设备共用
+    LLM.preload(config)
+    TTS.preload(config)
+    if config["main"].get("mode", "asyncio") == "asyncio":
+        asyncio.run(serve(config))
+        return
+
     host = config["main"]["host"]
     port = config["main"]["port"]
     # 创建 socket 对象 (IPv4, TCP)
@@ -254,29 +702,22 @@ def main():
                 client_socket, addr = server_socket.accept()
                 print(f"Connected by {addr}")
 
-                # pcm(wav) -> asr(text) -> llm(text) -> tts(speech) -> socket
-                tts = TTS(None, config)
-                llm = LLM(tts, config)
-                asr = ASR(llm, config)
-
-                # for agent
-                LLM.init_agent(asr, llm, tts)
-
-                conn = Connection(client_socket, asr, llm, tts, config=config)
-                tts.set_connection(conn)
+                conn = create_connection(client_socket, config)
 
                 while True:
-                    data = conn.recv(4096)
-                    if not data:
+                    if not conn.recv_into_decoder(4096):
                         print("Client disconnected.")
                         break
-                    conn.process(data)
+                    conn.process()
             except Exception as e:
                 # raise
                 print(e)
                 if client_socket:
                     client_socket.close()
                     client_socket = None
+            finally:
+                if conn:
+                    conn.close()
 
 if __name__ == '__main__':
     main()